@@ -11,6 +11,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from rest_framework import status
 from shopify_app.models import Client, SortingPlan, Subscription, BillingTokens, Usage
+from shopify_app.client import shopify_session, SHOPIFY_TIMEOUT
 import os
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
@@ -89,7 +90,7 @@ def execute_graphql(shop_url, access_token, query, variables=None):
         "query": query,
         "variables": variables or {}
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = shopify_session(shop_url).post(url, json=payload, headers=headers, timeout=SHOPIFY_TIMEOUT)
     response_data = response.json()
     
     if "errors" in response_data:
@@ -647,7 +648,7 @@ def create_one_time_charge(shop_url, access_token, charge_name, charge_price, re
         "returnUrl": return_url,
     }
 
-    response = requests.post(shopify_graphql_url, json={'query': mutation, 'variables': variables}, headers=headers)
+    response = shopify_session(shop_url).post(shopify_graphql_url, json={'query': mutation, 'variables': variables}, headers=headers, timeout=SHOPIFY_TIMEOUT)
     response_data = response.json()
     logger.debug(f"response.json : {response_data}")
 
@@ -0,0 +1,264 @@
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from .rules import epoch_key, epoch_micros
+
+############################################################################################
+# columnar rule engine: a collection is loaded once into typed NumPy columns and the sorting
+# rules of home/rules.py run as vectorized masks and stable argsorts over index arrays
+############################################################################################
+
+def _epoch_or_none(product: Dict, column: str):
+    key = epoch_key(column)
+    if key in product:
+        return product[key]
+    try:
+        return epoch_micros(product.get(column))
+    except (TypeError, ValueError):
+        return None
+
+
+class ProductColumns:
+    """
+    The products of a collection as typed columns, one row per product in the
+    order they were loaded:
+
+    - dates (created_at, published_at, updated_at) as float64 microseconds since
+      the epoch, exact until 2255, NaN when missing or unparseable. Products
+      loaded through normalize_timestamps are not parsed again;
+    - numbers (revenue, units, inventory, variant counts...) as float64, NaN
+      when missing.
+
+    - tags as an inverted index, tag -> rows of the products carrying it.
+
+    Columns are built on first use, so a collection only pays for the columns
+    its buckets read. Rules work on row indices; take() turns them back into
+    the product dicts.
+    """
+
+    def __init__(self, products: List[Dict]):
+        self.products = list(products)
+        self.product_ids = np.array([product.get("product_id") for product in self.products], dtype=object)
+        self._dates = {}
+        self._numbers = {}
+        self._tag_index = None
+
+    def date(self, column: str) -> np.ndarray:
+        if column not in self._dates:
+            # None becomes NaN
+            self._dates[column] = np.array(
+                [_epoch_or_none(product, column) for product in self.products], dtype=np.float64
+            )
+        return self._dates[column]
+
+    def number(self, column: str) -> np.ndarray:
+        if column not in self._numbers:
+            self._numbers[column] = np.array(
+                [np.nan if product.get(column) is None else float(product[column]) for product in self.products],
+                dtype=np.float64,
+            )
+        return self._numbers[column]
+
+    def tagged(self, tags) -> np.ndarray:
+        """Mask of the rows carrying any of the tags."""
+        if self._tag_index is None:
+            self._tag_index = {}
+            for row, product in enumerate(self.products):
+                for tag in set(product.get("tags") or ()):
+                    self._tag_index.setdefault(tag, []).append(row)
+        mask = np.zeros(len(self.products), dtype=bool)
+        for tag in set(tags or ()):
+            mask[self._tag_index.get(tag, [])] = True
+        return mask
+
+    def tagged_rows(self, tags, *excluded: np.ndarray) -> np.ndarray:
+        """Rows, in load order, carrying any of the tags and not in `excluded`."""
+        mask = self.tagged(tags)
+        for rows in excluded:
+            mask[rows] = False
+        return np.flatnonzero(mask)
+
+    def __len__(self):
+        return len(self.products)
+
+    def all_rows(self, *excluded: np.ndarray) -> "RowSet":
+        kept = np.ones(len(self.products), dtype=bool)
+        for rows in excluded:
+            kept[rows] = False
+        return RowSet(np.flatnonzero(kept))
+
+    def take(self, rows: np.ndarray) -> List[Dict]:
+        return [self.products[row] for row in rows]
+
+
+def _in_lookback(columns: ProductColumns, rows: np.ndarray, days: Optional[int], date_column: str = "created_at") -> np.ndarray:
+    if not days:
+        return np.ones(len(rows), dtype=bool)
+    lookback = epoch_micros(datetime.now(timezone.utc) - timedelta(days=days))
+    # NaN compares False, products without the date drop out
+    return columns.date(date_column)[rows] >= lookback
+
+
+class RowSet:
+    """
+    Rows still to be placed by the next buckets, in a lazy order: `rows` keep
+    the order they were loaded (or last fully ordered) in and `keys` hold the
+    sort keys of the capped buckets they went through, latest first, smallest
+    sorting first. The logical order is the one full stable sorts would have
+    left them in, it is only computed when something needs it (ordered()).
+    """
+
+    def __init__(self, rows: np.ndarray, keys: Tuple[np.ndarray, ...] = ()):
+        self.rows = rows
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.rows)
+
+    def order(self, selected: Optional[np.ndarray] = None) -> np.ndarray:
+        """Positions of the (selected) rows in logical order."""
+        positions = np.arange(len(self.rows)) if selected is None else selected
+        if not self.keys:
+            return positions
+        # lexsort is stable and takes its primary key last, load order breaks the last ties
+        return positions[np.lexsort(tuple(key[positions] for key in reversed(self.keys)))]
+
+    def ordered(self) -> np.ndarray:
+        return self.rows[self.order()]
+
+    def subset(self, mask: np.ndarray, key: Optional[np.ndarray] = None) -> "RowSet":
+        keys = self.keys if key is None else (key, *self.keys)
+        return RowSet(self.rows[mask], tuple(values[mask] for values in keys))
+
+
+def _top_positions(rowset: RowSet, capping: int) -> np.ndarray:
+    """
+    Positions of the first `capping` rows of the rowset in logical order,
+    without sorting the others: a partition on the primary key finds the
+    cut-off value and only the rows tied with it are ordered further.
+    """
+    primary = rowset.keys[0]
+    cutoff = np.partition(primary, capping - 1)[capping - 1]
+    ahead = np.flatnonzero(primary < cutoff)
+    tied = np.flatnonzero(primary == cutoff)
+    return np.concatenate([ahead, rowset.order(tied)[: capping - len(ahead)]])
+
+
+def _sort_by_number(column: str):
+    def rule(
+        columns: ProductColumns,
+        rows: np.ndarray,
+        days: Optional[int] = None,
+        date_type: Optional[int] = 0,
+        comparison_type: Optional[int] = 0,
+        inventory_threshold: Optional[int] = 0,
+        high_to_low: Optional[bool] = True,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        values = columns.number(column)[rows]
+        kept = _in_lookback(columns, rows, days) & ~np.isnan(values)
+        return kept, -values if high_to_low else values
+    return rule
+
+
+def new_products_columnar(
+    columns: ProductColumns,
+    rows: np.ndarray,
+    days: Optional[int] = None,
+    date_type: Optional[int] = 0,
+    comparison_type: Optional[int] = 0,
+    inventory_threshold: Optional[int] = 0,
+    high_to_low: Optional[bool] = True,
+) -> Tuple[np.ndarray, np.ndarray]:
+    date_column = {0: "created_at", 1: "published_at", 2: "updated_at"}.get(date_type, "created_at")
+    dates = columns.date(date_column)[rows]
+    kept = ~np.isnan(dates) & _in_lookback(columns, rows, days, date_column)
+    # newest first whatever high_to_low, as new_products does
+    return kept, -dates
+
+
+def product_inventory_columnar(
+    columns: ProductColumns,
+    rows: np.ndarray,
+    days: Optional[int] = None,
+    date_type: Optional[int] = 0,
+    comparison_type: Optional[int] = 0,
+    inventory_threshold: Optional[int] = 0,
+    high_to_low: Optional[bool] = True,
+) -> Tuple[np.ndarray, np.ndarray]:
+    inventory = columns.number("total_inventory")[rows]
+    comparisons = {
+        0: lambda values: values > inventory_threshold,
+        1: lambda values: values < inventory_threshold,
+        2: lambda values: values == inventory_threshold,
+        3: lambda values: values != inventory_threshold,
+    }
+    compare = comparisons.get(comparison_type, comparisons[0])
+    kept = _in_lookback(columns, rows, days) & ~np.isnan(inventory) & compare(inventory)
+    return kept, -inventory
+
+
+def product_tags_columnar(
+    columns: ProductColumns,
+    rows: np.ndarray,
+    days: Optional[int] = None,
+    is_equal_to: bool = True,
+    tags: Optional[List[str]] = None,
+) -> Tuple[np.ndarray, None]:
+    tagged = columns.tagged(tags)[rows]
+    kept = _in_lookback(columns, rows, days) & (tagged if is_equal_to else ~tagged)
+    # no sort, the tagged products keep their current order
+    return kept, None
+
+
+# rule name -> columnar implementation, same parameters as the rule in home/rules.py. Each returns
+# the mask of the rows the rule keeps and their sort key, smallest first, ties in the current order.
+# A None key keeps the current order
+COLUMNAR_RULES = {
+    "new_products": new_products_columnar,
+    "revenue_generated": _sort_by_number("total_revenue"),
+    "Number_of_sales": _sort_by_number("total_sold_units"),
+    "inventory_quantity": _sort_by_number("total_inventory"),
+    "variant_availability_ratio": _sort_by_number("variant_count"),
+    "product_inventory": product_inventory_columnar,
+    "product_tags": product_tags_columnar,
+}
+
+
+def evaluate_rule(
+    columns: ProductColumns,
+    remaining: RowSet,
+    rule_name: str,
+    rule_function: Callable,
+    capping: Optional[int] = None,
+    **parameters,
+) -> Tuple[np.ndarray, RowSet]:
+    """
+    Runs one bucket rule over the remaining rows, with its columnar implementation
+    when there is one and otherwise with `rule_function` on the product dicts.
+    A capped bucket only orders its top `capping` rows, the rest is handed on
+    unsorted with the bucket's key kept for the next bucket's ties.
+
+    Returns:
+        tuple: (capped rows in order, uncapped RowSet) with the meaning of the
+        rules' own (capped, uncapped) products.
+    """
+    columnar_rule = COLUMNAR_RULES.get(rule_name)
+    if columnar_rule is None:
+        rows = remaining.ordered()
+        products = columns.take(rows)
+        capped, uncapped = rule_function(products, capping=capping, **parameters)
+        row_of = {id(product): row for row, product in zip(rows, products)}
+        return (
+            np.array([row_of[id(product)] for product in capped], dtype=np.intp),
+            RowSet(np.array([row_of[id(product)] for product in uncapped], dtype=np.intp)),
+        )
+
+    kept, key = columnar_rule(columns, remaining.rows, **parameters)
+    candidates = remaining.subset(kept, key)
+    if not capping or capping >= len(candidates):
+        return candidates.ordered(), RowSet(remaining.rows[:0])
+
+    top = _top_positions(candidates, capping) if key is not None else candidates.order()[:capping]
+    uncapped = np.ones(len(candidates), dtype=bool)
+    uncapped[top] = False
+    return candidates.rows[candidates.order(top)], candidates.subset(uncapped)
@@ -4,10 +4,85 @@ from datetime import datetime, timedelta, timezone
 import json 
 from typing import List, Dict, Tuple, Optional
 
+import logging
+logger = logging.getLogger(__name__)
+
 ############################################################################################
 # sorting rules 
 ############################################################################################
 
+SORT_DATE_FIELDS = ('created_at', 'published_at', 'updated_at')
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def epoch_key(field: str) -> str:
+    return f'{field}_epoch'
+
+
+def epoch_micros(value) -> Optional[int]:
+    """
+    Microseconds since the epoch of a datetime or ISO 8601 string, naive datetimes
+    taken as UTC.
+
+    Raises:
+        ValueError, TypeError: If a string is not an ISO 8601 date.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = parser.isoparse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // MICROSECOND
+
+
+def normalize_timestamps(products, fields=SORT_DATE_FIELDS) -> List[Dict]:
+    """
+    Adds the epoch microseconds of each date field to the products, as
+    `<field>_epoch` (None when missing or unparseable), so the rules compare and
+    sort integers instead of parsing the dates again in every bucket.
+    """
+    products = list(products)
+    unparseable = {}
+    for product in products:
+        for field in fields:
+            try:
+                product[epoch_key(field)] = epoch_micros(product.get(field))
+            except (TypeError, ValueError) as e:
+                unparseable.setdefault(field, []).append((product.get('product_id'), e))
+                product[epoch_key(field)] = None
+
+    # one line per field, not per product
+    for field, errors in unparseable.items():
+        product_id, error = errors[0]
+        logger.warning(f"Could not parse {field} of {len(errors)} products, e.g. product {product_id}: {error}")
+    return products
+
+
+def _lookback_micros(days: Optional[int]) -> Optional[int]:
+    return epoch_micros(datetime.now(timezone.utc) - timedelta(days=days)) if days else None
+
+
+def _product_epoch(product: Dict, field: str = 'created_at') -> Optional[int]:
+    # the pre-parsed key from normalize_timestamps, parsing only products loaded without it
+    key = epoch_key(field)
+    if key in product:
+        return product[key]
+    try:
+        return epoch_micros(product[field])
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Error parsing {field} for product {product.get('product_id')}: {e}")
+        return None
+
+
+def _within_lookback(product: Dict, lookback: Optional[int], field: str = 'created_at') -> bool:
+    if lookback is None:
+        return True
+    product_epoch = _product_epoch(product, field)
+    return product_epoch is not None and product_epoch >= lookback
+
+
 # Updated and tested
 def new_products(
     products: List[Dict],
@@ -20,22 +95,19 @@ def new_products(
 ) -> Tuple[List[Dict], List[Dict]]:
     date_field_mapping = {0: 'created_at', 1: 'published_at', 2: 'updated_at'}
     date_field = date_field_mapping.get(date_type, 'created_at')
-    lookback_date = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    lookback = _lookback_micros(days)
 
     filtered_products = []
     for product in products:
         if isinstance(product, dict) and date_field in product and 'product_id' in product:
-            product_date = product[date_field]
-            try:
-                product_date_parsed = product_date if isinstance(product_date, datetime) else parser.isoparse(product_date)
-            except Exception as e:
-                print(f"Error parsing {date_field} for product {product['product_id']}: {e}")
+            product_epoch = _product_epoch(product, date_field)
+            if product_epoch is None:
                 continue
 
-            if lookback_date is None or product_date_parsed >= lookback_date:
-                filtered_products.append(product)
+            if lookback is None or product_epoch >= lookback:
+                filtered_products.append((product_epoch, product))
 
-    sorted_products = sorted(filtered_products, key=lambda p: p[date_field], reverse=True)
+    sorted_products = [product for _, product in sorted(filtered_products, key=lambda pair: pair[0], reverse=True)]
     capped_products = sorted_products[:capping] if capping else sorted_products
     uncapped_products = sorted_products[capping:] if capping else []
     return capped_products, uncapped_products
@@ -50,18 +122,12 @@ def revenue_generated(
     inventory_threshold: Optional[int] = 0,
     high_to_low: Optional[bool] = True
 ) -> Tuple[List[Dict], List[Dict]]:
-    lookback_date = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    lookback = _lookback_micros(days)
 
     filtered_products = []
     for product in products:
         if isinstance(product, dict) and 'total_revenue' in product and 'created_at' in product and 'product_id' in product:
-            try:
-                product_date = parser.isoparse(product['created_at']) if isinstance(product['created_at'], str) else product['created_at']
-            except Exception as e:
-                print(f"Error parsing created_at for product {product['product_id']}: {e}")
-                continue
-
-            if lookback_date is None or product_date >= lookback_date:
+            if _within_lookback(product, lookback):
                 filtered_products.append(product)
 
     sorted_products = sorted(filtered_products, key=lambda p: p['total_revenue'], reverse=high_to_low)
@@ -79,18 +145,12 @@ def Number_of_sales(
     inventory_threshold: Optional[int] = 0,
     high_to_low: Optional[bool] = True
 ) -> Tuple[List[Dict], List[Dict]]:
-    lookback_date = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    lookback = _lookback_micros(days)
 
     filtered_products = []
     for product in products:
         if isinstance(product, dict) and 'total_sold_units' in product and 'created_at' in product and 'product_id' in product:
-            try:
-                product_date = parser.isoparse(product['created_at']) if isinstance(product['created_at'], str) else product['created_at']
-            except Exception as e:
-                print(f"Error parsing created_at for product {product['product_id']}: {e}")
-                continue
-
-            if lookback_date is None or product_date >= lookback_date:
+            if _within_lookback(product, lookback):
                 filtered_products.append(product)
 
     sorted_products = sorted(filtered_products, key=lambda p: p['total_sold_units'], reverse=high_to_low)
@@ -108,18 +168,12 @@ def inventory_quantity(
     inventory_threshold: Optional[int] = 0,
     high_to_low: Optional[bool] = True
 ) -> Tuple[List[Dict], List[Dict]]:
-    lookback_date = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    lookback = _lookback_micros(days)
 
     filtered_products = []
     for product in products:
         if isinstance(product, dict) and 'total_inventory' in product and 'created_at' in product and 'product_id' in product:
-            try:
-                product_date = parser.isoparse(product['created_at']) if isinstance(product['created_at'], str) else product['created_at']
-            except Exception as e:
-                print(f"Error parsing created_at for product {product['product_id']}: {e}")
-                continue
-
-            if lookback_date is None or product_date >= lookback_date:
+            if _within_lookback(product, lookback):
                 filtered_products.append(product)
 
     sorted_products = sorted(filtered_products, key=lambda p: p['total_inventory'], reverse=high_to_low)
@@ -136,18 +190,12 @@ def variant_availability_ratio(
     inventory_threshold: int = 0,
     high_to_low: bool = True
 ) -> Tuple[List[Dict], List[Dict]]:
-    lookback_date = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    lookback = _lookback_micros(days)
 
     filtered_products = []
     for product in products:
         if isinstance(product, dict) and 'variant_count' in product and 'created_at' in product and 'product_id' in product:
-            try:
-                product_date = parser.isoparse(product['created_at']) if isinstance(product['created_at'], str) else product['created_at']
-            except Exception as e:
-                print(f"Error parsing created_at for product {product['product_id']}: {e}")
-                continue
-
-            if lookback_date is None or product_date >= lookback_date:
+            if _within_lookback(product, lookback):
                 filtered_products.append(product)
 
     sorted_products = sorted(filtered_products, key=lambda p: p['variant_count'], reverse=high_to_low)
@@ -172,18 +220,12 @@ def product_inventory(
     }
 
     comparison_function = comparison_mapping.get(comparison_type, comparison_mapping[0])
-    lookback_date = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    lookback = _lookback_micros(days)
 
     filtered_products = []
     for product in products:
         if isinstance(product, dict) and 'total_inventory' in product and 'created_at' in product and 'product_id' in product:
-            try:
-                product_date = parser.isoparse(product['created_at']) if isinstance(product['created_at'], str) else product['created_at']
-            except Exception as e:
-                print(f"Error parsing created_at for product {product['product_id']}: {e}")
-                continue
-
-            if (lookback_date is None or product_date >= lookback_date) and comparison_function(product):
+            if _within_lookback(product, lookback) and comparison_function(product):
                 filtered_products.append(product)
 
     sorted_products = sorted(filtered_products, key=lambda p: p['total_inventory'], reverse=True)
@@ -194,24 +236,19 @@ def product_inventory(
 
 # not using will deploy this after 7 # not tested but updated
 def product_tags(products: List[Dict], days: Optional[int] = None, is_equal_to: bool = True, tags: List[str] = [], capping: Optional[int] = None) -> Tuple[List[Dict], List[Dict]]:
-    lookback_date = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    lookback = _lookback_micros(days)
 
     filtered_products = []
     for product in products:
         if isinstance(product, dict) and 'tags' in product and 'created_at' in product and 'product_id' in product:
-            try:
-                product_date = parser.isoparse(product['created_at']) if isinstance(product['created_at'], str) else product['created_at']
-            except Exception as e:
-                print(f"Error parsing created_at for product {product['product_id']}: {e}")
-                continue
-
-            if lookback_date is None or product_date >= lookback_date:
+            if _within_lookback(product, lookback):
                 filtered_products.append(product)
 
+    tag_set = set(tags)
     if is_equal_to:
-        filtered_by_tags = [p for p in filtered_products if any(tag in p['tags'] for tag in tags)]
+        filtered_by_tags = [p for p in filtered_products if not tag_set.isdisjoint(p['tags'] or ())]
     else:
-        filtered_by_tags = [p for p in filtered_products if not any(tag in p['tags'] for tag in tags)]
+        filtered_by_tags = [p for p in filtered_products if tag_set.isdisjoint(p['tags'] or ())]
 
     capped_products = filtered_by_tags[:capping] if capping else filtered_by_tags
     uncapped_products = filtered_by_tags[capping:] if capping else []
@@ -319,3 +356,33 @@ def rfm_sort(products, days: int = None, capping: int = None, high_to_low: bool
     uncapped_products = sorted_products[capping:] if capping else []
 
     return capped_products, uncapped_products
+
+
+###############################################################
+# product fields each rule reads, as Shopify product query fields. The product fetch only
+# requests these (plus what the dashboard shows), see shopify_app.algo_plans.plan_product_fields
+
+RULE_PRODUCT_FIELDS = {
+    "new_products": ("createdAt", "publishedAt", "updatedAt"),
+    "revenue_generated": ("createdAt",),
+    "Number_of_sales": ("createdAt",),
+    "inventory_quantity": ("createdAt", "totalInventory"),
+    "variant_availability_ratio": ("createdAt", "variantsCount"),
+    "product_inventory": ("createdAt", "totalInventory"),
+    "product_tags": ("createdAt", "tags"),
+    "i_am_feeling_lucky": ("createdAt", "totalInventory", "variantsCount"),
+    "rfm_sort": ("createdAt",),
+}
+
+# rule name of a bucket -> rule function
+RULE_FUNCTIONS = {
+    "new_products": new_products,
+    "revenue_generated": revenue_generated,
+    "inventory_quantity": inventory_quantity,
+    "variant_availability_ratio": variant_availability_ratio,
+    "Number_of_sales": Number_of_sales,
+    "product_tags": product_tags,
+    "product_inventory": product_inventory,
+    "i_am_feeling_lucky": i_am_feeling_lucky,
+    "rfm_sort": rfm_sort,
+}
@@ -3,22 +3,21 @@ from dateutil import parser
 import pytz
 
 def promote_new(products, days: int = None, percentile: int = 100, variant_threshold: float = 0.0):
+    # listed_date parsed once per product, for both the filter and the sort key
     if days is not None:
         time_threshold = datetime.now(pytz.utc) - timedelta(days=days)
-        recent_products = [
-            p for p in products 
+        dated_products = [
+            (parser.isoparse(p['listed_date']), p) for p in products 
             if isinstance(p, dict) and 'listed_date' in p and 'id' in p 
             and isinstance(p['listed_date'], str)
-            and parser.isoparse(p['listed_date']) >= time_threshold
         ]
+        recent_products = [(listed, p) for listed, p in dated_products if listed >= time_threshold]
     else:
-        recent_products = products
+        recent_products = [(parser.isoparse(p['listed_date']), p) for p in products]
         
-    sorted_new_products = sorted(
-        recent_products, 
-        key=lambda x: parser.isoparse(x['listed_date']), 
-        reverse=True
-    )
+    sorted_new_products = [
+        p for _, p in sorted(recent_products, key=lambda pair: pair[0], reverse=True)
+    ]
     
     top_percent_index = max(1, len(sorted_new_products) * (percentile or 100) // 100)
     
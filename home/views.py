@@ -60,7 +60,10 @@ from shopify_app.tasks import (
     async_sort_product_order,
     async_fetch_and_store_collections,
     async_fetch_and_store_products,
+    async_apply_location_inventory,
 )
+from shopify_app.algo_plans import invalidate_algo_plan
+from django.db.models import F
 
 from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework_simplejwt.exceptions import TokenError
@@ -878,6 +881,8 @@ def update_collection(request, collection_id):
             try:
                 algo = ClientAlgo.objects.get(algo_id=algo_id)
                 collection.algo = algo
+                # the new algorithm may need product fields the last fetch skipped
+                collection.refetch = True
                 updated = True
                 logger.info("Updated algo for collection %s to %s", collection_id, algo_id)
             except ClientAlgo.DoesNotExist:
@@ -1729,11 +1734,16 @@ def update_all_algo(request, algo_id):
         if 'bucket_parameters' in data:
             logger.info("Updating bucket_parameters to %s", data['bucket_parameters'])
             client_algo.bucket_parameters = data['bucket_parameters']
+            # the new rules may need product fields the last fetch skipped
+            ClientCollections.objects.filter(algo=client_algo).update(refetch=True)
         if 'number_of_buckets' in data:
             logger.info("Updating number_of_buckets to %d", data['number_of_buckets'])
             client_algo.number_of_buckets = data['number_of_buckets']
 
+        # a new version makes the sort workers recompile their cached plan of this algorithm
+        client_algo.version = F('version') + 1
         client_algo.save()
+        invalidate_algo_plan(client_algo.algo_id)
 
         logger.info("Algorithm with algo_id %s successfully updated", algo_id)
 
@@ -2572,7 +2582,9 @@ def update_global_settings(request):
                     )
 
         # Update stock location if it's not an empty string
+        stock_location_changed = False
         if "stock_location" in data and data["stock_location"].strip():
+            stock_location_changed = client.stock_location != data["stock_location"]
             client.stock_location = data["stock_location"]
 
         # Update lookback period if it's a positive integer
@@ -2594,6 +2606,10 @@ def update_global_settings(request):
 
         client.save()
 
+        # recounts the stored inventory from the location cache, no product refetch
+        if stock_location_changed:
+            async_apply_location_inventory.delay(client.shop_id)
+
         return Response(
             {
                 "message": "Global settings updated successfully",
@@ -2698,7 +2714,8 @@ def get_and_update_collections(request):
 # ██████  ██ ███████ ███████ ██ ██   ████  ██████  ⁡
 #######################################################################################################
 
-from shopify_app.api import fetch_order_for_billing
+from shopify_app.api import get_monthly_order_count
+from shopify_app.tasks import async_meter_shop_orders
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -2721,17 +2738,18 @@ def fetch_last_month_order_count(request):
             logger.error("Shop URL not found for the user")
             return Response({"error": "Shop URL not found"}, status=status.HTTP_400_BAD_REQUEST)
 
-        today = datetime.today()
+        today = timezone.now().date()
         first_day_last_month = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
-        last_day_last_month = today.replace(day=1) - timedelta(days=1)
-        logger.debug(f"First and last dates of last month: {first_day_last_month} - {last_day_last_month}")
+        logger.debug(f"First day of last month: {first_day_last_month}")
 
-        order_count = fetch_order_for_billing(shop_url, first_day_last_month, last_day_last_month)
-        logger.debug(f"Fetched order count: {order_count}")
+        # counted by the metering task, never against Shopify inside the request
+        order_count = get_monthly_order_count(user.shop_id, first_day_last_month)
+        logger.debug(f"Metered order count: {order_count}")
 
         if order_count is None:
-            logger.error("Error fetching orders for billing")
-            return Response({"error": "Error fetching orders"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            logger.info("Order count not metered yet, metering queued")
+            async_meter_shop_orders.delay(user.shop_id)
+            return Response({"message": "Order count is being computed"}, status=status.HTTP_202_ACCEPTED)
 
         return Response({"order_count": order_count}, status=status.HTTP_200_OK)
 
@@ -0,0 +1,181 @@
+import inspect
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Mapping, Optional, Tuple
+from home.rules import RULE_FUNCTIONS, RULE_PRODUCT_FIELDS
+from .models import ClientAlgo
+
+import logging
+logger = logging.getLogger(__name__)
+
+#####################################################################################################
+# algorithm plans: a ClientAlgo compiled once into an immutable, validated execution plan, cached per
+# process and recompiled when the row's version changes
+#####################################################################################################
+
+# date fields each rule compares, the sort loader parses only these (see home.rules.normalize_timestamps)
+NEW_PRODUCTS_DATE_FIELDS = {0: "created_at", 1: "published_at", 2: "updated_at"}
+RULE_DATE_FIELDS = {
+    "revenue_generated": ("created_at",),
+    "Number_of_sales": ("created_at",),
+    "inventory_quantity": ("created_at",),
+    "variant_availability_ratio": ("created_at",),
+    "product_inventory": ("created_at",),
+    "product_tags": ("created_at",),
+    "i_am_feeling_lucky": ("created_at",),
+    "rfm_sort": (),
+}
+
+# product fields the fetch can query, in the order of api.PRODUCT_FIELD_SELECTIONS
+PRODUCT_FIELDS = (
+    "id", "title", "totalInventory", "createdAt", "publishedAt", "updatedAt", "tags", "images", "variantsCount", "variants",
+)
+# read by the dashboard and by the sort pipeline itself (pinning, boost/bury tags,
+# out of stock push down, the lookback filter of every rule) whatever the algorithm,
+# updatedAt and totalInventory also make the product fingerprint
+BASE_PRODUCT_FIELDS = ("id", "title", "images", "totalInventory", "tags", "createdAt", "updatedAt")
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+class AlgoPlanError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class BucketPlan:
+    rule_name: str
+    rule_function: Callable
+    capping: Optional[int]
+    parameters: Mapping
+
+
+@dataclass(frozen=True)
+class AlgoPlan:
+    algo_id: int
+    version: int
+    boost_tags: Tuple[str, ...]
+    bury_tags: Tuple[str, ...]
+    buckets: Tuple[BucketPlan, ...]
+    date_fields: Tuple[str, ...]
+    product_fields: Tuple[str, ...]
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _capping(value, rule_name):
+    if value in (None, 0, ""):
+        return None
+    try:
+        capping = int(value)
+    except (TypeError, ValueError):
+        raise AlgoPlanError(f"capping of {rule_name} must be a number, got {value!r}")
+    if capping < 0:
+        raise AlgoPlanError(f"capping of {rule_name} must be positive, got {capping}")
+    return capping or None
+
+
+def plan_product_fields(buckets):
+    """
+    Plans the product fields to query for a collection sorted with `buckets`:
+    the base fields plus the fields the rules of its buckets declare in RULE_PRODUCT_FIELDS.
+
+    Returns:
+        tuple: Names from PRODUCT_FIELDS, every field if a rule is unknown.
+    """
+    fields = set(BASE_PRODUCT_FIELDS)
+    for bucket in buckets:
+        rule_fields = RULE_PRODUCT_FIELDS.get(bucket.get("rule_name"))
+        if rule_fields is None:
+            return PRODUCT_FIELDS
+        fields.update(rule_fields)
+    return tuple(field for field in PRODUCT_FIELDS if field in fields)
+
+
+def compile_algo(client_algo):
+    """
+    Compiles a ClientAlgo into an AlgoPlan: buckets normalized to a list, rule
+    functions resolved, capping split from the rule parameters, the
+    parameters checked against the rule's signature and the product fields
+    and date fields the rules read planned. The stored
+    bucket_parameters are not modified.
+
+    Buckets with an unknown rule are left out, as the sort always did.
+
+    Raises:
+        AlgoPlanError: If a bucket's capping or parameters don't fit its rule.
+    """
+    buckets = client_algo.bucket_parameters or []
+    if isinstance(buckets, dict):
+        buckets = [buckets]
+
+    bucket_plans = []
+    date_fields = set()
+    for bucket in buckets:
+        rule_name = bucket.get("rule_name")
+        rule_function = RULE_FUNCTIONS.get(rule_name)
+        if rule_function is None:
+            logger.warning(f"No sort function found for rule: {rule_name} (algo {client_algo.algo_id})")
+            continue
+
+        parameters = dict(bucket.get("parameters") or {})
+        capping = _capping(parameters.pop("capping", None), rule_name)
+        try:
+            inspect.signature(rule_function).bind(None, capping=capping, **parameters)
+        except TypeError as e:
+            raise AlgoPlanError(f"Invalid parameters for {rule_name}: {e}")
+
+        bucket_plans.append(BucketPlan(rule_name, rule_function, capping, _freeze(parameters)))
+        if rule_name == "new_products":
+            date_fields.add(NEW_PRODUCTS_DATE_FIELDS.get(parameters.get("date_type"), "created_at"))
+        else:
+            date_fields.update(RULE_DATE_FIELDS.get(rule_name, ("created_at",)))
+
+    return AlgoPlan(
+        algo_id=client_algo.algo_id,
+        version=client_algo.version,
+        boost_tags=tuple(client_algo.boost_tags or ()),
+        bury_tags=tuple(client_algo.bury_tags or ()),
+        buckets=tuple(bucket_plans),
+        date_fields=tuple(sorted(date_fields)),
+        product_fields=plan_product_fields(buckets) if client_algo.bucket_parameters is not None else PRODUCT_FIELDS,
+    )
+
+
+def algo_plan(algo_id):
+    """
+    Returns the compiled plan of an algorithm, from the process cache when it
+    was compiled from the current version of the row. Only the version is read
+    from the database on a cache hit.
+
+    Raises:
+        ClientAlgo.DoesNotExist: If there is no such algorithm.
+        AlgoPlanError: If the algorithm does not compile.
+    """
+    version = ClientAlgo.objects.filter(algo_id=algo_id).values_list("version", flat=True).first()
+    if version is None:
+        raise ClientAlgo.DoesNotExist(f"ClientAlgo {algo_id} does not exist")
+
+    plan = _plans.get(algo_id)
+    if plan is not None and plan.version == version:
+        return plan
+
+    plan = compile_algo(ClientAlgo.objects.get(algo_id=algo_id))
+    with _plans_lock:
+        _plans[algo_id] = plan
+    logger.debug(f"compiled algo {algo_id} version {plan.version}: {len(plan.buckets)} buckets")
+    return plan
+
+
+def invalidate_algo_plan(algo_id):
+    """Drops the cached plan of an algorithm from this process."""
+    with _plans_lock:
+        _plans.pop(algo_id, None)
@@ -1,69 +1,109 @@
-import requests
+import asyncio
+import hashlib
 import json
+import queue
+import threading
+from bisect import bisect_left
 import shopify
 from django.apps import apps
-from .models import Client, Usage
+from .models import (
+    Client, Usage, ClientCollections, ClientProducts, OrderSyncState, ProductDailySales, ShopOrderCount,
+    ReorderJob, History, ClientAlgo,
+)
+from . import throttle
+from .algo_plans import algo_plan, AlgoPlanError
+from .client import shopify_graphql, shopify_rest, admin_api_url, AsyncShopifyClient, ShopifyRequestError, SHOPIFY_POOL_SIZE
+from .bulk import (
+    use_bulk_operations,
+    fetch_bulk_collections,
+    fetch_bulk_collection_products,
+    fetch_bulk_orders,
+)
 from datetime import datetime
 import pytz
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.db import transaction
+from django.db.models import Sum, Max, F
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
 from home.email import order_not_found
 
 import logging
 logger = logging.getLogger(__name__)
 
+# the shop order cache and what is derived from it, see CACHES in settings
+order_cache = ConnectionProxy(caches, "orders")
+
 from celery import shared_task
 
 def _get_shopify_headers(access_token):
     return {"Content-Type": "application/json", "X-Shopify-Access-Token": access_token}
 
+COLLECTIONS_QUERY = """
+query($after: String) {
+    collections(first: 250, after: $after) {
+        edges {
+            cursor
+            node {
+                id
+                title
+                updatedAt
+                productsCount {
+                    count
+                }
+                ruleSet {
+                    appliedDisjunctively
+                }
+            }
+        }
+        pageInfo {
+            hasNextPage
+        }
+    }
+}
+"""
+
+def _collection_row(node):
+    # only smart (automatic) collections have a rule set
+    return {
+        "id": node["id"],
+        "title": node["title"],
+        "products_count": node["productsCount"]["count"],
+        "updated_at": node["updatedAt"],
+        "type": "Automatic Collection" if node.get("ruleSet") else "Manual Collection",
+    }
+
 def fetch_collections(shop_url):
+    """
+    Lists the collections of a shop with their product count, last update and
+    type, in one paginated query (or one bulk operation for very large shops).
+    """
     client = _get_client(shop_url)
     if not client:
         return []
     
     access_token = client.access_token
-    api_version = apps.get_app_config("shopify_app").SHOPIFY_API_VERSION
     headers = _get_shopify_headers(access_token)
 
-    url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
-    rest_url = f"https://{shop_url}/admin/api/{api_version}/smart_collections.json"
+    if use_bulk_operations(ClientCollections.objects.filter(shop_id=client.shop_id).count()):
+        return [_collection_row(collection) for collection in fetch_bulk_collections(shop_url, headers)]
+
     collections = []
     has_next_page = True
     cursor = None
 
     while has_next_page:
-        query = """
-        query($after: String) {
-            collections(first: 250, after: $after) {
-                edges {
-                    cursor
-                    node {
-                        id
-                        title
-                        updatedAt
-                        productsCount {
-                            count
-                        }
-                    }
-                }
-                pageInfo {
-                    hasNextPage
-                }
-            }
-        }
-        """
-
         variables = {"after": cursor} if cursor else {}
-        response = requests.post(url, json={"query": query, "variables": variables}, headers=headers)
+        response = shopify_graphql(shop_url, headers, COLLECTIONS_QUERY, variables)
 
-        
         if response.status_code == 200:
             data = response.json()
             logger.debug(f"graphql data : {data}")
             new_collections = data.get("data", {}).get("collections", {}).get("edges", [])
-            collections.extend(new_collections)
+            collections.extend(_collection_row(collection["node"]) for collection in new_collections)
             page_info = data.get("data", {}).get("collections", {}).get("pageInfo", {})
             has_next_page = page_info.get("hasNextPage", False)
             if has_next_page:
@@ -71,27 +111,8 @@ def fetch_collections(shop_url):
         else:
             print(f"Error fetching collections: {response.status_code} - {response.text}")
             break
-        
-    rest_response = requests.get(rest_url, headers=headers)
-    automatic_collection_ids = set()
-    if rest_response.status_code == 200:
-        rest_data = rest_response.json()
-        for collection in rest_data.get("smart_collections", []):
-            automatic_collection_ids.add(collection["id"])
-    else:
-        logger.error(f"Error fetching smart collections: {rest_response.status_code} - {rest_response.text}")
-        
-        
-    return [
-        {
-            "id": collection["node"]["id"],
-            "title": collection["node"]["title"],
-            "products_count": collection["node"]["productsCount"]["count"],
-            "updated_at": collection["node"]["updatedAt"],
-            "type": "Automatic Collection" if int(collection["node"]["id"].split("/")[-1]) in automatic_collection_ids else "Manual Collection",
-        }
-        for collection in collections
-    ]
+
+    return collections
 
 def fetch_products_by_collection_with_img(shop_url, collection_id): #will remove later
     """
@@ -109,11 +130,7 @@ def fetch_products_by_collection_with_img(shop_url, collection_id): #will remove
         return []
 
     access_token = client.access_token
-    api_version = apps.get_app_config("shopify_app").SHOPIFY_API_VERSION
     headers = _get_shopify_headers(access_token)
-   
-
-    url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
 
     query = f"""
     {{
@@ -139,7 +156,7 @@ def fetch_products_by_collection_with_img(shop_url, collection_id): #will remove
     }}
     """
 
-    response = requests.post(url, json={"query": query}, headers=headers)
+    response = shopify_graphql(shop_url, headers, query)
     if response.status_code == 200:
         data = response.json()
         products = (
@@ -164,74 +181,128 @@ def fetch_products_by_collection_with_img(shop_url, collection_id): #will remove
         return []
 
 ##########################
+PRODUCT_PAGE_SIZE = 250
+
+# selection of each product field the fetch can request; bulk queries take no `first` on
+# nested connections and return the first image as featuredImage
+PRODUCT_FIELD_SELECTIONS = {
+    "id": "id",
+    "title": "title",
+    "totalInventory": "totalInventory",
+    "createdAt": "createdAt",
+    "publishedAt": "publishedAt",
+    "updatedAt": "updatedAt",
+    "tags": "tags",
+    "images": "images(first: 1) { edges { node { src altText } } }",
+    "variantsCount": "variantsCount { count }",
+    "variants": "variants(first: 10) { edges { node { id price compareAtPrice inventoryQuantity } } }",
+}
+BULK_PRODUCT_FIELD_SELECTIONS = {
+    **PRODUCT_FIELD_SELECTIONS,
+    "images": "featuredImage { src altText }",
+    "variants": "variants { edges { node { id price compareAtPrice inventoryQuantity } } }",
+}
+
+def collection_product_fields(algo_id):
+    """
+    The product fields to query for a collection sorted with `algo_id`, compiled
+    into the algorithm's plan (see algo_plans.plan_product_fields). Every field
+    when the collection has no algorithm or it does not compile.
+    """
+    if algo_id is None:
+        return list(PRODUCT_FIELD_SELECTIONS)
+    try:
+        return list(algo_plan(algo_id).product_fields)
+    except (ClientAlgo.DoesNotExist, AlgoPlanError) as e:
+        logger.warning(f"Fetching every product field, no plan for algo {algo_id}: {e}")
+        return list(PRODUCT_FIELD_SELECTIONS)
+
+def product_selection(fields, bulk=False):
+    selections = BULK_PRODUCT_FIELD_SELECTIONS if bulk else PRODUCT_FIELD_SELECTIONS
+    return "\n".join(selections[field] for field in fields)
+
+def collection_products_query(collection_id, selection):
+    return f"""
+    query($after: String) {{
+        collection(id: "gid://shopify/Collection/{collection_id}") {{
+            products(first: {PRODUCT_PAGE_SIZE}, after: $after) {{
+                edges {{
+                    cursor
+                    node {{
+                        {selection}
+                    }}
+                }}
+                pageInfo {{
+                    hasNextPage
+                }}
+            }}
+        }}
+    }}
+    """
+
 def fetch_products_by_collection(shop_url, collection_id, days):
+    return [
+        product
+        for page in iter_products_by_collection(shop_url, collection_id, days)
+        for product in page
+    ]
+
+def iter_products_by_collection(shop_url, collection_id, days, order_index=None):
+    """
+    Yields the products of a collection one page at a time, already enriched from
+    the order index, so callers can store a page before the next one is requested
+    and memory stays flat whatever the collection size.
+
+    Only the product fields planned for the collection's algorithm are requested,
+    the products miss the keys of the other fields.
+
+    Args:
+        order_index (dict): The shop's order index when the caller already built it,
+            see get_product_order_index.
+
+    Yields:
+        list: Up to PRODUCT_PAGE_SIZE product dicts as built by build_product_data.
+    """
     logger.debug("fetch products api running start")
     client = _get_client(shop_url)
     if not client:
-        return []
+        return
 
     access_token = client.access_token
-    api_version = apps.get_app_config("shopify_app").SHOPIFY_API_VERSION
     headers = _get_shopify_headers(access_token)
 
-    orders = fetch_orders(shop_url, days, headers)
-    logger.debug("orders fetching done")
+    if order_index is None:
+        order_index = get_product_order_index(client, days, headers)
+        logger.debug(f"order index ready for {len(order_index)} products")
+
+    collection = (
+        ClientCollections.objects.filter(collection_id=collection_id)
+        .values("products_count", "algo_id")
+        .first()
+    ) or {}
+    products_count = collection.get("products_count")
+    fields = collection_product_fields(collection.get("algo_id"))
+    logger.debug(f"product fields planned for collection {collection_id}: {fields}")
+
+    if use_bulk_operations(products_count):
+        logger.debug(f"fetching {products_count} products of collection {collection_id} with a bulk operation")
+        page = []
+        for node in fetch_bulk_collection_products(shop_url, headers, collection_id, product_selection(fields, bulk=True)):
+            page.append(build_product_data(node, order_index))
+            if len(page) == PRODUCT_PAGE_SIZE:
+                yield page
+                page = []
+        if page:
+            yield page
+        return
 
-    product_sales_data = {}
-    
-    url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
-    products = []
     has_next_page = True
     cursor = None
+    query = collection_products_query(collection_id, product_selection(fields))
 
     while has_next_page:
-        query = f"""
-        query($after: String) {{
-            collection(id: "gid://shopify/Collection/{collection_id}") {{
-                products(first: 250, after: $after) {{
-                    edges {{
-                        cursor
-                        node {{
-                            id
-                            title
-                            totalInventory
-                            createdAt
-                            publishedAt
-                            updatedAt
-                            tags
-                            images(first: 1) {{
-                                edges {{
-                                    node {{
-                                        src
-                                        altText
-                                    }}
-                                }}
-                            }}
-                            variantsCount {{  
-                                count
-                            }}
-                            variants(first: 10) {{
-                                edges {{
-                                    node {{
-                                        id
-                                        price
-                                        compareAtPrice
-                                        inventoryQuantity
-                                    }}
-                                }}
-                            }}
-                        }}
-                    }}
-                    pageInfo {{
-                        hasNextPage
-                    }}
-                }}
-            }}
-        }}
-        """
-
         variables = {"after": cursor} if cursor else {}
-        response = requests.post(url, json={"query": query, "variables": variables}, headers=headers)
+        response = shopify_graphql(shop_url, headers, query, variables)
         # logger.debug(response.json())
 
         if response.status_code == 200:
@@ -239,14 +310,13 @@ def fetch_products_by_collection(shop_url, collection_id, days):
             if not data:
                 logger.error("No products data available.")
                 order_not_found(response.json(), shop_url)
-                return []
+                return
             new_products = (
                 data.get("data", {})
                 .get("collection", {})
                 .get("products", {})
                 .get("edges", [])
             )
-            products.extend(new_products)
             page_info = (
                 data.get("data", {})
                 .get("collection", {})
@@ -256,63 +326,294 @@ def fetch_products_by_collection(shop_url, collection_id, days):
             has_next_page = page_info.get("hasNextPage", False)
             if has_next_page:
                 cursor = new_products[-1]["cursor"]
+
+            page = [build_product_data(product["node"], order_index) for product in new_products]
+            # drop the raw page before the caller stores this one
+            del data, new_products, response
+            yield page
         else:
             print(f"Error fetching products: {response.status_code} - {response.text}")
             break
 
-    products_data = []
-    for product in products:
-        product_id = product["node"]["id"].split("/")[-1]
+SHOP_FETCH_QUEUE_PAGES = 20
+SHOP_FETCH_PUT_TIMEOUT = 0.5
+_FETCH_DONE = object()
+
+def iter_shop_product_pages(client, collection_ids, days):
+    """
+    Shop-level fetch coordinator: yields the product pages of many collections of
+    one shop, with the collections paged concurrently over the shop's pooled async
+    client and one order index shared by all of them.
+
+    At most as many collections are in flight as the shop's throttle bucket can
+    serve at once, see throttle.concurrency_limit. Pages are handed over through
+    a bounded queue, so the caller stores them as they arrive and memory stays
+    flat. Collections large enough for a bulk operation are fetched afterwards,
+    one at a time as Shopify requires.
+
+    Yields:
+        tuple: (collection_id, page) with pages as built by build_product_data,
+        or (collection_id, None) once if the collection could not be fetched.
+
+    Raises:
+        OrderFetchError: If the orders of the shop could not be downloaded.
+    """
+    headers = _get_shopify_headers(client.access_token)
+    order_index = get_product_order_index(client, days, headers)
+    logger.debug(f"order index ready for {len(order_index)} products of {client.shop_url}")
+
+    collections = ClientCollections.objects.filter(shop_id=client.shop_id, collection_id__in=collection_ids).values(
+        "collection_id", "products_count", "algo_id"
+    )
+    queries = {}
+    bulk_collection_ids = []
+    for collection in collections:
+        if use_bulk_operations(collection["products_count"]):
+            bulk_collection_ids.append(collection["collection_id"])
+        else:
+            fields = collection_product_fields(collection["algo_id"])
+            queries[collection["collection_id"]] = collection_products_query(collection["collection_id"], product_selection(fields))
+
+    if queries:
+        concurrency = throttle.concurrency_limit(client.shop_url, queries.values(), SHOPIFY_POOL_SIZE)
+        logger.debug(f"fetching {len(queries)} collections of {client.shop_url}, {concurrency} at a time")
+
+        pages = queue.Queue(maxsize=SHOP_FETCH_QUEUE_PAGES)
+        stop = threading.Event()
+
+        def _put(item):
+            # gives up once the caller stopped reading, a full queue would block the producer forever
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=SHOP_FETCH_PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        async def _fetch_collection(shopify, slots, collection_id, query):
+            async with slots:
+                cursor = None
+                try:
+                    while not stop.is_set():
+                        body = await shopify.graphql(query, {"after": cursor} if cursor else {})
+                        products = ((body.get("data") or {}).get("collection") or {}).get("products")
+                        if products is None:
+                            raise ShopifyRequestError(200, body.get("errors"))
+
+                        edges = products["edges"]
+                        page = [build_product_data(edge["node"], order_index) for edge in edges]
+                        if not await asyncio.to_thread(_put, (collection_id, page)):
+                            return
+
+                        if not edges or not products["pageInfo"]["hasNextPage"]:
+                            return
+                        cursor = edges[-1]["cursor"]
+                except Exception as e:
+                    logger.error(f"Error fetching products of collection {collection_id}: {str(e)}")
+                    await asyncio.to_thread(_put, (collection_id, None))
+
+        async def _fetch_all():
+            slots = asyncio.Semaphore(concurrency)
+            async with AsyncShopifyClient(client.shop_url, headers, concurrency) as shopify:
+                await asyncio.gather(*(
+                    _fetch_collection(shopify, slots, collection_id, query)
+                    for collection_id, query in queries.items()
+                ))
+
+        def _run():
+            try:
+                asyncio.run(_fetch_all())
+            except Exception as e:
+                logger.error(f"Collection fetch of {client.shop_url} stopped: {str(e)}")
+            finally:
+                _put(_FETCH_DONE)
+
+        threading.Thread(target=_run, daemon=True).start()
+        try:
+            while (item := pages.get()) is not _FETCH_DONE:
+                yield item
+        finally:
+            # unblock the producers if the caller stopped early
+            stop.set()
+            while not pages.empty():
+                pages.get_nowait()
+
+    for collection_id in bulk_collection_ids:
+        try:
+            for page in iter_products_by_collection(client.shop_url, collection_id, days, order_index):
+                yield collection_id, page
+        except Exception as e:
+            logger.error(f"Error fetching products of collection {collection_id}: {str(e)}")
+            yield collection_id, None
 
-        recency_score = calculate_recency_score(orders, product["node"]["id"])
-        print("recency score : ", recency_score)
-        revenue = calculate_revenue_from_orders(orders, product["node"]["id"])
-        sales_velocity = calculate_sales_velocity_from_orders(orders, product["node"]["id"], days)
-        total_sold_units =  calculate_sales_velocity_from_orders(orders, product["node"]["id"], days, return_units=True)
+def product_fingerprint(node):
+    """
+    Changes whenever the product changed in Shopify (updatedAt), its inventory
+    changed (which does not touch updatedAt) or a different set of fields was
+    fetched for it.
+    """
+    fields = ",".join(sorted(key for key in node if not key.startswith("__")))
+    return hashlib.md5(f"{node['updatedAt']}|{node['totalInventory']}|{fields}".encode("utf-8")).hexdigest()
 
+def build_product_data(node, order_index):
+    """
+    Turns a product node of the product query into the dict stored as ClientProducts,
+    enriched with the product's metrics from the order index. Fields the query did not
+    select are left out, so the stored values of those columns are kept.
+    """
+    metrics = order_index.get(node["id"], EMPTY_ORDER_METRICS)
+
+    product = {
+        "id": node["id"].split("/")[-1],
+        "revenue": metrics["revenue"],
+        "sales_velocity": metrics["sales_velocity"],
+        "total_sold_units": metrics["total_sold_units"],
+        "recency_score": metrics["recency_score"],
+    }
+    if "title" in node:
+        product["title"] = node["title"]
+    if "images" in node:
+        product["image"] = node["images"]["edges"][0]["node"]["src"] if node["images"]["edges"] else None
+    if "totalInventory" in node:
+        product["totalInventory"] = node["totalInventory"]
+    if "createdAt" in node:
+        product["listed_date"] = node["createdAt"]
+    if "publishedAt" in node:
+        product["published_at"] = node["publishedAt"]
+    if "updatedAt" in node:
+        product["updated_at"] = node["updatedAt"]
+    if "tags" in node:
+        product["tags"] = node["tags"]
+    if "variantsCount" in node:
+        product["variants_count"] = node["variantsCount"]["count"]
+
+    if "updatedAt" in node and "totalInventory" in node:
+        product["fingerprint"] = product_fingerprint(node)
+
+    if "variants" in node:
         discount_percentage = 0.0
-        for variant in product["node"]["variants"]["edges"]:
+        discount_absolute = 0.0
+        for variant in node["variants"]["edges"]:
             price = float(variant["node"]["price"])
             compare_at_price = float(variant["node"].get("compareAtPrice") or 0)
-            print(price , compare_at_price)
+            discount_absolute = compare_at_price - price
             if compare_at_price > price:
                 discount_percentage = ((compare_at_price - price) / compare_at_price) * 100
-                break  
-
-        products_data.append({
-            "id": product_id,
-            "title": product["node"]["title"],
-            "image": product["node"]["images"]["edges"][0]["node"]["src"] if product["node"]["images"]["edges"] else None,
-            "totalInventory": product["node"]["totalInventory"],
-            "listed_date": product["node"]["createdAt"],
-            "published_at": product["node"]["publishedAt"],
-            "updated_at": product["node"]["updatedAt"],
-            "tags": product["node"].get("tags", []),
-            "revenue": revenue,
-            "sales_velocity": sales_velocity,
-            "total_sold_units": total_sold_units,
-            "variants_count": product["node"]["variantsCount"]["count"],
-            "variant_availability": sum(
-                variant["node"]["inventoryQuantity"]
-                for variant in product["node"]["variants"]["edges"]
-            ),
-            "recency_score": recency_score,
-            "discount_absolute": compare_at_price-price,
-            "discount_percentage": discount_percentage
-        })
+                break
 
-    return products_data
+        product["variant_availability"] = sum(
+            variant["node"]["inventoryQuantity"]
+            for variant in node["variants"]["edges"]
+        )
+        product["discount_absolute"] = discount_absolute
+        product["discount_percentage"] = discount_percentage
 
-def fetch_orders(shop_url, days, headers):
+    return product
+
+LINE_ITEM_PAGE_SIZE = 250
+# orders aliased into one follow-up request, keeps it under Shopify's 1000 point query cost
+ORDERS_PER_LINE_ITEM_REQUEST = 3
+
+LINE_ITEM_SELECTION = """
+edges {
+  node {
+    product {
+      id
+    }
+    quantity
+    originalUnitPriceSet {
+      shopMoney {
+        amount
+      }
+    }
+  }
+}
+pageInfo {
+  hasNextPage
+  endCursor
+}
+"""
+
+def fetch_remaining_line_items(shop_url, headers, orders):
     """
-    Fetches orders within a specified date range using Shopify's GraphQL API.
+    Completes the line items of the orders with more than one page of them,
+    e.g. wholesale orders, by appending the missing pages to their lineItems
+    edges. The follow-up pages of several orders are fetched in one request
+    with aliased order queries; orders whose line items fit in the first page
+    cost nothing.
+
+    Args:
+        orders (list): Order nodes of an orders page, updated in place.
+
+    Returns:
+        bool: False if a follow-up request failed, the orders are then incomplete.
     """
+    pending = [
+        (order, order["lineItems"]["pageInfo"]["endCursor"])
+        for order in orders
+        if order["lineItems"].get("pageInfo", {}).get("hasNextPage")
+    ]
+    if pending:
+        logger.debug(f"{len(pending)} orders of {shop_url} have more than {LINE_ITEM_PAGE_SIZE} line items")
+
+    while pending:
+        batch = pending[:ORDERS_PER_LINE_ITEM_REQUEST]
+        pending = pending[ORDERS_PER_LINE_ITEM_REQUEST:]
+        aliases = "\n".join(
+            f'''order{index}: order(id: "{order["id"]}") {{
+                lineItems(first: {LINE_ITEM_PAGE_SIZE}, after: "{cursor}") {{
+                    {LINE_ITEM_SELECTION}
+                }}
+            }}'''
+            for index, (order, cursor) in enumerate(batch)
+        )
+        response = shopify_graphql(shop_url, headers, f"{{ {aliases} }}")
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
 
-    logger.debug("orders fetching start")
-    api_version = apps.get_app_config("shopify_app").SHOPIFY_API_VERSION
-    url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
+        if response.status_code != 200 or body.get("errors") or not body.get("data"):
+            logger.error(f"Error fetching remaining line items: {response.status_code} - {body.get('errors')}")
+            return False
+
+        for index, (order, _) in enumerate(batch):
+            line_items = (body["data"].get(f"order{index}") or {}).get("lineItems")
+            if not line_items:
+                logger.error(f"Order {order['id']} of {shop_url} returned no line items")
+                return False
+            order["lineItems"]["edges"].extend(line_items["edges"])
+            if line_items["pageInfo"]["hasNextPage"]:
+                pending.append((order, line_items["pageInfo"]["endCursor"]))
+
+    return True
+
+def fetch_orders(shop_url, days, headers):
+    """
+    Fetches the orders of the last `days` days using Shopify's GraphQL API.
+
+    Returns:
+        list: Order edges, or None if Shopify returned an error.
+    """
     end_date = timezone.now()
     start_date = end_date - timedelta(days=days)
+    return fetch_orders_between(shop_url, start_date, end_date, headers)
+
+def fetch_orders_between(shop_url, start_date, end_date, headers, compact=False):
+    """
+    Fetches orders created between start_date and end_date using Shopify's GraphQL API.
+
+    Args:
+        compact (bool): Compact each page as it arrives (see compact_orders), so
+            only one raw page is held in memory at a time.
+
+    Returns:
+        list: Order edges, or compacted orders with `compact`. None if Shopify
+        returned an error.
+    """
+
+    logger.debug("orders fetching start")
     start_date_iso = start_date.isoformat()
     end_date_iso = end_date.isoformat()
     
@@ -324,26 +625,14 @@ def fetch_orders(shop_url, days, headers):
         pagination_query = f', after: "{after_cursor}"' if after_cursor else ""
         query = f"""
         {{
-          orders(first: 250, query: "created_at:>{start_date} AND created_at:<{end_date}"{pagination_query}) {{
+          orders(first: 250, query: "created_at:>{start_date_iso} AND created_at:<{end_date_iso}"{pagination_query}) {{
             edges {{
               cursor
               node {{
                 id
                 createdAt
-                lineItems(first: 250) {{
-                  edges {{
-                    node {{
-                      product {{
-                        id  
-                      }}
-                      quantity
-                      originalUnitPriceSet {{
-                        shopMoney {{
-                          amount
-                        }}
-                      }}
-                    }}
-                  }}
+                lineItems(first: {LINE_ITEM_PAGE_SIZE}) {{
+                  {LINE_ITEM_SELECTION}
                 }}
               }}
             }}
@@ -354,23 +643,139 @@ def fetch_orders(shop_url, days, headers):
         }}
         """
 
-        response = requests.post(url, json={"query": query}, headers=headers)
-    
-        if response.status_code != 200 or "errors" in response.json():
-            logger.error(f"Error fetching orders: {response.json().get('errors')}")
-            return []
+        response = shopify_graphql(shop_url, headers, query)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
 
-        data = response.json().get("data", {}).get("orders", {})
-        logger.debug(data)
+        if response.status_code != 200 or "errors" in body:
+            logger.error(f"Error fetching orders: {response.status_code} - {body.get('errors')}")
+            return None
+
+        data = body.get("data", {}).get("orders", {})
         if not data:
             logger.error("No orders data available.")
-            order_not_found(response.json(), shop_url)
-            return []
+            order_not_found(body, shop_url)
+            return None
         
+        if not fetch_remaining_line_items(shop_url, headers, [edge["node"] for edge in data["edges"]]):
+            return None
+
         has_next_page = data.get("pageInfo", {}).get("hasNextPage", False)
         after_cursor = data["edges"][-1]["cursor"] if has_next_page else None
-        orders.extend(data["edges"])
+        orders.extend(compact_orders(data["edges"]) if compact else data["edges"])
+        del body, data, response
+
+    return orders
+
+#########################
+# shop-wide order cache
+#########################
+
+ORDER_CACHE_TTL = getattr(settings, "ORDER_CACHE_TTL", 60 * 60)
+
+def compact_orders(orders):
+    """
+    Strips order edges down to what the order aggregation needs so a shop's
+    order history stays small in the cache.
+
+    Returns:
+        list: [createdAt, [[product GID, quantity, unit price], ...]] per order. Orders
+        without a product line item (custom or gift card only) are kept with no line
+        items, the order metering counts them.
+    """
+    compacted = []
+    for order in orders:
+        line_items = [
+            [
+                line_item["node"]["product"]["id"],
+                int(line_item["node"]["quantity"]),
+                float(line_item["node"]["originalUnitPriceSet"]["shopMoney"]["amount"]),
+            ]
+            for line_item in order["node"]["lineItems"]["edges"]
+            if line_item["node"].get("product")
+        ]
+        compacted.append([order["node"]["createdAt"], line_items])
+    return compacted
+
+def _order_cache_key(shop_url, window):
+    generation = order_cache.get(f"shop_orders_generation:{shop_url}", 0)
+    return f"shop_orders:{shop_url}:{generation}:{window}"
+
+def invalidate_shop_orders(shop_url):
+    """
+    Drops every cached order window of a shop by bumping its cache generation.
+    """
+    generation_key = f"shop_orders_generation:{shop_url}"
+    order_cache.add(generation_key, 0, timeout=None)
+    order_cache.incr(generation_key)
+    logger.debug(f"order cache invalidated for {shop_url}")
+
+def fetch_compact_orders_between(shop_url, start_date, end_date, headers, expected_rows=None):
+    """
+    Downloads the compacted orders of a date range, through a bulk operation when
+    the range is expected to hold more orders than the paginated query can handle.
+
+    Returns:
+        list: Compacted orders, or None if Shopify returned an error.
+    """
+    if use_bulk_operations(expected_rows):
+        try:
+            return list(fetch_bulk_orders(shop_url, headers, start_date, end_date))
+        except Exception as e:
+            logger.error(f"Bulk order fetch failed for {shop_url}: {str(e)}")
+            return None
+
+    return fetch_orders_between(shop_url, start_date, end_date, headers, compact=True)
+
+def get_shop_orders(shop_url, days, headers):
+    """
+    Returns the compacted orders of the shop's lookback window, downloading them
+    from Shopify only once per ORDER_CACHE_TTL for all collections of the shop.
+    Returns None if the download failed.
+    """
+    key = _order_cache_key(shop_url, f"days:{days}")
+    orders = order_cache.get(key)
+    if orders is not None:
+        logger.debug(f"order cache hit for {shop_url} ({days} days)")
+        return orders
 
+    volume_key = f"shop_order_volume:{shop_url}"
+    end_date = timezone.now()
+    orders = fetch_compact_orders_between(
+        shop_url, end_date - timedelta(days=days), end_date, headers, expected_rows=order_cache.get(volume_key)
+    )
+    if orders is None:
+        return None
+
+    order_cache.set(key, orders, ORDER_CACHE_TTL)
+    order_cache.set(volume_key, len(orders), None)
+    return orders
+
+def get_shop_orders_for_range(shop_url, start_date, end_date, headers=None):
+    """
+    Same as get_shop_orders for an explicit date range (analytics).
+    Returns None if the download failed.
+    """
+    key = _order_cache_key(shop_url, f"range:{start_date.isoformat()}:{end_date.isoformat()}")
+    orders = order_cache.get(key)
+    if orders is not None:
+        return orders
+
+    if headers is None:
+        client = _get_client(shop_url)
+        if not client:
+            return None
+        headers = _get_shopify_headers(client.access_token)
+
+    orders = fetch_compact_orders_between(
+        shop_url, start_date, end_date, headers, expected_rows=order_cache.get(f"shop_order_volume:{shop_url}")
+    )
+    if orders is None:
+        return None
+
+    order_cache.set(key, orders, ORDER_CACHE_TTL)
     return orders
 
 def calculate_revenue_from_orders(orders, product_id):
@@ -390,20 +795,19 @@ def calculate_revenue_from_orders(orders, product_id):
 from datetime import datetime, timezone as dt_timezone
 from django.utils import timezone
 
+def _parse_order_date(order_date_str):
+    if order_date_str.endswith('Z'):
+        order_date = datetime.strptime(order_date_str, '%Y-%m-%dT%H:%M:%SZ')
+        return order_date.replace(tzinfo=dt_timezone.utc)
+    return datetime.fromisoformat(order_date_str)
+
 def calculate_recency_score(orders, product_id):
     last_order_date = None
 
     for order in orders:
         for line_item in order["node"]["lineItems"]["edges"]:
             if line_item["node"]["product"]["id"] == product_id:
-                order_date_str = order["node"]["createdAt"]
-
-
-                if order_date_str.endswith('Z'):
-                    order_date = datetime.strptime(order_date_str, '%Y-%m-%dT%H:%M:%SZ')
-                    order_date = order_date.replace(tzinfo=dt_timezone.utc)  
-                else:
-                    order_date = datetime.fromisoformat(order_date_str)
+                order_date = _parse_order_date(order["node"]["createdAt"])
 
                 if not last_order_date or order_date > last_order_date:
                     last_order_date = order_date
@@ -429,6 +833,233 @@ def calculate_sales_velocity_from_orders(orders, product_id, days, return_units=
     sales_velocity = total_sold_units / days if days > 0 else 0
     return total_sold_units if return_units else sales_velocity
 
+EMPTY_ORDER_METRICS = {
+    "revenue": 0,
+    "total_sold_units": 0,
+    "sales_velocity": 0,
+    "recency_score": 0,
+    "last_order_date": None,
+}
+
+def build_product_order_index(orders, days):
+    """
+    Walks the fetched orders once and aggregates the order metrics of every product.
+
+    Args:
+        orders (list): Compacted orders as returned by get_shop_orders.
+        days (int): The lookback period used for the sales velocity.
+
+    Returns:
+        dict: Product GID -> {"revenue", "total_sold_units", "sales_velocity",
+        "recency_score", "last_order_date"}. Products without orders are absent,
+        use EMPTY_ORDER_METRICS for them.
+    """
+    index = {}
+    for created_at, line_items in orders:
+        order_date = _parse_order_date(created_at)
+        for product_gid, quantity, price in line_items:
+            metrics = index.get(product_gid)
+            if metrics is None:
+                metrics = index[product_gid] = {"revenue": 0, "total_sold_units": 0, "last_order_date": None}
+
+            metrics["revenue"] += price * quantity
+            metrics["total_sold_units"] += quantity
+
+            if not metrics["last_order_date"] or order_date > metrics["last_order_date"]:
+                metrics["last_order_date"] = order_date
+
+    now = timezone.now()
+    for metrics in index.values():
+        metrics["sales_velocity"] = metrics["total_sold_units"] / days if days > 0 else 0
+        metrics["recency_score"] = (now - metrics["last_order_date"]).days
+
+    return index
+
+class OrderFetchError(Exception):
+    pass
+
+def get_product_order_index(client, days, headers):
+    """
+    Returns the per-product order metrics of the client's lookback window, either
+    from the incremental daily rollups or from the shop-wide order cache.
+
+    Raises:
+        OrderFetchError: If the orders could not be downloaded, so callers never
+        store zero revenue for a whole collection after a failed page.
+    """
+    if apps.get_app_config("shopify_app").ORDER_SYNC_INCREMENTAL:
+        if sync_orders_incremental(client, days, headers):
+            return product_metrics_from_rollups(client.shop_id, days)
+        logger.error(f"incremental order sync failed for {client.shop_url}, using full order fetch")
+
+    orders = get_shop_orders(client.shop_url, days, headers)
+    if orders is None:
+        raise OrderFetchError(f"Could not fetch orders of {client.shop_url}")
+    return build_product_order_index(orders, days)
+
+#########################
+# incremental order sync
+#########################
+
+ROLLUP_BATCH_SIZE = 1000
+
+def _fold_orders_into_rollups(shop_id, orders):
+    daily = {}
+    monthly = {}
+    for created_at, line_items in orders:
+        order_date = _parse_order_date(created_at)
+        month = order_date.date().replace(day=1)
+        monthly[month] = monthly.get(month, 0) + 1
+        for product_gid, quantity, price in line_items:
+            key = (product_gid.split("/")[-1], order_date.date())
+            revenue, units, last_order_at = daily.get(key, (0, 0, order_date))
+            daily[key] = (revenue + price * quantity, units + quantity, max(last_order_at, order_date))
+
+    # the caller holds the shop's sync state lock, so reading and adding to the existing rows is safe
+    keys = list(daily)
+    existing = {}
+    for start in range(0, len(keys), ROLLUP_BATCH_SIZE):
+        chunk = keys[start:start + ROLLUP_BATCH_SIZE]
+        rollups = ProductDailySales.objects.filter(
+            shop_id=shop_id,
+            product_id__in={product_id for product_id, _ in chunk},
+            date__in={day for _, day in chunk},
+        )
+        for rollup in rollups:
+            if (rollup.product_id, rollup.date) in daily:
+                existing[(rollup.product_id, rollup.date)] = rollup
+
+    created = []
+    updated = []
+    for (product_id, day), (revenue, units, last_order_at) in daily.items():
+        rollup = existing.get((product_id, day))
+        if rollup is None:
+            created.append(ProductDailySales(
+                shop_id=shop_id,
+                product_id=product_id,
+                date=day,
+                revenue=Decimal(str(round(revenue, 2))),
+                sold_units=units,
+                last_order_at=last_order_at,
+            ))
+            continue
+        rollup.revenue += Decimal(str(round(revenue, 2)))
+        rollup.sold_units += units
+        if not rollup.last_order_at or last_order_at > rollup.last_order_at:
+            rollup.last_order_at = last_order_at
+        updated.append(rollup)
+
+    ProductDailySales.objects.bulk_create(created, batch_size=ROLLUP_BATCH_SIZE)
+    ProductDailySales.objects.bulk_update(updated, ["revenue", "sold_units", "last_order_at"], batch_size=ROLLUP_BATCH_SIZE)
+
+    # order metering falls back to these counts where Shopify's count query is unavailable
+    for month, count in monthly.items():
+        ShopOrderCount.objects.get_or_create(shop_id=shop_id, month=month)
+        ShopOrderCount.objects.filter(shop_id=shop_id, month=month).update(synced_count=F("synced_count") + count)
+
+    return len(daily)
+
+def _already_folded(state, order_date):
+    # folded orders were created after synced_from, up to the newest one recorded
+    if state.synced_from is None or state.last_order_created_at is None:
+        return False
+    return state.synced_from < order_date <= state.last_order_created_at
+
+def sync_orders_incremental(client, days, headers):
+    """
+    Folds the shop's orders created since the last sync into ProductDailySales.
+
+    The orders are downloaded without holding any lock. The sync state row is
+    then locked only to re-check the watermark and fold, so an order another
+    refresh of the same shop folded meanwhile is never counted twice. Widening
+    the lookback period backfills the missing older range once.
+
+    Returns:
+        bool: False if Shopify returned an error, in which case nothing is stored.
+    """
+    now = timezone.now()
+    window_start = now - timedelta(days=days)
+
+    state, _ = OrderSyncState.objects.get_or_create(shop_id=client.shop_id)
+
+    ranges = []
+    if state.synced_from is None:
+        ranges.append((window_start, now))
+    else:
+        if window_start < state.synced_from:
+            ranges.append((window_start, state.synced_from))
+        ranges.append((state.last_order_created_at or state.synced_from, now))
+
+    # only a backfill can be large enough for a bulk operation
+    backfill_rows = order_cache.get(f"shop_order_volume:{client.shop_url}")
+
+    fetched = []
+    for start_date, end_date in ranges:
+        expected_rows = backfill_rows if start_date < (state.last_order_created_at or now) else None
+        orders = fetch_compact_orders_between(client.shop_url, start_date, end_date, headers, expected_rows)
+        if orders is None:
+            return False
+        fetched.extend(orders)
+
+    if state.synced_from is None:
+        order_cache.set(f"shop_order_volume:{client.shop_url}", len(fetched), None)
+
+    with transaction.atomic():
+        state = OrderSyncState.objects.select_for_update().get(pk=state.pk)
+
+        new_orders = [order for order in fetched if not _already_folded(state, _parse_order_date(order[0]))]
+        folded = _fold_orders_into_rollups(client.shop_id, new_orders)
+
+        if new_orders:
+            newest = max(_parse_order_date(created_at) for created_at, _ in new_orders)
+            if not state.last_order_created_at or newest > state.last_order_created_at:
+                state.last_order_created_at = newest
+        if state.synced_from is None or window_start < state.synced_from:
+            state.synced_from = window_start
+        state.last_synced_at = now
+        state.save(update_fields=["synced_from", "last_order_created_at", "last_synced_at"])
+
+    logger.debug(
+        f"incremental order sync for {client.shop_url}: {len(new_orders)} orders "
+        f"({len(fetched) - len(new_orders)} already folded), {folded} rollups"
+    )
+    return True
+
+def product_metrics_from_rollups(shop_id, days):
+    """
+    Same shape as build_product_order_index, computed from the daily rollups of
+    the last `days` days.
+    """
+    since = (timezone.now() - timedelta(days=days)).date()
+    rows = (
+        ProductDailySales.objects.filter(shop_id=shop_id, date__gte=since)
+        .values("product_id")
+        .annotate(revenue=Sum("revenue"), total_sold_units=Sum("sold_units"), last_order_date=Max("last_order_at"))
+    )
+
+    now = timezone.now()
+    index = {}
+    for row in rows:
+        index[f"gid://shopify/Product/{row['product_id']}"] = {
+            "revenue": float(row["revenue"]),
+            "total_sold_units": row["total_sold_units"],
+            "last_order_date": row["last_order_date"],
+            "sales_velocity": row["total_sold_units"] / days if days > 0 else 0,
+            "recency_score": (now - row["last_order_date"]).days if row["last_order_date"] else 0,
+        }
+    return index
+
+def prune_order_rollups(retention_days):
+    """
+    Deletes daily rollups older than retention_days for every shop.
+    """
+    # rollups are whole days, so the kept range starts at midnight of the cutoff day
+    cutoff = (timezone.now() - timedelta(days=retention_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    deleted, _ = ProductDailySales.objects.filter(date__lt=cutoff.date()).delete()
+    # so a later lookback beyond the retention window gets backfilled again
+    OrderSyncState.objects.filter(synced_from__lt=cutoff).update(synced_from=cutoff)
+    return deleted
+
 #########################
 
 def get_past_date(days):
@@ -462,11 +1093,8 @@ def fetch_client_data(shop_url, access_token):
     Returns:
         dict: A dictionary containing the client's shop data or an empty dictionary if an error occurs.
     """
-    api_version = apps.get_app_config("shopify_app").SHOPIFY_API_VERSION
     headers = _get_shopify_headers(access_token)
 
-    url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
-
     query = """
     {
       shop {
@@ -500,7 +1128,7 @@ def fetch_client_data(shop_url, access_token):
     }
     """
     
-    response = requests.post(url, json={"query": query}, headers=headers)
+    response = shopify_graphql(shop_url, headers, query)
     if response.status_code == 200:
         data = response.json()
         logger.debug(f"Data from Shopify: {data}") 
@@ -510,43 +1138,190 @@ def fetch_client_data(shop_url, access_token):
         return {}
 
 # MAIN API FUNCTION
+REORDER_MOVES_PER_REQUEST = 250
+
+def _longest_increasing_subsequence(sequence):
+    """
+    Returns the indexes of one longest strictly increasing subsequence of `sequence`.
+    """
+    tails = []  # tails[k]: index ending the best increasing run of length k + 1
+    tail_values = []
+    previous = [None] * len(sequence)
+
+    for index, value in enumerate(sequence):
+        length = bisect_left(tail_values, value)
+        if length:
+            previous[index] = tails[length - 1]
+        if length == len(tails):
+            tails.append(index)
+            tail_values.append(value)
+        else:
+            tails[length] = index
+            tail_values[length] = value
+
+    indexes = set()
+    index = tails[-1] if tails else None
+    while index is not None:
+        indexes.add(index)
+        index = previous[index]
+    return indexes
+
+def plan_reorder_moves(current_positions, sorted_product_ids):
+    """
+    Plans the collectionReorderProducts moves that turn the stored order of a
+    collection into `sorted_product_ids`.
+
+    The products on a longest increasing subsequence of their current positions
+    keep their relative order, only the others are moved, each right after its
+    predecessor in the new order. Shopify applies moves in sequence, so every
+    newPosition is computed on the order left by the previous moves.
+
+    Args:
+        current_positions (dict): product id -> stored position_in_collection.
+        sorted_product_ids (list): Product ids in the desired order.
+
+    Returns:
+        list: (product id, new position) moves. Every product is moved when the
+        stored positions do not describe the collection's current order.
+    """
+    target = [str(product_id) for product_id in sorted_product_ids]
+    full_moves = [(product_id, position) for position, product_id in enumerate(target)]
+
+    positions = [current_positions.get(product_id) for product_id in target]
+    if (
+        set(current_positions) != set(target)
+        or not all(positions)
+        or len(set(positions)) != len(positions)
+    ):
+        logger.debug("stored positions unusable, moving every product")
+        return full_moves
+
+    stable = _longest_increasing_subsequence(positions)
+
+    # Every place a product occupies during the replay, in collection order: the front, then each
+    # stored slot followed by the products that get moved right after it. A moved product always
+    # lands on its place right behind its predecessor, so its newPosition is the number of places
+    # before it still occupied, counted with a Fenwick tree instead of replaying list moves.
+    slot = [None] * len(target)  # target index -> place of its stored position
+    moved_to = [None] * len(target)  # target index -> place it is moved to
+    place_count = 0
+
+    def follow(index):
+        nonlocal place_count
+        while index < len(target) and index not in stable:
+            moved_to[index] = place_count
+            place_count += 1
+            index += 1
+
+    follow(0)
+    for index in sorted(range(len(target)), key=positions.__getitem__):
+        slot[index] = place_count
+        place_count += 1
+        if index in stable:
+            follow(index + 1)
+
+    tree = [0] * (place_count + 1)
+
+    def occupy(place, delta):
+        place += 1
+        while place <= place_count:
+            tree[place] += delta
+            place += place & -place
+
+    def occupied_before(place):
+        count = 0
+        while place:
+            count += tree[place]
+            place -= place & -place
+        return count
+
+    for place in slot:
+        occupy(place, 1)
+
+    moves = []
+    for index, product_id in enumerate(target):
+        if index in stable:
+            continue
+        occupy(slot[index], -1)
+        moves.append((product_id, occupied_before(moved_to[index])))
+        occupy(moved_to[index], 1)
+
+    return moves
+
 def update_collection_products_order(
-    shop_url, access_token, collection_id, sorted_product_ids
+    shop_url, access_token, collection_id, sorted_product_ids, history_entry=None
 ):
     """
-    Updates the product order of a collection in Shopify and updates usage data.
+    Sends the new product order of a collection to Shopify.
+
+    Only the moves planned by plan_reorder_moves against the stored
+    position_in_collection are sent, in batches of REORDER_MOVES_PER_REQUEST.
+    Shopify applies each batch in a background job; the reorder is tracked as a
+    ReorderJob and only completed (positions, usage, sort dates, history) once
+    every job is done, see poll_reorder_jobs.
 
     Args:
         shop_url (str): The Shopify store URL.
         access_token (str): The access token for Shopify API authentication.
         collection_id (str): The ID of the collection to update.
         sorted_product_ids (list): A list of product IDs in the desired order.
+        history_entry (History): The history entry settled when the reorder completes.
 
     Returns:
-        bool: True if the update is successful, False otherwise.
+        ReorderJob: The tracked reorder, "done" if Shopify already finished it,
+        "pending" while its jobs run. None if Shopify rejected the reorder, which
+        is recorded as a failed ReorderJob.
+    """
+    job_ids = _send_reorder_moves(shop_url, access_token, collection_id, sorted_product_ids)
+
+    client = Client.objects.get(shop_url=shop_url)
+    reorder_job = ReorderJob.objects.create(
+        shop_id=client.shop_id,
+        collection_id=collection_id,
+        history=history_entry,
+        job_ids=job_ids or [],
+        product_ids=[str(product_id) for product_id in sorted_product_ids],
+    )
+    if job_ids is None:
+        finish_reorder(reorder_job, succeeded=False)
+        return None
+
+    if not job_ids:
+        finish_reorder(reorder_job, succeeded=True)
+    else:
+        logger.debug(f"reorder of collection {collection_id} waits for Shopify jobs {job_ids}")
+    return reorder_job
+
+def _send_reorder_moves(shop_url, access_token, collection_id, sorted_product_ids):
+    """
+    Returns:
+        list: Ids of the Shopify jobs still applying the moves, None if Shopify
+        rejected the reorder.
     """
     try:
-        api_version = apps.get_app_config("shopify_app").SHOPIFY_API_VERSION
         headers = _get_shopify_headers(access_token)
-        url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
         collection_global_id = f"gid://shopify/Collection/{collection_id}"
 
-        sort_order_url = f"https://{shop_url}/admin/api/{api_version}/custom_collections/{collection_id}.json"
+        sort_order_url = f"{admin_api_url(shop_url)}/custom_collections/{collection_id}.json"
         payload = {"custom_collection": {"id": collection_id, "sort_order": "manual"}}
-        sort_response = requests.put(sort_order_url, json=payload, headers=headers)
+        sort_response = shopify_rest("PUT", shop_url, sort_order_url, headers, json=payload)
 
         if sort_response.status_code != 200:
             sort_error = sort_response.json()
             if "errors" in sort_error and "Not Found" in str(sort_error["errors"]):
-                print(f"Collection {collection_id} is likely automated and cannot be set to manual.")
-                return False
+                logger.warning(f"Collection {collection_id} is likely automated and cannot be set to manual.")
+                return None
             else:
-                print(f"Failed to set sort order to manual: {sort_response.text}")
-                return False
+                logger.error(f"Failed to set sort order of collection {collection_id} to manual: {sort_response.text}")
+                return None
 
         reorder_mutation = """
         mutation updateProductOrder($id: ID!, $moves: [MoveInput!]!) {
             collectionReorderProducts(id: $id, moves: $moves) {
+                job {
+                    id
+                    done
+                }
                 userErrors {
                     field
                     message
@@ -554,50 +1329,207 @@ def update_collection_products_order(
             }
         }
         """
-        moves = [
-            {
-                "id": f"gid://shopify/Product/{product_id}",
-                "newPosition": str(position),
-            }
-            for position, product_id in enumerate(sorted_product_ids)
-        ]
-        variables = {"id": collection_global_id, "moves": moves}
-        reorder_response = requests.post(
-            url, json={"query": reorder_mutation, "variables": variables}, headers=headers
-        )
+        # the stored positions are stale while an earlier reorder is still running
+        if ReorderJob.objects.filter(collection_id=collection_id, status="pending").exists():
+            current_positions = {}
+        else:
+            current_positions = dict(
+                ClientProducts.objects.filter(collection_id=collection_id).values_list("product_id", "position_in_collection")
+            )
+        planned_moves = plan_reorder_moves(current_positions, sorted_product_ids)
+        logger.debug(f"{len(planned_moves)} moves planned for {len(sorted_product_ids)} products of collection {collection_id}")
+
+        job_ids = []
+        for start in range(0, len(planned_moves), REORDER_MOVES_PER_REQUEST):
+            moves = [
+                {
+                    "id": f"gid://shopify/Product/{product_id}",
+                    "newPosition": str(position),
+                }
+                for product_id, position in planned_moves[start:start + REORDER_MOVES_PER_REQUEST]
+            ]
+            variables = {"id": collection_global_id, "moves": moves}
+            reorder_response = shopify_graphql(shop_url, headers, reorder_mutation, variables)
+
+            if reorder_response.status_code != 200:
+                logger.error(f"Failed to reorder products of collection {collection_id}: {reorder_response.status_code} - {reorder_response.text}")
+                return None
 
-        if reorder_response.status_code == 200:
             reorder_result = reorder_response.json()
             logger.debug(f"reorder data response is  : \n {reorder_result}")
-            reorder_errors = (
-                reorder_result.get("data", {})
-                .get("collectionReorderProducts", {})
-                .get("userErrors", [])
-            )
+            reorder = (reorder_result.get("data") or {}).get("collectionReorderProducts") or {}
+            reorder_errors = reorder.get("userErrors", [])
+            if reorder_errors or not reorder:
+                logger.error(f"Reorder of collection {collection_id} rejected: {reorder_errors or reorder_result.get('errors')}")
+                return None
 
-            if not reorder_errors:
-                try:
-                    client = Client.objects.get(shop_url=shop_url)
-                    usage = Usage.objects.get(shop=client)
-
-                    with transaction.atomic():
-                        usage.sorts_count += 1
-                        usage.usage_date = timezone.now().date()
-                        usage.save()
-                except Client.DoesNotExist:
-                    print(f"Client with shop_url {shop_url} does not exist.")
-                except Usage.DoesNotExist:
-                    print(f"Usage data for client {client.id} does not exist.")
-                return True
-            else:
-                print(f"User errors: {reorder_errors}")
-        else:
-            print(f"Failed to reorder products: {reorder_response.status_code} - {reorder_response.text}")
-        return False
+            job = reorder.get("job")
+            if job and not job["done"]:
+                job_ids.append(job["id"])
+
+        return job_ids
 
     except Exception as e:
-        print(f"Exception during product order update: {str(e)}")
-        return False
+        logger.error(f"Exception during product order update of collection {collection_id}: {str(e)}")
+        return None
+
+def finish_reorder(reorder_job, succeeded):
+    """
+    Completes a reorder once Shopify finished or failed its jobs. A successful
+    reorder stores the new positions, counts the sort in Usage and stamps the
+    sort dates; the linked history entry is settled either way.
+
+    The reorder is claimed by moving it out of "pending" first, so overlapping
+    polls complete it only once.
+
+    Returns:
+        bool: False if the reorder was already completed by someone else.
+    """
+    with transaction.atomic():
+        status = "done" if succeeded else "failed"
+        completed_at = timezone.now()
+        claimed = ReorderJob.objects.filter(pk=reorder_job.pk, status="pending").update(
+            status=status, job_ids=[], completed_at=completed_at
+        )
+        if not claimed:
+            logger.debug(f"reorder {reorder_job.pk} of collection {reorder_job.collection_id} already completed")
+            return False
+        reorder_job.status = status
+        reorder_job.job_ids = []
+        reorder_job.completed_at = completed_at
+
+        if succeeded:
+            collection_id = reorder_job.collection_id
+            current_positions = dict(
+                ClientProducts.objects.filter(collection_id=collection_id).values_list("product_id", "position_in_collection")
+            )
+            for index, product_id in enumerate(reorder_job.product_ids):
+                if current_positions.get(product_id) != index + 1:
+                    ClientProducts.objects.filter(product_id=product_id, collection_id=collection_id).update(position_in_collection=index + 1)
+
+            counted = Usage.objects.filter(shop_id=reorder_job.shop_id).update(
+                sorts_count=F("sorts_count") + 1, usage_date=timezone.now().date()
+            )
+            if not counted:
+                logger.warning(f"Usage data for client {reorder_job.shop_id} does not exist, sort of collection {collection_id} not counted")
+
+            ClientCollections.objects.filter(collection_id=collection_id).update(sort_date=timezone.now())
+            Client.objects.filter(shop_id=reorder_job.shop_id).update(sort_date=timezone.now())
+
+    if reorder_job.history_id:
+        settle_reorder_history(reorder_job.history_id)
+    return True
+
+def record_failed_reorder(shop_id, collection_id, history_id):
+    """
+    Records a collection whose sort failed before reaching Shopify as a failed
+    reorder, so a history entry covering several collections still counts it.
+    """
+    ReorderJob.objects.create(
+        shop_id=shop_id, collection_id=collection_id, history_id=history_id, status="failed", completed_at=timezone.now()
+    )
+    settle_reorder_history(history_id)
+
+def settle_reorder_history(history_id):
+    """
+    Marks a history entry Done or Failed once all of its reorders are completed:
+    `expected_reorders` of them for an entry covering several collections, the
+    ones created so far otherwise. Failed if any of them failed; an entry
+    already Failed stays Failed.
+    """
+    history = History.objects.filter(id=history_id).first()
+    if history is None:
+        return
+
+    reorders = ReorderJob.objects.filter(history_id=history_id)
+    if reorders.filter(status="pending").exists():
+        return
+    if history.expected_reorders is not None and reorders.count() < history.expected_reorders:
+        return
+
+    if reorders.filter(status="failed").exists():
+        History.objects.filter(id=history_id).update(status="Failed", ended_at=timezone.now())
+    else:
+        History.objects.filter(id=history_id).exclude(status__iexact="failed").update(status="Done", ended_at=timezone.now())
+
+REORDER_JOB_TIMEOUT = 60 * 60
+REORDER_POLL_IDS_PER_REQUEST = 250
+
+async def _poll_shop_jobs(shop_url, headers, job_ids):
+    query = """
+    query($ids: [ID!]!) {
+        nodes(ids: $ids) {
+            ... on Job {
+                id
+                done
+            }
+        }
+    }
+    """
+    async with AsyncShopifyClient(shop_url, headers) as shopify:
+        pages = await asyncio.gather(*(
+            shopify.graphql(query, {"ids": job_ids[start:start + REORDER_POLL_IDS_PER_REQUEST]})
+            for start in range(0, len(job_ids), REORDER_POLL_IDS_PER_REQUEST)
+        ))
+
+    states = {}
+    for page in pages:
+        for node in (page.get("data") or {}).get("nodes") or []:
+            if node:
+                states[node["id"]] = node["done"]
+    return states
+
+def poll_reorder_jobs():
+    """
+    Polls the Shopify jobs of every pending reorder, all shops concurrently with
+    one status query per shop, and completes the reorders whose jobs are done.
+    A job Shopify no longer knows, or a reorder running past
+    REORDER_JOB_TIMEOUT, fails the reorder.
+
+    Returns:
+        int: Number of reorders completed or failed.
+    """
+    pending = list(ReorderJob.objects.filter(status="pending").select_related("shop"))
+    if not pending:
+        return 0
+
+    by_shop = {}
+    for reorder_job in pending:
+        by_shop.setdefault(reorder_job.shop, []).append(reorder_job)
+
+    async def _run():
+        return await asyncio.gather(
+            *(
+                _poll_shop_jobs(
+                    client.shop_url,
+                    _get_shopify_headers(client.access_token),
+                    [job_id for reorder_job in reorder_jobs for job_id in reorder_job.job_ids],
+                )
+                for client, reorder_jobs in by_shop.items()
+            ),
+            return_exceptions=True,
+        )
+
+    settled = 0
+    deadline = timezone.now() - timedelta(seconds=REORDER_JOB_TIMEOUT)
+    for (client, reorder_jobs), states in zip(by_shop.items(), asyncio.run(_run())):
+        if isinstance(states, Exception):
+            logger.error(f"Error polling reorder jobs of {client.shop_url}: {str(states)}")
+            continue
+
+        for reorder_job in reorder_jobs:
+            missing = [job_id for job_id in reorder_job.job_ids if job_id not in states]
+            running = [job_id for job_id in reorder_job.job_ids if states.get(job_id) is False]
+
+            if missing or (running and reorder_job.created_at < deadline):
+                logger.error(f"Reorder of collection {reorder_job.collection_id} failed, jobs missing: {missing}, running: {running}")
+                settled += finish_reorder(reorder_job, succeeded=False)
+            elif not running:
+                settled += finish_reorder(reorder_job, succeeded=True)
+            elif running != reorder_job.job_ids:
+                ReorderJob.objects.filter(pk=reorder_job.pk, status="pending").update(job_ids=running)
+
+    return settled
     
 #########################
 
@@ -608,9 +1540,7 @@ def fetch_order_for_graph(shop_url, start_date, end_date):
         return []
 
     access_token = client.access_token
-    api_version = apps.get_app_config("shopify_app").SHOPIFY_API_VERSION
     headers = _get_shopify_headers(access_token)
-    url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
 
     orders = []
     has_next_page = True
@@ -651,7 +1581,7 @@ def fetch_order_for_graph(shop_url, start_date, end_date):
         }}
         """
 
-        response = requests.post(url, json={"query": query}, headers=headers)
+        response = shopify_graphql(shop_url, headers, query)
         if response.status_code != 200:
             print(f"Error fetching orders: {response.status_code} - {response.text}")
             return []
@@ -673,115 +1603,152 @@ def fetch_order_for_graph(shop_url, start_date, end_date):
         "total_revenue": total_revenue,
     }
 
-def fetch_products_for_graph(shop_url, collection_ids, start_date, end_date):
-    client = _get_client(shop_url)
-    if not client:
-        return []
+#####################################################################################################
+# analytics ingestion: the orders of a date range are fetched and aggregated per product once, then
+# fanned out to every requested collection in one pass
+#####################################################################################################
 
-    access_token = client.access_token
-    api_version = apps.get_app_config("shopify_app").SHOPIFY_API_VERSION
-    headers = _get_shopify_headers(access_token)
+ANALYTICS_PRODUCT_FIELDS = (
+    "id", "title", "totalInventory", "createdAt", "publishedAt", "updatedAt", "tags", "variantsCount", "variants",
+)
 
-    products_data = {}
-    
-    for collection_id in collection_ids:
-        url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
-        products = []
-        has_next_page = True
-        cursor = None
-
-        while has_next_page:
-            query = f"""
-            query($after: String) {{
-                collection(id: "gid://shopify/Collection/{collection_id}") {{
-                    products(first: 250, after: $after) {{
-                        edges {{
-                            cursor
-                            node {{
-                                id
-                                title
-                                totalInventory
-                                createdAt
-                                publishedAt
-                                updatedAt
-                                tags
-                                images(first: 1) {{
-                                    edges {{
-                                        node {{
-                                            src
-                                            altText
-                                        }}
-                                    }}
-                                }}
-                                variantsCount {{  
-                                    count
-                                }}
-                                variants(first: 10) {{
-                                    edges {{
-                                        node {{
-                                            id
-                                            price
-                                            inventoryQuantity
-                                        }}
-                                    }}
-                                }}
-                            }}
-                        }}
-                        pageInfo {{
-                            hasNextPage
-                        }}
-                    }}
-                }}
-            }}
-            """
-
-            variables = {"after": cursor} if cursor else {}
-            response = requests.post(url, json={"query": query, "variables": variables}, headers=headers)
-
-            if response.status_code == 200:
-                data = response.json()
-                new_products = (
-                    data.get("data", {})
-                    .get("collection", {})
-                    .get("products", {})
-                    .get("edges", [])
-                )
-                products.extend(new_products)
-                page_info = (
-                    data.get("data", {})
-                    .get("collection", {})
-                    .get("products", {})
-                    .get("pageInfo", {})
-                )
-                has_next_page = page_info.get("hasNextPage", False)
-                if has_next_page:
-                    cursor = new_products[-1]["cursor"]
-            else:
-                print(f"Error fetching products: {response.status_code} - {response.text}")
-                break
+def get_range_product_aggregate(shop_url, start_date, end_date, headers=None):
+    """
+    Returns the order metrics of every product sold between start_date and end_date,
+    as built by build_product_order_index, cached per (shop, range).
+    Returns None if the orders could not be fetched.
+    """
+    key = _order_cache_key(shop_url, f"aggregate:{start_date.isoformat()}:{end_date.isoformat()}")
+    aggregate = order_cache.get(key)
+    if aggregate is not None:
+        return aggregate
 
-        for product in products:
-            product_id = product["node"]["id"].split("/")[-1]
-            orders_data = fetch_order_for_graph(shop_url, start_date, end_date)
-            total_revenue = calculate_revenue_from_orders(orders_data["orders"], product_id)
+    orders = get_shop_orders_for_range(shop_url, start_date, end_date, headers)
+    if orders is None:
+        return None
 
-            products_data[product_id] = {
-                "title": product["node"]["title"],
-                "totalInventory": product["node"]["totalInventory"],
-                "createdAt": product["node"]["createdAt"],
-                "publishedAt": product["node"]["publishedAt"],
-                "updatedAt": product["node"]["updatedAt"],
-                "tags": product["node"].get("tags", []),
-                "revenue": total_revenue,
-                "sales_velocity": calculate_sales_velocity_from_orders(orders_data["orders"], product_id, (end_date - start_date).days),
-                "total_sold_units": calculate_sales_velocity_from_orders(orders_data["orders"], product_id, (end_date - start_date).days, return_units=True),
-                "variants_count": product["node"]["variantsCount"]["count"],
-                "variant_availability": sum(
-                    variant["node"]["inventoryQuantity"]
-                    for variant in product["node"]["variants"]["edges"]
-                ),
-            }
+    aggregate = build_product_order_index(orders, max((end_date - start_date).days, 1))
+    order_cache.set(key, aggregate, ORDER_CACHE_TTL)
+    return aggregate
+
+async def _fetch_collection_product_nodes(shopify, collection_id, selection):
+    query = collection_products_query(collection_id, selection)
+    nodes = []
+    cursor = None
+    while True:
+        body = await shopify.graphql(query, {"after": cursor} if cursor else {})
+        # a missing collection or a GraphQL error must fail the collection, not read as no products
+        products = ((body.get("data") or {}).get("collection") or {}).get("products")
+        if body.get("errors") or products is None:
+            raise ShopifyRequestError(200, body.get("errors") or f"collection {collection_id} not found")
+
+        edges = products["edges"]
+        nodes.extend(edge["node"] for edge in edges)
+
+        if not edges or not products["pageInfo"]["hasNextPage"]:
+            return nodes
+        cursor = edges[-1]["cursor"]
+
+def fetch_collections_product_nodes(shop_url, headers, collection_ids):
+    """
+    Pages through the products of several collections concurrently over one
+    connection pool.
+
+    Returns:
+        dict: collection_id -> list of product nodes, or the exception that
+        stopped the collection's fetch.
+    """
+    selection = product_selection(ANALYTICS_PRODUCT_FIELDS)
+
+    async def _run():
+        async with AsyncShopifyClient(shop_url, headers) as shopify:
+            return await asyncio.gather(
+                *(_fetch_collection_product_nodes(shopify, collection_id, selection) for collection_id in collection_ids),
+                return_exceptions=True,
+            )
+
+    return dict(zip(collection_ids, asyncio.run(_run())))
 
+def build_analytics_product(node, metrics):
+    return {
+        "title": node["title"],
+        "totalInventory": node["totalInventory"],
+        "createdAt": node["createdAt"],
+        "publishedAt": node["publishedAt"],
+        "updatedAt": node["updatedAt"],
+        "tags": node.get("tags", []),
+        "revenue": metrics["revenue"],
+        "sales_velocity": metrics["sales_velocity"],
+        "total_sold_units": metrics["total_sold_units"],
+        "variants_count": node["variantsCount"]["count"],
+        "variant_availability": sum(
+            variant["node"]["inventoryQuantity"]
+            for variant in node["variants"]["edges"]
+        ),
+    }
+
+def _analytics_cache_key(shop_url, collection_id, start_date, end_date):
+    return _order_cache_key(shop_url, f"analytics:{start_date.isoformat()}:{end_date.isoformat()}:{collection_id}")
+
+def fetch_collections_analytics(shop_url, collection_ids, start_date, end_date):
+    """
+    Builds the analytics of several collections over a date range.
+
+    The range's orders are aggregated per product once for the shop, and every
+    product is built once however many of the collections it belongs to. Results
+    are cached per (shop, range, collection), only the collections missing from
+    the cache are fetched from Shopify.
+
+    Returns:
+        dict: collection_id -> {"total_revenue", "total_sold_units", "products"},
+        where products maps product ids to their analytics. Collections whose
+        fetch failed are left out.
+    """
+    client = _get_client(shop_url)
+    if not client:
+        return {}
+
+    keys = {collection_id: _analytics_cache_key(shop_url, collection_id, start_date, end_date) for collection_id in collection_ids}
+    cached = order_cache.get_many(list(keys.values()))
+    analytics = {collection_id: cached[key] for collection_id, key in keys.items() if key in cached}
+
+    missing = [collection_id for collection_id in collection_ids if collection_id not in analytics]
+    if not missing:
+        return analytics
+
+    headers = _get_shopify_headers(client.access_token)
+    aggregate = get_range_product_aggregate(shop_url, start_date, end_date, headers)
+    if aggregate is None:
+        logger.error(f"Orders of {shop_url} between {start_date} and {end_date} could not be fetched")
+        return analytics
+
+    built = {}
+    to_cache = {}
+    for collection_id, nodes in fetch_collections_product_nodes(shop_url, headers, missing).items():
+        if isinstance(nodes, Exception):
+            logger.error(f"Error fetching products of collection {collection_id}: {str(nodes)}")
+            continue
+
+        products = {}
+        for node in nodes:
+            product_id = node["id"].split("/")[-1]
+            if product_id not in built:
+                built[product_id] = build_analytics_product(node, aggregate.get(node["id"], EMPTY_ORDER_METRICS))
+            products[product_id] = built[product_id]
+
+        analytics[collection_id] = to_cache[keys[collection_id]] = {
+            "total_revenue": sum(product["revenue"] for product in products.values()),
+            "total_sold_units": sum(product["total_sold_units"] for product in products.values()),
+            "products": products,
+        }
+
+    order_cache.set_many(to_cache, ORDER_CACHE_TTL)
+    return analytics
+
+def fetch_products_for_graph(shop_url, collection_ids, start_date, end_date):
+    products_data = {}
+    for collection in fetch_collections_analytics(shop_url, collection_ids, start_date, end_date).values():
+        products_data.update(collection["products"])
     return products_data
 
 #####################################################################################################
@@ -795,10 +1762,7 @@ def fetch_order_for_billing(shop_url, start_date, end_date):
 
     access_token = client.access_token
     logger.debug("Access token found")
-    api_version = apps.get_app_config("shopify_app").SHOPIFY_API_VERSION
     headers = _get_shopify_headers(access_token)
-    url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
-    logger.debug(f"URL: {url}")
     
     total_orders = 0
     has_next_page = True
@@ -819,7 +1783,7 @@ def fetch_order_for_billing(shop_url, start_date, end_date):
         }}
         """
 
-        response = requests.post(url, json={"query": query}, headers=headers)
+        response = shopify_graphql(shop_url, headers, query)
         
         # Handle potential access denial for protected data
         if response.status_code != 200:
@@ -859,3 +1823,89 @@ def fetch_order_for_billing(shop_url, start_date, end_date):
     logger.debug(f"Total orders: {total_orders}")
     return total_orders
 
+
+#####################################################################################################
+# order metering: monthly order counts per shop, counted by Shopify and persisted so billing and
+# plan limit checks read them from the database
+#####################################################################################################
+
+def _month_range(month):
+    start = datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+def count_orders_between(shop_url, start_date, end_date, headers):
+    """
+    Counts the orders created in [start_date, end_date) with Shopify's ordersCount
+    query, one request whatever the order volume.
+
+    Returns:
+        int: The exact count, or None if the query failed or is not available
+        in the shop's API version.
+    """
+    query = f"""
+    {{
+      ordersCount(query: "created_at:>='{start_date.isoformat()}' AND created_at:<'{end_date.isoformat()}'", limit: null) {{
+        count
+        precision
+      }}
+    }}
+    """
+    response = shopify_graphql(shop_url, headers, query)
+    if response.status_code != 200:
+        logger.error(f"Error counting orders: {response.status_code} - {response.text}")
+        return None
+
+    try:
+        response_json = response.json()
+    except ValueError:
+        logger.error("Failed to parse JSON response")
+        return None
+
+    orders_count = (response_json.get("data") or {}).get("ordersCount")
+    if response_json.get("errors") or not orders_count:
+        logger.warning(f"ordersCount unavailable for {shop_url}: {response_json.get('errors')}")
+        return None
+    if orders_count.get("precision") != "EXACT":
+        logger.warning(f"ordersCount for {shop_url} is only a lower bound: {orders_count}")
+        return None
+
+    return orders_count["count"]
+
+def meter_shop_orders(client, month):
+    """
+    Counts the orders of the month starting on `month` and persists the count.
+
+    Shopify's count query is used where available. Otherwise shops with the
+    incremental order sync keep the count the sync folds in, and the others
+    fall back to paging through the orders.
+
+    Returns:
+        ShopOrderCount: The stored count, or None if nothing could be counted.
+    """
+    start_date, end_date = _month_range(month)
+    end_date = min(end_date, timezone.now())
+    headers = _get_shopify_headers(client.access_token)
+
+    order_count = count_orders_between(client.shop_url, start_date, end_date, headers)
+    if order_count is None and not apps.get_app_config("shopify_app").ORDER_SYNC_INCREMENTAL:
+        order_count = fetch_order_for_billing(client.shop_url, start_date, end_date)
+
+    if order_count is None:
+        return ShopOrderCount.objects.filter(shop_id=client.shop_id, month=month).first()
+
+    metered, _ = ShopOrderCount.objects.update_or_create(
+        shop_id=client.shop_id,
+        month=month,
+        defaults={"order_count": order_count, "counted_at": timezone.now()},
+    )
+    logger.debug(f"metered {order_count} orders for {client.shop_url} in {month:%Y-%m}")
+    return metered
+
+def get_monthly_order_count(shop_id, month):
+    """
+    Returns the persisted order count of a shop's month, or None if it was not
+    metered yet.
+    """
+    metered = ShopOrderCount.objects.filter(shop_id=shop_id, month=month).first()
+    return metered.count if metered else None
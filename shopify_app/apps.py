@@ -23,7 +23,31 @@ class ShopifyAppConfig(AppConfig):
     # API_VERSION specifies which api version that the app will communicate with
     SHOPIFY_API_VERSION = os.environ.get('SHOPIFY_API_VERSION', 'unstable')
 
+    # Sends the Admin API calls of every shop to this host instead of the shop's
+    # own domain, e.g. http://localhost:8765 for the shopify_fixture_server command
+    SHOPIFY_BASE_URL = os.environ.get('SHOPIFY_BASE_URL')
+
+    # Keep per-product daily sales rollups up to date from a per-shop watermark
+    # instead of downloading the whole lookback window on every refresh
+    ORDER_SYNC_INCREMENTAL = os.environ.get('ORDER_SYNC_INCREMENTAL', 'False') == 'True'
+    ORDER_ROLLUP_RETENTION_DAYS = int(os.environ.get('ORDER_ROLLUP_RETENTION_DAYS', 365))
+
+    # Collections, collection products and order windows expected to hold at least
+    # this many rows are fetched with a bulk operation (0 disables bulk operations)
+    BULK_OPERATION_THRESHOLD = int(os.environ.get('BULK_OPERATION_THRESHOLD', 50000))
+
+    # Collections unchanged in Shopify skip the product refresh, but are refreshed at
+    # least this often so the order-derived metrics follow the lookback window
+    PRODUCT_SYNC_MAX_AGE_HOURS = int(os.environ.get('PRODUCT_SYNC_MAX_AGE_HOURS', 24))
+
     # See http://api.shopify.com/authentication.html for available scopes
     # to determine the permisssions your app will need.
-    SHOPIFY_API_SCOPE = os.environ.get('SHOPIFY_API_SCOPE', 'read_products,read_all_orders,write_products,read_orders,write_orders').split(',')
+    # read_inventory and read_locations feed the location inventory (Client.stock_location) and the
+    # inventory_levels/update webhook. Shops installed before they were added keep their old grant until
+    # the merchant goes through /auth/login/ again: check-scopes reports the missing ones, and the
+    # inventory sync skips those shops with a warning instead of failing.
+    SHOPIFY_API_SCOPE = os.environ.get(
+        'SHOPIFY_API_SCOPE',
+        'read_products,read_all_orders,write_products,read_orders,write_orders,read_inventory,read_locations',
+    ).split(',')
 
@@ -0,0 +1,274 @@
+import time
+import requests
+from django.apps import apps
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+from .client import shopify_graphql, loads
+
+import logging
+logger = logging.getLogger(__name__)
+
+# shared by all workers, see CACHES in settings
+shared_cache = ConnectionProxy(caches, "shopify")
+
+#####################################################################################################
+# Shopify bulk operations: used instead of the `first: 250` cursor loops once a shop's catalog or
+# order history is too large to page through
+#####################################################################################################
+
+BULK_POLL_INTERVAL = 1
+BULK_MAX_POLL_INTERVAL = 10
+BULK_TIMEOUT = 60 * 60
+
+BULK_RUN_MUTATION = """
+mutation bulkOperationRunQuery($query: String!) {
+    bulkOperationRunQuery(query: $query) {
+        bulkOperation {
+            id
+            status
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}
+"""
+
+BULK_STATUS_QUERY = """
+query bulkOperationStatus($id: ID!) {
+    node(id: $id) {
+        ... on BulkOperation {
+            id
+            status
+            errorCode
+            objectCount
+            url
+        }
+    }
+}
+"""
+
+
+class BulkOperationError(Exception):
+    pass
+
+
+def use_bulk_operations(expected_rows):
+    """
+    Whether a fetch of `expected_rows` rows should go through a bulk operation
+    instead of the paginated GraphQL queries.
+    """
+    threshold = apps.get_app_config("shopify_app").BULK_OPERATION_THRESHOLD
+    return bool(threshold) and expected_rows is not None and expected_rows >= threshold
+
+
+def _bulk_graphql(shop_url, headers, query, variables=None):
+    response = shopify_graphql(shop_url, headers, query, variables or {})
+    if response.status_code != 200:
+        raise BulkOperationError(f"{response.status_code} - {response.text}")
+
+    data = response.json()
+    if data.get("errors"):
+        raise BulkOperationError(f"GraphQL errors: {data['errors']}")
+    return data["data"]
+
+
+def run_bulk_query(shop_url, headers, query):
+    """
+    Submits `query` as a bulk operation and waits for Shopify to finish it.
+
+    Shopify runs one bulk query per shop and app at a time, so workers of the
+    same shop queue up on a cache lock.
+
+    Returns:
+        str: The URL of the JSONL result, or None if the query matched nothing.
+    """
+    lock_key = f"bulk_operation_lock:{shop_url}"
+    deadline = time.monotonic() + BULK_TIMEOUT
+
+    while not shared_cache.add(lock_key, 1, BULK_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise BulkOperationError(f"Timed out waiting for the running bulk operation of {shop_url}")
+        time.sleep(BULK_POLL_INTERVAL)
+
+    try:
+        result = _bulk_graphql(shop_url, headers, BULK_RUN_MUTATION, {"query": query})["bulkOperationRunQuery"]
+        if result["userErrors"]:
+            raise BulkOperationError(f"User errors: {result['userErrors']}")
+
+        operation_id = result["bulkOperation"]["id"]
+        logger.debug(f"bulk operation {operation_id} started for {shop_url}")
+
+        interval = BULK_POLL_INTERVAL
+        while True:
+            time.sleep(interval)
+            operation = _bulk_graphql(shop_url, headers, BULK_STATUS_QUERY, {"id": operation_id})["node"]
+
+            if operation["status"] == "COMPLETED":
+                logger.debug(f"bulk operation {operation_id} completed with {operation['objectCount']} objects")
+                return operation["url"]
+            if operation["status"] in ("FAILED", "CANCELED", "EXPIRED"):
+                raise BulkOperationError(f"Bulk operation {operation_id} {operation['status']}: {operation['errorCode']}")
+            if time.monotonic() > deadline:
+                raise BulkOperationError(f"Bulk operation {operation_id} did not finish in {BULK_TIMEOUT} seconds")
+
+            interval = min(interval * 2, BULK_MAX_POLL_INTERVAL)
+    finally:
+        shared_cache.delete(lock_key)
+
+
+def iter_jsonl(url):
+    """
+    Streams the JSONL result of a bulk operation one row at a time.
+    """
+    if not url:
+        return
+
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(chunk_size=64 * 1024):
+            if line:
+                yield loads(line)
+
+
+def iter_bulk_objects(rows, parent_type):
+    """
+    Re-attaches the flattened child rows of a bulk result to their parent.
+
+    Shopify writes every child row right after its parent, so only the current
+    parent is kept in memory.
+
+    Args:
+        rows (iterable): Rows from iter_jsonl.
+        parent_type (str): GraphQL type of the parent objects, e.g. "Product".
+
+    Yields:
+        tuple: (parent row, list of child rows)
+    """
+    prefix = f"gid://shopify/{parent_type}/"
+    parent = None
+    children = []
+
+    for row in rows:
+        if row.get("id", "").startswith(prefix):
+            if parent is not None:
+                yield parent, children
+            parent, children = row, []
+        elif parent is not None and row.get("__parentId") == parent["id"]:
+            children.append(row)
+        else:
+            logger.warning(f"Skipping bulk row without a {parent_type} parent: {row.get('id')}")
+
+    if parent is not None:
+        yield parent, children
+
+
+def fetch_bulk_collection_products(shop_url, headers, collection_id, selection):
+    """
+    Yields the product nodes of a collection in the same shape as the paginated
+    product query of fetch_products_by_collection.
+
+    Args:
+        selection (str): Product fields to select, see api.product_selection.
+    """
+    query = f"""
+    {{
+        collection(id: "gid://shopify/Collection/{collection_id}") {{
+            products {{
+                edges {{
+                    node {{
+                        {selection}
+                    }}
+                }}
+            }}
+        }}
+    }}
+    """
+    url = run_bulk_query(shop_url, headers, query)
+
+    for product, variants in iter_bulk_objects(iter_jsonl(url), "Product"):
+        if "featuredImage" in product:
+            image = product.pop("featuredImage")
+            product["images"] = {"edges": [{"node": image}] if image else []}
+        # every product has a variant, no child rows means variants were not selected
+        if variants:
+            product["variants"] = {"edges": [{"node": variant} for variant in variants]}
+        yield product
+
+
+def fetch_bulk_orders(shop_url, headers, start_date, end_date):
+    """
+    Yields the orders created between start_date and end_date in the compacted
+    format of api.compact_orders, orders without a product line item included.
+    """
+    query = f"""
+    {{
+        orders(query: "created_at:>{start_date.isoformat()} AND created_at:<{end_date.isoformat()}") {{
+            edges {{
+                node {{
+                    id
+                    createdAt
+                    lineItems {{
+                        edges {{
+                            node {{
+                                product {{
+                                    id
+                                }}
+                                quantity
+                                originalUnitPriceSet {{
+                                    shopMoney {{
+                                        amount
+                                    }}
+                                }}
+                            }}
+                        }}
+                    }}
+                }}
+            }}
+        }}
+    }}
+    """
+    url = run_bulk_query(shop_url, headers, query)
+
+    for order, line_items in iter_bulk_objects(iter_jsonl(url), "Order"):
+        compacted = [
+            [
+                line_item["product"]["id"],
+                int(line_item["quantity"]),
+                float(line_item["originalUnitPriceSet"]["shopMoney"]["amount"]),
+            ]
+            for line_item in line_items
+            if line_item.get("product")
+        ]
+        # kept without line items too, the order metering counts every order
+        yield [order["createdAt"], compacted]
+
+
+def fetch_bulk_collections(shop_url, headers):
+    """
+    Yields collection nodes in the shape used by fetch_collections, with the
+    rule set that marks automatic collections.
+    """
+    query = """
+    {
+        collections {
+            edges {
+                node {
+                    id
+                    title
+                    updatedAt
+                    productsCount {
+                        count
+                    }
+                    ruleSet {
+                        appliedDisjunctively
+                    }
+                }
+            }
+        }
+    }
+    """
+    url = run_bulk_query(shop_url, headers, query)
+    for row in iter_jsonl(url):
+        yield row
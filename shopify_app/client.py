@@ -0,0 +1,269 @@
+import asyncio
+import json
+import threading
+import time
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from django.apps import apps
+from . import throttle
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+#####################################################################################################
+# shared Shopify client: keep-alive connection pools per shop host, a sync facade for the existing
+# fetch loops and an async interface for concurrent requests
+#####################################################################################################
+
+SHOPIFY_POOL_SIZE = 10
+SHOPIFY_TIMEOUT = 120
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def loads(data):
+    """
+    Decodes a JSON document, bytes or str, with orjson when it is installed.
+
+    Raises:
+        ValueError: If the document is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class ShopifyRequestError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"{status_code} - {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+def admin_api_url(shop_url):
+    """
+    Base URL of the shop's Admin API. SHOPIFY_BASE_URL points every shop at
+    another host, e.g. the local fixture server.
+    """
+    config = apps.get_app_config("shopify_app")
+    base_url = config.SHOPIFY_BASE_URL or f"https://{shop_url}"
+    return f"{base_url.rstrip('/')}/admin/api/{config.SHOPIFY_API_VERSION}"
+
+
+def graphql_url(shop_url):
+    return f"{admin_api_url(shop_url)}/graphql.json"
+
+
+ACCESS_SCOPES_QUERY = """
+{
+    currentAppInstallation {
+        accessScopes {
+            handle
+        }
+    }
+}
+"""
+
+
+def missing_scopes(granted, required):
+    """
+    Scopes of `required` not covered by `granted`; a write_ scope covers its read_ scope.
+    """
+    covered = set(granted)
+    covered.update(f"read_{scope[len('write_'):]}" for scope in granted if scope.startswith("write_"))
+    return [scope for scope in required if scope not in covered]
+
+
+def granted_scopes(shop_url, headers):
+    """
+    Returns:
+        list: Access scope handles granted to the app by the shop, None if Shopify returned an error.
+    """
+    response = shopify_graphql(shop_url, headers, ACCESS_SCOPES_QUERY)
+    if response.status_code != 200:
+        logger.error(f"Error reading access scopes: {response.status_code} - {response.text}")
+        return None
+    installation = (response.json().get("data") or {}).get("currentAppInstallation")
+    if not installation:
+        logger.error(f"No app installation data available for {shop_url}")
+        return None
+    return [scope["handle"] for scope in installation["accessScopes"]]
+
+
+def shopify_session(shop_url):
+    """
+    Returns the process-wide requests session of a shop, so consecutive pages
+    reuse the same TLS connection instead of a new handshake per request.
+    """
+    session = _sessions.get(shop_url)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(shop_url)
+            if session is None:
+                session = requests.Session()
+                session.headers["Accept-Encoding"] = "gzip"
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SHOPIFY_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[shop_url] = session
+    return session
+
+
+_UNDECODED = object()
+
+
+class ShopifyResponse:
+    """
+    A requests.Response whose body is decoded at most once: json() returns the
+    same decoded document however many times it is called.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._body = _UNDECODED
+        self.status_code = response.status_code
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def json(self):
+        if self._body is _UNDECODED:
+            try:
+                self._body = loads(self._response.content)
+            except ValueError as e:
+                self._body = e
+        if isinstance(self._body, ValueError):
+            raise self._body
+        return self._body
+
+
+def _decode(response):
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def shopify_graphql(shop_url, headers, query, variables=None):
+    """
+    Sync facade: posts a GraphQL query over the shop's pooled session, paced by
+    the shop's throttle governor. Throttled requests are retried with backoff.
+
+    Returns:
+        ShopifyResponse: The response, callers check the status code. Its body is
+        gzip-compressed on the wire and decoded once.
+    """
+    payload = {"query": query}
+    if variables is not None:
+        payload["variables"] = variables
+
+    for attempt in range(throttle.THROTTLE_MAX_RETRIES + 1):
+        wait = throttle.reserve(shop_url, query)
+        while wait:
+            time.sleep(wait)
+            wait = throttle.reserve(shop_url, query)
+
+        response = ShopifyResponse(
+            shopify_session(shop_url).post(graphql_url(shop_url), json=payload, headers=headers, timeout=SHOPIFY_TIMEOUT)
+        )
+        body = _decode(response)
+        throttle.record(shop_url, query, body)
+
+        if not throttle.is_throttled(response.status_code, body) or attempt == throttle.THROTTLE_MAX_RETRIES:
+            return response
+
+        delay = throttle.retry_delay(shop_url, query, body, attempt)
+        logger.warning(f"Shopify throttled {shop_url}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+        time.sleep(delay)
+
+
+def shopify_rest(method, shop_url, url, headers, **kwargs):
+    """
+    Sync facade for the few REST calls left, over the shop's pooled session.
+    Rate limited calls are retried after the Retry-After delay.
+    """
+    for attempt in range(throttle.THROTTLE_MAX_RETRIES + 1):
+        response = shopify_session(shop_url).request(method, url, headers=headers, timeout=SHOPIFY_TIMEOUT, **kwargs)
+        if response.status_code != 429 or attempt == throttle.THROTTLE_MAX_RETRIES:
+            return response
+
+        delay = float(response.headers.get("Retry-After", 2 ** attempt))
+        logger.warning(f"Shopify REST rate limit hit for {shop_url}, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+
+class AsyncShopifyClient:
+    """
+    Async GraphQL client of one shop. Requests share one connection pool and at
+    most `concurrency` of them are in flight at a time.
+
+        async with AsyncShopifyClient(shop_url, headers) as shopify:
+            pages = await asyncio.gather(*(shopify.graphql(query, variables) for variables in batch))
+    """
+
+    def __init__(self, shop_url, headers, concurrency=SHOPIFY_POOL_SIZE):
+        self.shop_url = shop_url
+        self.headers = headers
+        self.concurrency = concurrency
+        self.url = graphql_url(shop_url)
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self.concurrency),
+            headers={"Accept-Encoding": "gzip", **self.headers},
+            timeout=aiohttp.ClientTimeout(total=SHOPIFY_TIMEOUT),
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+
+    async def graphql(self, query, variables=None):
+        """
+        Returns:
+            dict: The decoded response body.
+
+        Raises:
+            ShopifyRequestError: If Shopify did not answer with HTTP 200.
+        """
+        payload = {"query": query}
+        if variables is not None:
+            payload["variables"] = variables
+
+        async with self._semaphore:
+            for attempt in range(throttle.THROTTLE_MAX_RETRIES + 1):
+                # the governor talks to Redis synchronously, off the event loop so other requests keep going
+                wait = await asyncio.to_thread(throttle.reserve, self.shop_url, query)
+                while wait:
+                    await asyncio.sleep(wait)
+                    wait = await asyncio.to_thread(throttle.reserve, self.shop_url, query)
+
+                async with self._session.post(self.url, json=payload) as response:
+                    status_code = response.status
+                    content = await response.read()
+                body = None
+                if status_code == 200:
+                    body = loads(content)
+                    await asyncio.to_thread(throttle.record, self.shop_url, query, body)
+
+                if not throttle.is_throttled(status_code, body) or attempt == throttle.THROTTLE_MAX_RETRIES:
+                    break
+
+                delay = throttle.retry_delay(self.shop_url, query, body, attempt)
+                logger.warning(f"Shopify throttled {self.shop_url}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+                await asyncio.sleep(delay)
+
+        if status_code != 200:
+            raise ShopifyRequestError(status_code, content.decode("utf-8", "replace"))
+        return body
+
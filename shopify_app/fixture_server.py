@@ -0,0 +1,557 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import logging
+logger = logging.getLogger(__name__)
+
+#####################################################################################################
+# local stand-in for the Shopify Admin API: answers the GraphQL queries and REST calls of the
+# ingestion, inventory and reorder paths from synthetic or recorded data, with configurable latency and a
+# simulated cost bucket. Point the app at it with SHOPIFY_BASE_URL, see shopify_fixture_server.
+#####################################################################################################
+
+PRODUCT_ID_BASE = 9_000_000_000
+COLLECTION_ID_BASE = 8_000_000_000
+ORDER_ID_BASE = 7_000_000_000
+
+# synthetic stock is split between an online warehouse and an offline store
+FIXTURE_LOCATIONS = [
+    {"id": "gid://shopify/Location/1", "name": "Warehouse", "isActive": True, "fulfillsOnlineOrders": True},
+    {"id": "gid://shopify/Location/2", "name": "Retail store", "isActive": True, "fulfillsOnlineOrders": False},
+]
+
+FIXTURE_SCOPES = ["write_products", "read_all_orders", "write_orders", "read_inventory", "read_locations"]
+
+FIXTURE_TAGS = ["new", "sale", "summer", "winter", "clearance", "bestseller", "limited", "basics"]
+
+FIXTURE_MAXIMUM_AVAILABLE = 1000
+FIXTURE_RESTORE_RATE = 50
+FIXTURE_MUTATION_COST = 10
+
+# field of a product node -> name that must appear in the query for the field to be returned
+PRODUCT_FIELD_NAMES = {
+    "title": "title",
+    "totalInventory": "totalInventory",
+    "createdAt": "createdAt",
+    "publishedAt": "publishedAt",
+    "updatedAt": "updatedAt",
+    "tags": "tags",
+    "images": "images",
+    "featuredImage": "featuredImage",
+    "variantsCount": "variantsCount",
+    "variants": "variants",
+}
+
+
+def _iso(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as jsonl:
+        return [json.loads(line) for line in jsonl if line.strip()]
+
+
+class FixtureShop:
+    """
+    The catalog served by the fixture server.
+
+    Synthetic products, collections and orders are derived from their index and
+    the seed, so two runs with the same sizes see the same data. Recorded node
+    rows (products.jsonl, collections.jsonl, orders.jsonl of a directory, e.g.
+    saved from real responses) replace the synthetic ones of the same kind;
+    recorded products carry their collection in `__collectionId`, or belong to
+    the first collection.
+    """
+
+    def __init__(self, products=1000, collections=1, orders=None, order_days=30, seed=0, recordings=None):
+        self.seed = seed
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.order_days = order_days
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.bulk_operations = []
+        self.stats = {"requests": 0, "throttled": 0, "reorder_moves": 0}
+        self._variant_levels = None
+        self._orders_by_id = None
+
+        recorded = {}
+        if recordings:
+            for kind in ("products", "collections", "orders"):
+                rows = _read_jsonl(os.path.join(recordings, f"{kind}.jsonl"))
+                if rows is not None:
+                    recorded[kind] = rows
+
+        if "collections" in recorded:
+            self.collections = recorded["collections"]
+        else:
+            self.collections = [self._collection(index) for index in range(collections)]
+        collection_ids = [collection["id"] for collection in self.collections]
+
+        self.collection_products = {collection_id: [] for collection_id in collection_ids}
+        if "products" in recorded:
+            self.products = recorded["products"]
+            for product in self.products:
+                collection_id = product.get("__collectionId", collection_ids[0])
+                self.collection_products.setdefault(collection_id, []).append(product)
+        else:
+            self.products = [self._product(index) for index in range(products)]
+            for index, product in enumerate(self.products):
+                self.collection_products[collection_ids[index % len(collection_ids)]].append(product)
+
+        for collection in self.collections:
+            collection["productsCount"] = {"count": len(self.collection_products.get(collection["id"], []))}
+
+        if "orders" in recorded:
+            self.orders = recorded["orders"]
+        else:
+            self.orders = [self._order(index) for index in range(len(self.products) if orders is None else orders)]
+        self.orders.sort(key=lambda order: order["createdAt"])
+
+    def _collection(self, index):
+        return {
+            "id": f"gid://shopify/Collection/{COLLECTION_ID_BASE + index}",
+            "title": f"Fixture collection {index}",
+            "updatedAt": _iso(self.now - timedelta(days=1)),
+            "ruleSet": None,
+        }
+
+    def _product(self, index):
+        rng = random.Random(self.seed * 1_000_003 + index)
+        created_at = self.now - timedelta(days=rng.randint(0, 720))
+        variants = []
+        for variant in range(rng.randint(1, 5)):
+            price = round(rng.uniform(5, 200), 2)
+            compare_at_price = round(price * rng.uniform(1.05, 1.6), 2) if rng.random() < 0.3 else None
+            variants.append({
+                "id": f"gid://shopify/ProductVariant/{(PRODUCT_ID_BASE + index) * 10 + variant}",
+                "price": f"{price:.2f}",
+                "compareAtPrice": f"{compare_at_price:.2f}" if compare_at_price else None,
+                "inventoryQuantity": rng.randint(0, 50) if rng.random() > 0.1 else 0,
+            })
+        image = {"src": f"https://cdn.example.com/products/{index}.jpg", "altText": None}
+        return {
+            "id": f"gid://shopify/Product/{PRODUCT_ID_BASE + index}",
+            "title": f"Fixture product {index}",
+            "totalInventory": sum(variant["inventoryQuantity"] for variant in variants),
+            "createdAt": _iso(created_at),
+            "publishedAt": _iso(created_at + timedelta(hours=1)),
+            "updatedAt": _iso(created_at + timedelta(days=rng.randint(0, 30))),
+            "tags": rng.sample(FIXTURE_TAGS, rng.randint(0, 3)),
+            "images": {"edges": [{"node": image}]},
+            "featuredImage": image,
+            "variantsCount": {"count": len(variants)},
+            "variants": {"edges": [{"node": variant} for variant in variants]},
+        }
+
+    def _order(self, index):
+        rng = random.Random(self.seed * 1_000_033 + index)
+        line_items = []
+        # about one order in 500 is a wholesale order with more line items than one page holds
+        line_item_count = rng.randint(300, 600) if rng.random() < 0.002 else rng.randint(1, 3)
+        for _ in range(line_item_count):
+            product = self.products[rng.randrange(len(self.products))] if self.products else None
+            price = product["variants"]["edges"][0]["node"]["price"] if product and "variants" in product else "10.00"
+            line_items.append({
+                "product": {"id": product["id"]} if product else None,
+                "quantity": rng.randint(1, 4),
+                "originalUnitPriceSet": {"shopMoney": {"amount": price}},
+            })
+        return {
+            "id": f"gid://shopify/Order/{ORDER_ID_BASE + index}",
+            "createdAt": _iso(self.now - timedelta(seconds=rng.randint(0, self.order_days * 24 * 60 * 60))),
+            "lineItems": {"edges": [{"node": line_item} for line_item in line_items]},
+        }
+
+    def variant_levels(self):
+        if self._variant_levels is None:
+            self._variant_levels = [
+                {
+                    "id": variant["node"]["id"],
+                    "product": {"id": product["id"]},
+                    "inventoryItem": {
+                        "id": variant["node"]["id"].replace("ProductVariant", "InventoryItem"),
+                        "inventoryLevels": {"edges": [
+                            {"node": {"location": {"id": location["id"]}, "quantities": [{"quantity": quantity}]}}
+                            for location, quantity in zip(
+                                FIXTURE_LOCATIONS,
+                                (variant["node"]["inventoryQuantity"] - variant["node"]["inventoryQuantity"] // 3,
+                                 variant["node"]["inventoryQuantity"] // 3),
+                            )
+                        ]},
+                    },
+                }
+                for product in self.products
+                for variant in product.get("variants", {}).get("edges", [])
+            ]
+        return self._variant_levels
+
+    def order(self, order_id):
+        if self._orders_by_id is None:
+            self._orders_by_id = {order["id"]: order for order in self.orders}
+        return self._orders_by_id.get(order_id)
+
+    def orders_between(self, start, end):
+        return [
+            order for order in self.orders
+            if (start is None or order["createdAt"] > start) and (end is None or order["createdAt"] < end)
+        ]
+
+
+class FixtureBucket:
+    """
+    Leaky cost bucket of the simulated shop, reported in `extensions.cost` like
+    Shopify does.
+    """
+
+    def __init__(self, maximum=FIXTURE_MAXIMUM_AVAILABLE, restore_rate=FIXTURE_RESTORE_RATE):
+        self.maximum = maximum
+        self.restore_rate = restore_rate
+        self.available = float(maximum)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, cost):
+        """
+        Returns:
+            tuple: (whether the points were taken, the cost extension to report)
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.maximum, self.available + (now - self.updated) * self.restore_rate)
+            self.updated = now
+            taken = self.available >= cost
+            if taken:
+                self.available -= cost
+            return taken, {
+                "requestedQueryCost": cost,
+                "actualQueryCost": cost if taken else None,
+                "throttleStatus": {
+                    "maximumAvailable": self.maximum,
+                    "currentlyAvailable": int(self.available),
+                    "restoreRate": self.restore_rate,
+                },
+            }
+
+
+def query_cost(query):
+    # rough estimate: the size of the outermost connection, plus 2 per connection
+    if query.lstrip().startswith("mutation"):
+        return FIXTURE_MUTATION_COST
+    sizes = re.findall(r"first:\s*(\d+)", query)
+    return int(sizes[0]) + 2 if sizes else 1
+
+
+def _after(query, variables):
+    cursor = (variables or {}).get("after")
+    if cursor is None:
+        match = re.search(r'after:\s*"([^"]*)"', query)
+        cursor = match.group(1) if match else None
+    return int(cursor) if cursor else 0
+
+
+def _page(rows, query, variables, shape=lambda row: row, size=None, offset=None):
+    if size is None:
+        size_match = re.search(r"first:\s*(\d+)", query)
+        size = int(size_match.group(1)) if size_match else 250
+    if offset is None:
+        offset = _after(query, variables)
+    page = rows[offset:offset + size]
+    return {
+        "edges": [{"cursor": str(offset + index + 1), "node": shape(row)} for index, row in enumerate(page)],
+        "pageInfo": {"hasNextPage": offset + size < len(rows), "endCursor": str(offset + len(page))},
+    }
+
+
+def _line_item_page_size(query):
+    match = re.search(r"lineItems\(first:\s*(\d+)", query)
+    return int(match.group(1)) if match else 250
+
+
+def _order_page(order, size, offset=0):
+    # first page of line items, as the orders query returns them
+    return {**order, "lineItems": _page(order["lineItems"]["edges"], "", {}, lambda edge: edge["node"], size, offset)}
+
+
+def _select_product(node, query):
+    selected = {"id": node["id"]}
+    for field, name in PRODUCT_FIELD_NAMES.items():
+        if field in node and re.search(rf"\b{name}\b", query):
+            selected[field] = node[field]
+    return selected
+
+
+def _created_at_bound(query, operator):
+    match = re.search(rf"created_at:{operator}=?'?([^' \"]+)'?", query)
+    if not match:
+        return None
+    return _iso(datetime.fromisoformat(match.group(1)).astimezone(timezone.utc))
+
+
+def _bulk_rows(shop, query):
+    """
+    The JSONL rows of a bulk query: every node of its connection, with the rows of
+    a nested connection written right after their parent and pointing back to it
+    through `__parentId`, as Shopify does. None if the query is not served.
+    """
+    rows = []
+
+    match = re.search(r'collection\(id:\s*"([^"]+)"\)', query)
+    if match:
+        for product in shop.collection_products.get(match.group(1), []):
+            node = _select_product(product, query)
+            variants = node.pop("variants", None)
+            rows.append(node)
+            if variants:
+                rows.extend({**edge["node"], "__parentId": node["id"]} for edge in variants["edges"])
+        return rows
+
+    if re.search(r"\borders\(", query):
+        for order in shop.orders_between(_created_at_bound(query, ">"), _created_at_bound(query, "<")):
+            rows.append({"id": order["id"], "createdAt": order["createdAt"]})
+            rows.extend({**edge["node"], "__parentId": order["id"]} for edge in order["lineItems"]["edges"])
+        return rows
+
+    if "productVariants" in query:
+        for variant in shop.variant_levels():
+            rows.append({"id": variant["id"], "product": variant["product"], "inventoryItem": {"id": variant["inventoryItem"]["id"]}})
+            rows.extend({**edge["node"], "__parentId": variant["id"]} for edge in variant["inventoryItem"]["inventoryLevels"]["edges"])
+        return rows
+
+    if re.search(r"\bcollections\b", query):
+        return list(shop.collections)
+
+    return None
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    shop = None
+    bucket = None
+    latency = 0.0
+    job_seconds = 0.0
+
+    def log_message(self, format, *args):
+        logger.debug(f"fixture server: {format % args}")
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        match = re.search(r"/bulk/(\d+)\.jsonl$", self.path)
+        if match:
+            self._send_bulk_result(int(match.group(1)))
+        else:
+            self._rest()
+
+    def _send_bulk_result(self, number):
+        operations = self.shop.bulk_operations
+        if not 0 < number <= len(operations):
+            self._send(404, {"errors": "Not Found"})
+            return
+        payload = "".join(json.dumps(row) + "\n" for row in operations[number - 1]["rows"]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/jsonl")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _bulk_operation(self, operation):
+        if operation is None:
+            return None
+        done = operation["ready_at"] <= time.monotonic()
+        number = operation["id"].split("/")[-1]
+        return {
+            "id": operation["id"],
+            "status": "COMPLETED" if done else "RUNNING",
+            "errorCode": None,
+            "objectCount": str(len(operation["rows"])) if done else "0",
+            # Shopify gives no result file when the query matched nothing
+            "url": f"http://{self.headers.get('Host')}/bulk/{number}.jsonl" if done and operation["rows"] else None,
+        }
+
+    def do_PUT(self):
+        self._rest()
+
+    def do_POST(self):
+        if not self.path.endswith("/graphql.json"):
+            self._rest()
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self.shop.lock:
+            self.shop.stats["requests"] += 1
+
+        payload = self._body()
+        query = payload.get("query", "")
+        variables = payload.get("variables") or {}
+
+        taken, cost = self.bucket.take(query_cost(query))
+        if not taken:
+            with self.shop.lock:
+                self.shop.stats["throttled"] += 1
+            self._send(200, {
+                "errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}],
+                "extensions": {"cost": cost},
+            })
+            return
+
+        try:
+            data = self._resolve(query, variables)
+        except Exception as e:
+            logger.exception("fixture server failed to answer a query")
+            self._send(500, {"errors": [{"message": str(e)}]})
+            return
+
+        if data is None:
+            self._send(200, {"errors": [{"message": "Query not served by the fixture server"}], "extensions": {"cost": cost}})
+        else:
+            self._send(200, {"data": data, "extensions": {"cost": cost}})
+
+    def _rest(self):
+        if self.latency:
+            time.sleep(self.latency)
+        match = re.search(r"/custom_collections/(\d+)\.json$", self.path)
+        if match and self.command == "PUT":
+            self._body()
+            self._send(200, {"custom_collection": {"id": int(match.group(1)), "sort_order": "manual"}})
+        else:
+            self._send(404, {"errors": "Not Found"})
+
+    def _resolve(self, query, variables):
+        shop = self.shop
+
+        if "collectionReorderProducts" in query:
+            with shop.lock:
+                shop.stats["reorder_moves"] += len(variables.get("moves", []))
+                job_id = f"gid://shopify/Job/{len(shop.jobs) + 1}"
+                shop.jobs[job_id] = time.monotonic() + self.job_seconds
+            return {"collectionReorderProducts": {"job": {"id": job_id, "done": not self.job_seconds}, "userErrors": []}}
+
+        if "nodes(ids" in query:
+            now = time.monotonic()
+            return {"nodes": [
+                {"id": job_id, "done": shop.jobs[job_id] <= now} if job_id in shop.jobs else None
+                for job_id in variables.get("ids", [])
+            ]}
+
+        if "bulkOperationRunQuery" in query:
+            rows = _bulk_rows(shop, variables.get("query", ""))
+            if rows is None:
+                return {"bulkOperationRunQuery": {
+                    "bulkOperation": None,
+                    "userErrors": [{"field": ["query"], "message": "Bulk query not served by the fixture server"}],
+                }}
+            with shop.lock:
+                operation = {
+                    "id": f"gid://shopify/BulkOperation/{len(shop.bulk_operations) + 1}",
+                    "rows": rows,
+                    "ready_at": time.monotonic() + self.job_seconds,
+                }
+                shop.bulk_operations.append(operation)
+            return {"bulkOperationRunQuery": {"bulkOperation": {"id": operation["id"], "status": "CREATED"}, "userErrors": []}}
+
+        if "currentBulkOperation" in query:
+            return {"currentBulkOperation": self._bulk_operation(shop.bulk_operations[-1] if shop.bulk_operations else None)}
+
+        if re.search(r"\bnode\(id:", query):
+            operation = next((operation for operation in shop.bulk_operations if operation["id"] == variables.get("id")), None)
+            return {"node": self._bulk_operation(operation)}
+
+        if "webhookSubscriptionCreate" in query:
+            return {"webhookSubscriptionCreate": {"webhookSubscription": {"id": "gid://shopify/WebhookSubscription/1"}, "userErrors": []}}
+
+        if "ordersCount" in query:
+            orders = shop.orders_between(_created_at_bound(query, ">"), _created_at_bound(query, "<"))
+            return {"ordersCount": {"count": len(orders), "precision": "EXACT"}}
+
+        if re.search(r"\borders\(", query):
+            orders = shop.orders_between(_created_at_bound(query, ">"), _created_at_bound(query, "<"))
+            size = _line_item_page_size(query)
+            return {"orders": _page(orders, query, variables, lambda order: _order_page(order, size))}
+
+        aliased_orders = re.findall(r'(\w+):\s*order\(id:\s*"([^"]+)"\)\s*\{\s*lineItems\(first:\s*(\d+),\s*after:\s*"(\d+)"\)', query)
+        if aliased_orders:
+            data = {}
+            for alias, order_id, size, cursor in aliased_orders:
+                order = shop.order(order_id)
+                data[alias] = _order_page(order, int(size), int(cursor)) if order else None
+            return data
+
+        match = re.search(r'collection\(id:\s*"([^"]+)"\)', query)
+        if match:
+            if match.group(1) not in shop.collection_products:
+                return {"collection": None}
+            products = shop.collection_products[match.group(1)]
+            products_query = query[query.index("products("):]
+            return {"collection": {"products": _page(products, products_query, variables, lambda node: _select_product(node, query))}}
+
+        if "productVariants(" in query:
+            variants = shop.variant_levels()
+            product_ids = {f"gid://shopify/Product/{product_id}" for product_id in re.findall(r"product_id:(\d+)", query)}
+            if product_ids:
+                variants = [variant for variant in variants if variant["product"]["id"] in product_ids]
+            return {"productVariants": _page(variants, query, variables)}
+
+        if "currentAppInstallation" in query:
+            return {"currentAppInstallation": {"accessScopes": [{"handle": scope} for scope in FIXTURE_SCOPES]}}
+
+        if "locations(" in query:
+            return {"locations": _page(FIXTURE_LOCATIONS, query, variables)}
+
+        if re.search(r"\bcollections\(", query):
+            return {"collections": _page(shop.collections, query, variables)}
+
+        if "inventoryItem(" in query:
+            return {"inventoryItem": None}
+
+        return None
+
+
+def make_server(shop, host="127.0.0.1", port=0, latency_ms=0, restore_rate=FIXTURE_RESTORE_RATE,
+                maximum_available=FIXTURE_MAXIMUM_AVAILABLE, job_seconds=0.0):
+    """
+    Builds the fixture HTTP server of `shop`; port 0 picks a free port, read it
+    back from server.server_address.
+
+    Args:
+        latency_ms (int): Delay added to every response.
+        restore_rate (int): Points per second the simulated cost bucket restores.
+        job_seconds (float): How long a reorder job or bulk operation runs before
+            it is reported done, 0 answers it as already done.
+    """
+    handler = type("BoundFixtureHandler", (FixtureHandler,), {
+        "shop": shop,
+        "bucket": FixtureBucket(maximum_available, restore_rate),
+        "latency": latency_ms / 1000,
+        "job_seconds": job_seconds,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_thread(server):
+    """
+    Runs `server` in a daemon thread and returns its base URL.
+    """
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
@@ -0,0 +1,369 @@
+from django.db import transaction
+from django.utils import timezone
+from .models import ClientProducts, ShopLocation, VariantInventory
+from .client import shopify_graphql, granted_scopes, missing_scopes
+from .bulk import use_bulk_operations, run_bulk_query, iter_jsonl, iter_bulk_objects, BulkOperationError
+
+import logging
+logger = logging.getLogger(__name__)
+
+#####################################################################################################
+# location inventory: the available quantity of every variant at every location, cached per variant
+# so total_inventory and variant_availability follow Client.stock_location without a product refetch
+#####################################################################################################
+
+VARIANT_PAGE_SIZE = 100
+INVENTORY_SCOPES = ("read_inventory", "read_locations")
+INVENTORY_BATCH_SIZE = 1000
+REFRESH_PRODUCTS_PER_QUERY = 50
+
+LOCATIONS_QUERY = """
+query($after: String) {
+    locations(first: 250, after: $after, includeInactive: true) {
+        edges {
+            cursor
+            node {
+                id
+                name
+                isActive
+                fulfillsOnlineOrders
+            }
+        }
+        pageInfo {
+            hasNextPage
+        }
+    }
+}
+"""
+
+VARIANT_LEVELS_SELECTION = """
+id
+product {
+    id
+}
+inventoryItem {
+    id
+    inventoryLevels%s {
+        edges {
+            node {
+                location {
+                    id
+                }
+                quantities(names: ["available"]) {
+                    quantity
+                }
+            }
+        }
+    }
+}
+"""
+
+
+class InventoryFetchError(Exception):
+    pass
+
+
+def _numeric_id(global_id):
+    return global_id.split("/")[-1]
+
+
+def _available(level):
+    return sum(quantity["quantity"] or 0 for quantity in level.get("quantities") or [])
+
+
+def fetch_locations(shop_url, headers):
+    """
+    Returns:
+        list: Location nodes of the shop, None if Shopify returned an error.
+    """
+    locations = []
+    cursor = None
+    while True:
+        response = shopify_graphql(shop_url, headers, LOCATIONS_QUERY, {"after": cursor} if cursor else {})
+        if response.status_code != 200:
+            logger.error(f"Error fetching locations: {response.status_code} - {response.text}")
+            return None
+
+        data = (response.json().get("data") or {}).get("locations")
+        if not data:
+            logger.error(f"No locations data available for {shop_url}")
+            return None
+
+        locations.extend(edge["node"] for edge in data["edges"])
+        if not data["pageInfo"]["hasNextPage"]:
+            return locations
+        cursor = data["edges"][-1]["cursor"]
+
+
+def iter_variant_levels(shop_url, headers, location_count, expected_rows=None, product_ids=None):
+    """
+    Yields the inventory of every variant of the shop, through a bulk operation
+    for large catalogs and paginated queries otherwise.
+
+    Args:
+        product_ids (list): Only the variants of these products, always paginated.
+
+    Yields:
+        tuple: (variant_id, product_id, inventory_item_id, {location_id: available})
+    """
+    if product_ids is None and use_bulk_operations(expected_rows):
+        query = f"""
+        {{
+            productVariants {{
+                edges {{
+                    node {{
+                        {VARIANT_LEVELS_SELECTION % ""}
+                    }}
+                }}
+            }}
+        }}
+        """
+        rows = iter_jsonl(run_bulk_query(shop_url, headers, query))
+        for variant, levels in iter_bulk_objects(rows, "ProductVariant"):
+            yield (
+                _numeric_id(variant["id"]),
+                _numeric_id(variant["product"]["id"]),
+                _numeric_id(variant["inventoryItem"]["id"]),
+                {_numeric_id(level["location"]["id"]): _available(level) for level in levels},
+            )
+        return
+
+    search = ""
+    if product_ids is not None:
+        search = ', query: "%s"' % " OR ".join(f"product_id:{product_id}" for product_id in product_ids)
+
+    query = f"""
+    query($after: String) {{
+        productVariants(first: {VARIANT_PAGE_SIZE}, after: $after{search}) {{
+            edges {{
+                cursor
+                node {{
+                    {VARIANT_LEVELS_SELECTION % f"(first: {max(location_count, 1)})"}
+                }}
+            }}
+            pageInfo {{
+                hasNextPage
+            }}
+        }}
+    }}
+    """
+    cursor = None
+    while True:
+        response = shopify_graphql(shop_url, headers, query, {"after": cursor} if cursor else {})
+        if response.status_code != 200:
+            raise InventoryFetchError(f"Error fetching inventory levels: {response.status_code} - {response.text}")
+
+        data = (response.json().get("data") or {}).get("productVariants")
+        if not data:
+            raise InventoryFetchError(f"No inventory levels data available for {shop_url}")
+
+        for edge in data["edges"]:
+            variant = edge["node"]
+            yield (
+                _numeric_id(variant["id"]),
+                _numeric_id(variant["product"]["id"]),
+                _numeric_id(variant["inventoryItem"]["id"]),
+                {
+                    _numeric_id(level["node"]["location"]["id"]): _available(level["node"])
+                    for level in variant["inventoryItem"]["inventoryLevels"]["edges"]
+                },
+            )
+
+        if not data["pageInfo"]["hasNextPage"]:
+            return
+        cursor = data["edges"][-1]["cursor"]
+
+
+def _store_variant_batch(shop_id, batch):
+    VariantInventory.objects.bulk_create(
+        [
+            VariantInventory(
+                shop_id=shop_id,
+                variant_id=variant_id,
+                product_id=product_id,
+                inventory_item_id=inventory_item_id,
+                levels=levels,
+            )
+            for variant_id, product_id, inventory_item_id, levels in batch
+        ],
+        update_conflicts=True,
+        unique_fields=["shop", "variant_id"],
+        update_fields=["product_id", "inventory_item_id", "levels", "updated_at"],
+    )
+
+
+def sync_inventory_levels(client):
+    """
+    Refreshes the shop's locations and the per-location inventory cache of every
+    variant, then applies it to the stored products.
+
+    Returns:
+        int: Number of variants cached, None if the locations could not be read
+        or the shop has not granted the inventory scopes yet.
+    """
+    headers = {"Content-Type": "application/json", "X-Shopify-Access-Token": client.access_token}
+
+    granted = granted_scopes(client.shop_url, headers)
+    if granted is None:
+        return None
+    missing = missing_scopes(granted, INVENTORY_SCOPES)
+    if missing:
+        # installed before the scopes were added, the merchant has to re-authorize through /auth/login/
+        logger.warning(f"{client.shop_url} has not granted {', '.join(missing)}, skipping the location inventory sync")
+        return None
+
+    locations = fetch_locations(client.shop_url, headers)
+    if locations is None:
+        return None
+
+    location_ids = []
+    for location in locations:
+        location_id = _numeric_id(location["id"])
+        location_ids.append(location_id)
+        ShopLocation.objects.update_or_create(
+            shop_id=client.shop_id,
+            location_id=location_id,
+            defaults={
+                "name": location["name"],
+                "fulfills_online_orders": location["fulfillsOnlineOrders"],
+                "is_active": location["isActive"],
+            },
+        )
+    ShopLocation.objects.filter(shop_id=client.shop_id).exclude(location_id__in=location_ids).delete()
+
+    started_at = timezone.now()
+    expected_rows = ClientProducts.objects.filter(shop_id=client.shop_id).count()
+    variant_count = 0
+    batch = []
+    for variant in iter_variant_levels(client.shop_url, headers, len(locations), expected_rows):
+        variant_count += 1
+        batch.append(variant)
+        if len(batch) == INVENTORY_BATCH_SIZE:
+            _store_variant_batch(client.shop_id, batch)
+            batch = []
+    if batch:
+        _store_variant_batch(client.shop_id, batch)
+
+    # variants deleted in Shopify were not rewritten by this sync
+    VariantInventory.objects.filter(shop_id=client.shop_id, updated_at__lt=started_at).delete()
+
+    logger.debug(f"cached inventory of {variant_count} variants at {len(location_ids)} locations for {client.shop_url}")
+    apply_location_inventory(client)
+    return variant_count
+
+
+def refresh_product_inventory(client, product_ids):
+    """
+    Re-reads the location levels of the variants of just fetched products and
+    applies them, so their total_inventory is not overwritten by a cache older
+    than the fetch. A catalog-sized list goes through sync_inventory_levels.
+
+    Returns:
+        bool: True if the products were counted from fresh levels, False if the
+        levels could not be read and the fetched inventory was left as is.
+    """
+    location_count = ShopLocation.objects.filter(shop_id=client.shop_id).count()
+    if not location_count:
+        # never synced (or the inventory scopes are missing), there is nothing to count by
+        return False
+
+    try:
+        if use_bulk_operations(len(product_ids)):
+            return sync_inventory_levels(client) is not None
+
+        headers = {"Content-Type": "application/json", "X-Shopify-Access-Token": client.access_token}
+        started_at = timezone.now()
+        for start in range(0, len(product_ids), REFRESH_PRODUCTS_PER_QUERY):
+            chunk = product_ids[start:start + REFRESH_PRODUCTS_PER_QUERY]
+            batch = list(iter_variant_levels(client.shop_url, headers, location_count, product_ids=chunk))
+            if batch:
+                _store_variant_batch(client.shop_id, batch)
+            VariantInventory.objects.filter(
+                shop_id=client.shop_id, product_id__in=chunk, updated_at__lt=started_at
+            ).delete()
+    except (InventoryFetchError, BulkOperationError) as e:
+        logger.error(f"Could not refresh the inventory levels of {client.shop_url}, keeping the fetched inventory: {e}")
+        return False
+
+    apply_location_inventory(client, product_ids)
+    return True
+
+
+def selected_location_ids(client):
+    """
+    Location ids counted for the client's stock_location: every active location,
+    the ones fulfilling online orders ("online") or the others ("offline").
+    """
+    locations = ShopLocation.objects.filter(shop_id=client.shop_id, is_active=True)
+    if client.stock_location == "online":
+        locations = locations.filter(fulfills_online_orders=True)
+    elif client.stock_location == "offline":
+        locations = locations.filter(fulfills_online_orders=False)
+    return set(locations.values_list("location_id", flat=True))
+
+
+def location_inventory(client, product_ids=None):
+    """
+    Sums the cached variant quantities at the client's selected locations.
+
+    Returns:
+        dict: product_id -> quantity, only for products with cached variants.
+    """
+    location_ids = selected_location_ids(client)
+    variants = VariantInventory.objects.filter(shop_id=client.shop_id)
+    if product_ids is not None:
+        variants = variants.filter(product_id__in=product_ids)
+
+    totals = {}
+    for product_id, levels in variants.values_list("product_id", "levels").iterator(chunk_size=INVENTORY_BATCH_SIZE):
+        quantity = sum(available for location_id, available in levels.items() if location_id in location_ids)
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    return totals
+
+
+def apply_location_inventory(client, product_ids=None):
+    """
+    Writes total_inventory and variant_availability of the stored products from
+    the location inventory cache, only for the rows whose value changed.
+
+    Returns:
+        int: Number of ClientProducts rows updated.
+    """
+    totals = location_inventory(client, product_ids)
+    if not totals:
+        return 0
+
+    stored = ClientProducts.objects.filter(shop_id=client.shop_id, product_id__in=list(totals)).only(
+        "product_id", "total_inventory", "variant_availability"
+    )
+    changed = []
+    for product in stored.iterator(chunk_size=INVENTORY_BATCH_SIZE):
+        quantity = totals[product.product_id]
+        if product.total_inventory != quantity or product.variant_availability != quantity:
+            product.total_inventory = quantity
+            product.variant_availability = quantity
+            changed.append(product)
+
+    with transaction.atomic():
+        ClientProducts.objects.bulk_update(changed, ["total_inventory", "variant_availability"], batch_size=INVENTORY_BATCH_SIZE)
+
+    logger.debug(f"location inventory ({client.stock_location}) changed {len(changed)} products of {client.shop_url}")
+    return len(changed)
+
+
+def apply_level_update(client, inventory_item_id, location_id, available):
+    """
+    Patches the cached quantity of one inventory item at one location, from an
+    inventory_levels/update webhook, and re-applies it to the product.
+
+    Returns:
+        str: The product id, None if the inventory item is not cached.
+    """
+    variant = VariantInventory.objects.filter(shop_id=client.shop_id, inventory_item_id=str(inventory_item_id)).first()
+    if not variant:
+        return None
+
+    variant.levels[str(location_id)] = available or 0
+    variant.save(update_fields=["levels", "updated_at"])
+    apply_location_inventory(client, [variant.product_id])
+    return variant.product_id
@@ -0,0 +1,145 @@
+import json
+import time
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from shopify_app.api import (
+    fetch_collections,
+    fetch_orders,
+    fetch_products_by_collection,
+    get_shop_orders,
+    invalidate_shop_orders,
+)
+from shopify_app.fixture_server import FixtureShop, make_server, serve_in_thread, COLLECTION_ID_BASE, FIXTURE_RESTORE_RATE
+from shopify_app.models import Client, ClientAlgo, ClientCollections, History
+from shopify_app.tasks import async_fetch_and_store_products, async_sort_product_order
+
+BENCHMARK_DAYS = 30
+BENCHMARK_BUCKETS = [
+    {"rule_name": "revenue_generated", "parameters": {"days": BENCHMARK_DAYS}},
+    {"rule_name": "new_products", "parameters": {"days": BENCHMARK_DAYS}},
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the ingestion and sort paths against the local fixture server at several catalog sizes. "
+        "Everything written to the database is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000", help="Comma separated product counts")
+        parser.add_argument("--orders-ratio", type=float, default=0.5, help="Orders generated per product")
+        parser.add_argument("--latency-ms", type=int, default=0, help="Delay added to every fixture response")
+        parser.add_argument("--restore-rate", type=int, default=FIXTURE_RESTORE_RATE, help="Cost points restored per second")
+        parser.add_argument(
+            "--bulk-threshold", type=int, default=0,
+            help="Fetch with bulk operations from this many rows, 0 times the paginated queries only",
+        )
+        parser.add_argument("--save", default=None, help="Write the timings to this JSON file")
+        parser.add_argument("--baseline", default=None, help="Fail when a timing regresses against this JSON file")
+        parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline, 0.25 = 25%%")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",") if size.strip()]
+        config = apps.get_app_config("shopify_app")
+        saved_config = (config.SHOPIFY_BASE_URL, config.BULK_OPERATION_THRESHOLD, config.ORDER_SYNC_INCREMENTAL)
+
+        results = {}
+        try:
+            # the fixture server answers both the paginated queries and bulk operations
+            config.BULK_OPERATION_THRESHOLD = options["bulk_threshold"]
+            config.ORDER_SYNC_INCREMENTAL = False
+            for size in sizes:
+                results[str(size)] = self._run(config, size, options)
+        finally:
+            config.SHOPIFY_BASE_URL, config.BULK_OPERATION_THRESHOLD, config.ORDER_SYNC_INCREMENTAL = saved_config
+
+        if options["save"]:
+            with open(options["save"], "w") as results_file:
+                json.dump(results, results_file, indent=2)
+            self.stdout.write(f"Timings saved to {options['save']}")
+
+        if options["baseline"]:
+            self._compare(results, options["baseline"], options["tolerance"])
+
+    def _run(self, config, size, options):
+        self.stdout.write(f"\n{size} products")
+        shop = FixtureShop(products=size, orders=int(size * options["orders_ratio"]))
+        server = make_server(shop, latency_ms=options["latency_ms"], restore_rate=options["restore_rate"])
+        config.SHOPIFY_BASE_URL = serve_in_thread(server)
+
+        timings = {}
+
+        def timed(stage, function, *args):
+            started = time.perf_counter()
+            result = function(*args)
+            timings[stage] = round(time.perf_counter() - started, 3)
+            self.stdout.write(f"  {stage:<32}{timings[stage]:>10.3f}s")
+            return result
+
+        try:
+            with transaction.atomic():
+                shop_id = f"benchmark-{size}"
+                shop_url = f"{shop_id}.myshopify.com"
+                client = Client.objects.create(
+                    shop_id=shop_id,
+                    shop_name=shop_id,
+                    email=f"{shop_id}@example.com",
+                    shop_url=shop_url,
+                    access_token="fixture",
+                    lookback_period=BENCHMARK_DAYS,
+                )
+                algo = ClientAlgo.objects.create(
+                    shop=client,
+                    algo_name="Benchmark",
+                    number_of_buckets=len(BENCHMARK_BUCKETS),
+                    bucket_parameters=BENCHMARK_BUCKETS,
+                )
+                ClientCollections.objects.create(
+                    collection_id=COLLECTION_ID_BASE,
+                    shop=client,
+                    collection_name="Benchmark",
+                    products_count=size,
+                    algo=algo,
+                )
+                history = History.objects.create(shop_id=client, requested_by="benchmark", product_count=0)
+                headers = {"Content-Type": "application/json", "X-Shopify-Access-Token": client.access_token}
+                invalidate_shop_orders(shop_url)
+
+                timed("fetch_collections", fetch_collections, shop_url)
+                timed("fetch_orders", fetch_orders, shop_url, BENCHMARK_DAYS, headers)
+                # the product fetch reads the order index from the shop's order cache
+                get_shop_orders(shop_url, BENCHMARK_DAYS, headers)
+                timed("fetch_products_by_collection", fetch_products_by_collection, shop_url, COLLECTION_ID_BASE, BENCHMARK_DAYS)
+                stored = timed(
+                    "async_fetch_and_store_products",
+                    async_fetch_and_store_products, shop_url, shop_id, COLLECTION_ID_BASE, BENCHMARK_DAYS,
+                )
+                if stored.get("status") != "success":
+                    raise CommandError(f"Storing products failed: {stored}")
+                timed("async_sort_product_order", async_sort_product_order, shop_id, COLLECTION_ID_BASE, algo.algo_id, history.id)
+
+                invalidate_shop_orders(shop_url)
+                transaction.set_rollback(True)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.stdout.write(f"  fixture server: {shop.stats}")
+        return timings
+
+    def _compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = []
+        for size, timings in results.items():
+            for stage, seconds in timings.items():
+                expected = baseline.get(size, {}).get(stage)
+                if expected and seconds > expected * (1 + tolerance):
+                    regressions.append(f"{stage} at {size} products: {seconds:.3f}s, baseline {expected:.3f}s")
+
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regression beyond {tolerance:.0%} of {baseline_path}"))
@@ -0,0 +1,36 @@
+import json
+import uuid
+import requests
+from django.core.management.base import BaseCommand
+from shopify_app.webhooks import CATALOG_WEBHOOKS, sign_webhook
+
+
+class Command(BaseCommand):
+    help = "Post a locally signed catalog webhook payload to a running backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument("topic", choices=sorted(CATALOG_WEBHOOKS), help="Webhook topic, e.g. PRODUCTS_UPDATE")
+        parser.add_argument("payload", help="Path of the JSON payload to send")
+        parser.add_argument("--shop", required=True, help="Shop domain sent as X-Shopify-Shop-Domain")
+        parser.add_argument("--base-url", default="http://localhost:8000", help="Backend base URL")
+        parser.add_argument("--secret", default=None, help="Signing secret, defaults to SHOPIFY_API_SECRET")
+
+    def handle(self, *args, **options):
+        with open(options["payload"], "rb") as payload_file:
+            body = payload_file.read()
+        json.loads(body)  # fail before sending an invalid payload
+
+        url = f"{options['base_url'].rstrip('/')}/auth/{CATALOG_WEBHOOKS[options['topic']]}"
+        headers = {
+            "Content-Type": "application/json",
+            "X-Shopify-Topic": "/".join(options["topic"].lower().rsplit("_", 1)),
+            "X-Shopify-Shop-Domain": options["shop"],
+            "X-Shopify-Webhook-Id": str(uuid.uuid4()),
+            "X-Shopify-Hmac-SHA256": sign_webhook(body, options["secret"]),
+        }
+
+        response = requests.post(url, data=body, headers=headers)
+        if response.ok:
+            self.stdout.write(self.style.SUCCESS(f"{options['topic']} accepted: {response.status_code} {response.text}"))
+        else:
+            self.stderr.write(self.style.ERROR(f"{options['topic']} rejected: {response.status_code} {response.text}"))
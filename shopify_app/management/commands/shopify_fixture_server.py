@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from shopify_app.fixture_server import FixtureShop, make_server, FIXTURE_RESTORE_RATE
+
+
+class Command(BaseCommand):
+    help = "Serve a local Shopify Admin API stand-in with synthetic or recorded data, use it with SHOPIFY_BASE_URL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--products", type=int, default=1000, help="Number of synthetic products")
+        parser.add_argument("--collections", type=int, default=1, help="Number of collections the products are spread over")
+        parser.add_argument("--orders", type=int, default=None, help="Number of synthetic orders, defaults to one per product")
+        parser.add_argument("--recordings", default=None, help="Directory of recorded products/collections/orders .jsonl node rows")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--latency-ms", type=int, default=0, help="Delay added to every response")
+        parser.add_argument("--restore-rate", type=int, default=FIXTURE_RESTORE_RATE, help="Cost points restored per second")
+        parser.add_argument("--job-seconds", type=float, default=0.0, help="How long reorder jobs and bulk operations take to complete")
+
+    def handle(self, *args, **options):
+        shop = FixtureShop(
+            products=options["products"],
+            collections=options["collections"],
+            orders=options["orders"],
+            seed=options["seed"],
+            recordings=options["recordings"],
+        )
+        server = make_server(
+            shop,
+            host=options["host"],
+            port=options["port"],
+            latency_ms=options["latency_ms"],
+            restore_rate=options["restore_rate"],
+            job_seconds=options["job_seconds"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Serving {len(shop.products)} products in {len(shop.collections)} collections and {len(shop.orders)} orders "
+            f"on http://{options['host']}:{server.server_address[1]}, set SHOPIFY_BASE_URL to it"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {shop.stats}")
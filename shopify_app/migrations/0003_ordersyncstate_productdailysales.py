@@ -0,0 +1,41 @@
+# Generated by Django 5.1.3 on 2024-12-02 10:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopify_app', '0002_alter_clientproducts_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('synced_from', models.DateTimeField(blank=True, null=True)),
+                ('last_order_created_at', models.DateTimeField(blank=True, null=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, to_field='shop_id')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.CharField(max_length=255)),
+                ('date', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=15)),
+                ('sold_units', models.IntegerField(default=0)),
+                ('last_order_at', models.DateTimeField(blank=True, null=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, to_field='shop_id')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['shop', 'date'], name='dailysales_shop_date_idx')],
+                'unique_together': {('shop', 'product_id', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.3 on 2024-12-04 09:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopify_app', '0003_ordersyncstate_productdailysales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopOrderCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('order_count', models.IntegerField(blank=True, null=True)),
+                ('synced_count', models.IntegerField(default=0)),
+                ('counted_at', models.DateTimeField(blank=True, null=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, to_field='shop_id')),
+            ],
+            options={
+                'unique_together': {('shop', 'month')},
+            },
+        ),
+    ]
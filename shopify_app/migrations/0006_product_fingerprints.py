@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2024-12-06 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopify_app', '0005_reorderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientcollections',
+            name='products_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='clientproducts',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
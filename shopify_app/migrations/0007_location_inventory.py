@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2024-12-09 10:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopify_app', '0006_product_fingerprints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location_id', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('fulfills_online_orders', models.BooleanField(default=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, to_field='shop_id')),
+            ],
+            options={
+                'unique_together': {('shop', 'location_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='VariantInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variant_id', models.CharField(max_length=255)),
+                ('product_id', models.CharField(max_length=255)),
+                ('inventory_item_id', models.CharField(db_index=True, max_length=255)),
+                ('levels', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, to_field='shop_id')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['shop', 'product_id'], name='variantinv_shop_product_idx')],
+                'unique_together': {('shop', 'variant_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2024-12-10 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopify_app', '0007_location_inventory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientalgo',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
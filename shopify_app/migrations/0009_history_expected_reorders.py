@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2024-12-10 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopify_app', '0008_clientalgo_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='expected_reorders',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -115,6 +115,7 @@ class ClientCollections(models.Model):
     collection_sold_units = models.IntegerField(default=0)
     never_active = models.BooleanField(default=True)
     is_smart = models.BooleanField(default=False)
+    products_synced_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ('shop', 'collection_id')  
@@ -143,6 +144,7 @@ class ClientProducts(models.Model):
     recency_score = models.FloatField(default=0)
     discount_absolute = models.FloatField(default=0.0, null=True)
     discount_percentage = models.FloatField(default=0.0, null=True)  
+    fingerprint = models.CharField(max_length=32, blank=True, default='')  # Shopify updatedAt + inventory + fetched fields
 
     def __str__(self):
         return f"Product {self.product_name} (ID: {self.product_id}) for shop_id {self.shop_id}"
@@ -158,6 +160,8 @@ class ClientAlgo(models.Model):
     bury_tags = models.JSONField(blank=True, default=list)
     bucket_parameters = models.JSONField(blank=True, default=dict)
     is_primary = models.BooleanField(default=False)
+    # bumped on every edit, compiled sort plans are cached per (algo_id, version)
+    version = models.PositiveIntegerField(default=1)
 
     def __str__(self):
         return f"{self.algo_name} - {self.shop_id}"
@@ -233,6 +237,78 @@ class ClientGraph(models.Model):
     def __str__(self):
         return f"Graph for {self.client.shop_id} on {self.date}"
 
+#incremental order sync
+class OrderSyncState(models.Model):
+    shop = models.OneToOneField(Client, on_delete=models.CASCADE, to_field='shop_id')
+    synced_from = models.DateTimeField(null=True, blank=True)
+    last_order_created_at = models.DateTimeField(null=True, blank=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Order sync for {self.shop_id} up to {self.last_order_created_at}"
+
+class ProductDailySales(models.Model):
+    shop = models.ForeignKey(Client, on_delete=models.CASCADE, to_field='shop_id')
+    product_id = models.CharField(max_length=255)
+    date = models.DateField()
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0.00)
+    sold_units = models.IntegerField(default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('shop', 'product_id', 'date')
+        indexes = [models.Index(fields=['shop', 'date'], name='dailysales_shop_date_idx')]
+
+    def __str__(self):
+        return f"Sales of product {self.product_id} for shop {self.shop_id} on {self.date}"
+
+#order metering
+class ShopOrderCount(models.Model):
+    shop = models.ForeignKey(Client, on_delete=models.CASCADE, to_field='shop_id')
+    month = models.DateField()  # first day of the month, UTC
+    order_count = models.IntegerField(null=True, blank=True)  # from Shopify's ordersCount
+    synced_count = models.IntegerField(default=0)  # orders folded by the incremental order sync
+    counted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('shop', 'month')
+
+    @property
+    def count(self):
+        return self.order_count if self.order_count is not None else self.synced_count
+
+    def __str__(self):
+        return f"{self.count} orders for shop {self.shop_id} in {self.month:%Y-%m}"
+
+#location inventory
+class ShopLocation(models.Model):
+    shop = models.ForeignKey(Client, on_delete=models.CASCADE, to_field='shop_id')
+    location_id = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    fulfills_online_orders = models.BooleanField(default=True)  # "online" locations of Client.stock_location
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        unique_together = ('shop', 'location_id')
+
+    def __str__(self):
+        return f"Location {self.name} of shop {self.shop_id}"
+
+class VariantInventory(models.Model):
+    shop = models.ForeignKey(Client, on_delete=models.CASCADE, to_field='shop_id')
+    variant_id = models.CharField(max_length=255)
+    product_id = models.CharField(max_length=255)
+    inventory_item_id = models.CharField(max_length=255, db_index=True)
+    levels = models.JSONField(default=dict)  # location_id -> available quantity
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('shop', 'variant_id')
+        indexes = [models.Index(fields=['shop', 'product_id'], name='variantinv_shop_product_idx')]
+
+    def __str__(self):
+        return f"Inventory of variant {self.variant_id} for shop {self.shop_id}"
+
 #BillingToken
 class BillingTokens(models.Model):
     TOKEN_STATUS_CHOICES = [
@@ -273,6 +349,29 @@ class History(models.Model):
     product_count = models.PositiveIntegerField()
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     collection_name = models.CharField(max_length=255)
+    # reorders the entry waits for when it covers several collections, None for a single sort
+    expected_reorders = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.collection_name} - {self.status} - {self.requested_by}"
+
+
+#collection reorder jobs
+class ReorderJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed')
+    ]
+
+    shop = models.ForeignKey(Client, on_delete=models.CASCADE, to_field='shop_id')
+    collection = models.ForeignKey(ClientCollections, on_delete=models.CASCADE, to_field='collection_id')
+    history = models.ForeignKey(History, on_delete=models.SET_NULL, null=True, blank=True)
+    job_ids = models.JSONField(default=list)  # Shopify Job ids still running, one per batch of moves
+    product_ids = models.JSONField(default=list)  # the sorted order, stored as positions once done
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Reorder of collection {self.collection_id} - {self.status}"
@@ -1,16 +1,30 @@
 # shopify_app/tasks.py
-from celery import shared_task, chord
+from celery import shared_task, chord, chain
 from django.db import transaction
 from django.db.models import Sum
 from django.utils import timezone
 from django.utils.timezone import now
+from django.utils.dateparse import parse_datetime
 from datetime import datetime, timedelta
-from .models import Client, ClientCollections, ClientProducts, ClientAlgo, ClientGraph , Usage, Subscription, SortingPlan, History
+from .models import Client, ClientCollections, ClientProducts, ClientAlgo, ClientGraph , Usage, Subscription, SortingPlan, History, ShopOrderCount, VariantInventory
 from .api import (
     fetch_collections,
     fetch_products_by_collection,
+    iter_products_by_collection,
+    iter_shop_product_pages,
     update_collection_products_order,
+    prune_order_rollups,
+    meter_shop_orders,
+    invalidate_shop_orders,
+    poll_reorder_jobs,
+    record_failed_reorder,
+    get_product_order_index,
+    OrderFetchError,
+    EMPTY_ORDER_METRICS,
 )
+from .webhooks import apply_product_update, apply_inventory_level_update, apply_order_create
+from .inventory import sync_inventory_levels, apply_location_inventory, refresh_product_inventory
+from django.apps import apps
 from home.strategies import (
     promote_new,
     promote_high_revenue_products,
@@ -25,30 +39,11 @@ from home.strategies import (
     push_pinned_products_to_top
 ) 
 
-from home.rules import (
-    new_products,
-    revenue_generated,
-    inventory_quantity,
-    variant_availability_ratio,
-    product_inventory,
-    Number_of_sales,
-    product_tags,
-    product_inventory,
-    i_am_feeling_lucky,
-    rfm_sort
-)
+from home.columnar import ProductColumns, evaluate_rule
+from home.rules import normalize_timestamps, RULE_FUNCTIONS
+from .algo_plans import algo_plan
 
-ALGO_ID_TO_FUNCTION = {
-    "new_products": new_products,  
-    "revenue_generated": revenue_generated,  
-    "inventory_quantity": inventory_quantity,  
-    "variant_availability_ratio": variant_availability_ratio,  
-    "Number_of_sales": Number_of_sales, 
-    "product_tags": product_tags,  
-    "product_inventory": product_inventory,
-    "i_am_feeling_lucky":i_am_feeling_lucky,
-    "rfm_sort":rfm_sort
-}
+ALGO_ID_TO_FUNCTION = RULE_FUNCTIONS
 
 from decimal import Decimal
 import logging
@@ -106,91 +101,292 @@ def async_fetch_and_store_collections(shop_id):
 
             if not created:
                 logger.debug(f"Updating existing collection: {collection_name}")
+                # the collection's updatedAt and product count are its fingerprint
+                if (
+                    client_collection.updated_at != parse_datetime(updated_at)
+                    or client_collection.products_count != products_count
+                ):
+                    client_collection.refetch = True
                 client_collection.collection_name = collection_name
                 client_collection.products_count = products_count
                 client_collection.updated_at = updated_at
-                client_collection.refetch = True
                 client_collection.is_smart = is_smart
                 client_collection.save()
 
         logger.info(f"Collections fetched and stored for shop_id: {shop_id}, total: {len(collections)}")
+        async_fetch_and_store_shop_products.delay(shop_id)
         return {"status": "success", "collections_fetched": len(collections)}
 
     except Exception as e:
         logger.error(f"Error fetching and storing collections for shop_id {shop_id}: {str(e)}")
         return {"status": "error", "message": str(e)}
     
-@shared_task
-def async_fetch_and_store_products(shop_url, shop_id, collection_id, days):
-    try:
-        logger.info(f"Starting product fetch for shop_id: {shop_id}, collection_id: {collection_id}, days: {days}")
-
-        products = fetch_products_by_collection(shop_url, collection_id, days)
-        logger.debug(f"Fetched {len(products)} products from collection_id {collection_id} for shop_id {shop_id}")
-
-        total_revenue = 0  
-        total_sales = 0
+# build_product_data key -> ClientProducts column of the product fields the fetch may skip
+PRODUCT_FIELD_COLUMNS = {
+    "title": "product_name",
+    "image": "image_link",
+    "listed_date": "created_at",
+    "tags": "tags",
+    "updated_at": "updated_at",
+    "published_at": "published_at",
+    "variants_count": "variant_count",
+    "variant_availability": "variant_availability",
+    "totalInventory": "total_inventory",
+    "discount_absolute": "discount_absolute",
+    "discount_percentage": "discount_percentage",
+    "fingerprint": "fingerprint",
+}
 
-        if products:
-            logger.info(f"Products fetched successfully: {len(products)}")
+def _metrics_changed(stored, metrics):
+    return (
+        round(float(stored["total_revenue"]), 2) != round(metrics["total_revenue"], 2)
+        or stored["total_sold_units"] != metrics["total_sold_units"]
+        or round(float(stored["sales_velocity"]), 2) != round(metrics["sales_velocity"], 2)
+        or stored["recency_score"] != metrics["recency_score"]
+    )
+
+def _store_product_page(shop_id, collection_id, products):
+    page_revenue = 0
+    page_sales = 0
+    written = 0
+
+    stored_products = {
+        row["product_id"]: row
+        for row in ClientProducts.objects.filter(product_id__in=[product.get("id") for product in products]).values(
+            "product_id", "collection_id", "fingerprint", "total_revenue", "total_sold_units", "sales_velocity", "recency_score"
+        )
+    }
 
+    with transaction.atomic():
         for product in products:
             product_id = product.get("id")
-            product_name = product.get("title", "")
-            image_link = product.get("image")
-            created_at = product.get("listed_date", "")
-            updated_at = product.get("updated_at", "")
-            published_at = product.get("published_at", "")
-            total_inventory = product.get("totalInventory", 0)
-            tags = product.get("tags", [])
-            variant_count = product.get("variants_count", 0)
-            variant_availability = product.get("variant_availability", 0)
             revenue = product.get("revenue", 0.00)  
             sales_velocity = product.get("sales_velocity", 0.00)
             total_sold_units = product.get("total_sold_units", 0)
             recency_score = product.get("recency_score", None)
-            discount_percentage = product.get('discount_percentage')
-            discount_absolute = product.get('discount_absolute')
 
-            total_revenue += revenue
-            total_sales += total_sold_units
+            page_revenue += revenue
+            page_sales += total_sold_units
+
+            metrics = {
+                'total_revenue': float(revenue),
+                'total_sold_units': total_sold_units,
+                'sales_velocity': float(sales_velocity),
+                'recency_score': recency_score,
+            }
+
+            # unchanged in Shopify: only the order-derived metrics can be stale
+            stored = stored_products.get(product_id)
+            if (
+                stored
+                and str(stored["collection_id"]) == str(collection_id)
+                and product.get("fingerprint")
+                and stored["fingerprint"] == product["fingerprint"]
+            ):
+                if _metrics_changed(stored, metrics):
+                    ClientProducts.objects.filter(product_id=product_id).update(**metrics)
+                    written += 1
+                continue
+
+            logger.debug(f"Updating product in database: {product.get('title', '')} (ID: {product_id})")
+
+            defaults = {
+                'shop_id': shop_id,
+                'collection_id': collection_id,
+                **metrics,
+            }
+            # columns of fields left out of the planned product query keep their stored values
+            for key, column in PRODUCT_FIELD_COLUMNS.items():
+                if key in product:
+                    defaults[column] = product[key]
+
+            ClientProducts.objects.update_or_create(product_id=product_id, defaults=defaults)
+            written += 1
+
+    logger.debug(f"{written} of {len(products)} products written for collection_id {collection_id}")
+    return page_revenue, page_sales
+
+def _product_fetch_due(collection):
+    # unchanged since a recent sync, see the refetch flag
+    max_age = timedelta(hours=apps.get_app_config("shopify_app").PRODUCT_SYNC_MAX_AGE_HOURS)
+    return (
+        collection["refetch"]
+        or not collection["products_synced_at"]
+        or collection["products_synced_at"] <= now() - max_age
+    )
+
+def _refresh_skipped_order_metrics(client, collection_ids, days):
+    """
+    Rewrites the order metrics of the stored products of collections whose
+    product fetch was skipped, from the order index (rollups or the shop's
+    order cache), so their sales stay current without refetching products.
+
+    Returns:
+        int: Number of products whose metrics changed, None if the orders
+        could not be read and the stored metrics were kept.
+    """
+    headers = {"Content-Type": "application/json", "X-Shopify-Access-Token": client.access_token}
+    try:
+        order_index = get_product_order_index(client, days, headers)
+    except OrderFetchError as e:
+        logger.error(f"Keeping the stored order metrics of {len(collection_ids)} collections of shop_id {client.shop_id}: {str(e)}")
+        return None
+
+    stored_products = ClientProducts.objects.filter(shop_id=client.shop_id, collection_id__in=collection_ids).values(
+        "product_id", "collection_id", "total_revenue", "total_sold_units", "sales_velocity", "recency_score"
+    )
+    totals = {int(collection_id): [0, 0] for collection_id in collection_ids}
+    written = 0
+    with transaction.atomic():
+        for stored in list(stored_products):
+            order_metrics = order_index.get(f"gid://shopify/Product/{stored['product_id']}", EMPTY_ORDER_METRICS)
+            metrics = {
+                'total_revenue': float(order_metrics["revenue"]),
+                'total_sold_units': order_metrics["total_sold_units"],
+                'sales_velocity': float(order_metrics["sales_velocity"]),
+                'recency_score': order_metrics["recency_score"],
+            }
+            totals[stored["collection_id"]][0] += metrics["total_revenue"]
+            totals[stored["collection_id"]][1] += metrics["total_sold_units"]
+
+            if _metrics_changed(stored, metrics):
+                ClientProducts.objects.filter(product_id=stored["product_id"]).update(**metrics)
+                written += 1
+
+        for collection_id, (total_revenue, total_sales) in totals.items():
+            ClientCollections.objects.filter(collection_id=collection_id).update(
+                collection_total_revenue=total_revenue,
+                collection_sold_units=total_sales,
+            )
 
-            logger.debug(f"here is the total sales of the collection {total_sales}")
-            logger.debug(f"Updating product in database: {product_name} (ID: {product_id})")
+    logger.debug(f"Order metrics of {written} products refreshed in {len(collection_ids)} skipped collections of shop_id {client.shop_id}")
+    return written
 
-            ClientProducts.objects.update_or_create(
-                product_id=product_id,
-                defaults={
-                    'shop_id': shop_id,
-                    'collection_id': collection_id,
-                    'product_name': product_name,
-                    'image_link': image_link,
-                    'created_at': created_at,   
-                    'tags': tags,
-                    'updated_at': updated_at,
-                    'published_at': published_at,
-                    'total_revenue': float(revenue),
-                    'variant_count': variant_count,
-                    'variant_availability': variant_availability,
-                    'total_inventory': total_inventory,
-                    'total_sold_units': total_sold_units,
-                    'sales_velocity': float(sales_velocity),
-                    'recency_score': recency_score,
-                    'discount_absolute':discount_absolute,
-                    'discount_percentage': discount_percentage  
-                }
+@shared_task
+def async_fetch_and_store_products(shop_url, shop_id, collection_id, days):
+    try:
+        logger.info(f"Starting product fetch for shop_id: {shop_id}, collection_id: {collection_id}, days: {days}")
+
+        collections = ClientCollections.objects.filter(collection_id=collection_id, shop_id=shop_id)
+        collection = collections.values("refetch", "products_synced_at").first()
+        if collection and not _product_fetch_due(collection):
+            logger.info(f"Collection {collection_id} unchanged since {collection['products_synced_at']}, skipping product fetch")
+            refreshed = _refresh_skipped_order_metrics(Client.objects.get(shop_id=shop_id), [collection_id], days)
+            return {"status": "skipped", "products_fetched": 0, "metrics_refreshed": refreshed}
+
+        # cleared up front so a change flagged while this sync runs is not lost
+        collections.update(refetch=False)
+
+        total_revenue = 0  
+        total_sales = 0
+        products_fetched = 0
+
+        # each page is stored before the next one is requested
+        for products in iter_products_by_collection(shop_url, collection_id, days):
+            page_revenue, page_sales = _store_product_page(shop_id, collection_id, products)
+            total_revenue += page_revenue
+            total_sales += page_sales
+            products_fetched += len(products)
+            logger.debug(f"Stored {products_fetched} products of collection_id {collection_id} so far, total sales {total_sales}")
+
+        logger.debug(f"Fetched {products_fetched} products from collection_id {collection_id} for shop_id {shop_id}")
+
+        # the fetched totalInventory counts every location, recount it from levels read after the fetch
+        client = Client.objects.get(shop_id=shop_id)
+        if client.stock_location != 'all':
+            refresh_product_inventory(
+                client, list(ClientProducts.objects.filter(collection_id=collection_id).values_list("product_id", flat=True))
             )
 
-        ClientCollections.objects.filter(collection_id=collection_id, shop_id=shop_id).update(
+        collections.update(
             collection_total_revenue=total_revenue,
-            collection_sold_units=total_sales
+            collection_sold_units=total_sales,
+            products_synced_at=now(),
         )
 
         logger.info(f"Product fetch and store completed for shop_id: {shop_id}, collection_id: {collection_id}")
-        return {"status": "success", "products_fetched": len(products), "total_revenue": total_revenue}
+        return {"status": "success", "products_fetched": products_fetched, "total_revenue": total_revenue}
     
     except Exception as e:
         logger.error(f"Error storing products for shop_id {shop_id}, collection_id {collection_id}: {str(e)}")
+        ClientCollections.objects.filter(collection_id=collection_id, shop_id=shop_id).update(refetch=True)
+        return {"status": "error", "message": str(e)}
+
+@shared_task
+def async_fetch_and_store_shop_products(shop_id, collection_ids=None):
+    """
+    Refreshes the stored products of many collections of a shop at once through
+    the shop-level fetch coordinator, so a full-shop refresh takes about as long
+    as its slowest collection. Defaults to the shop's active collections; the
+    ones unchanged since a recent sync are skipped.
+    """
+    try:
+        client = Client.objects.get(shop_id=shop_id)
+        collections = ClientCollections.objects.filter(shop_id=shop_id)
+        if collection_ids is None:
+            collections = collections.filter(status=True)
+        else:
+            collections = collections.filter(collection_id__in=collection_ids)
+
+        due = []
+        skipped = []
+        for collection in collections.values("collection_id", "refetch", "products_synced_at"):
+            (due if _product_fetch_due(collection) else skipped).append(collection["collection_id"])
+
+        # the products of the skipped collections are unchanged, their sales are not
+        if skipped:
+            _refresh_skipped_order_metrics(client, skipped, client.lookback_period)
+
+        if not due:
+            logger.info(f"No collection of shop_id {shop_id} needs a product fetch")
+            return {"status": "skipped", "products_fetched": 0}
+
+        logger.info(f"Starting product fetch of {len(due)} collections for shop_id: {shop_id}")
+        # cleared up front so a change flagged while this sync runs is not lost
+        ClientCollections.objects.filter(collection_id__in=due).update(refetch=False)
+
+        totals = {collection_id: [0, 0] for collection_id in due}
+        failed = set()
+        products_fetched = 0
+        try:
+            for collection_id, products in iter_shop_product_pages(client, due, client.lookback_period):
+                if products is None:
+                    failed.add(collection_id)
+                    continue
+                page_revenue, page_sales = _store_product_page(shop_id, collection_id, products)
+                totals[collection_id][0] += page_revenue
+                totals[collection_id][1] += page_sales
+                products_fetched += len(products)
+        except Exception:
+            failed.update(due)
+            raise
+        finally:
+            if failed:
+                ClientCollections.objects.filter(collection_id__in=failed).update(refetch=True)
+
+        synced = [collection_id for collection_id in due if collection_id not in failed]
+        for collection_id in synced:
+            total_revenue, total_sales = totals[collection_id]
+            ClientCollections.objects.filter(collection_id=collection_id).update(
+                collection_total_revenue=total_revenue,
+                collection_sold_units=total_sales,
+                products_synced_at=now(),
+            )
+
+        # the fetched totalInventory counts every location, recount it from levels read after the fetch
+        if client.stock_location != 'all':
+            refresh_product_inventory(
+                client, list(ClientProducts.objects.filter(collection_id__in=synced).values_list("product_id", flat=True).distinct())
+            )
+
+        logger.info(f"Fetched {products_fetched} products of {len(synced)} collections for shop_id {shop_id}, {len(failed)} failed")
+        return {"status": "success", "products_fetched": products_fetched, "collections_failed": len(failed)}
+
+    except Client.DoesNotExist:
+        logger.error(f"Client not found for shop_id {shop_id}")
+        return {"status": "error", "message": f"Client not found for shop_id {shop_id}"}
+    except Exception as e:
+        logger.error(f"Error storing products for shop_id {shop_id}: {str(e)}")
         return {"status": "error", "message": str(e)}
 
 @shared_task #not ussing i guess
@@ -286,13 +482,10 @@ def async_cron_sort_product_order(shop_id, collection_id, algo_id):
         logger.info(f"Total products sorted: {len(new_order)}")
 
         pid = pid_extractor(new_order)
-        success = update_collection_products_order(client.shop_url, client.access_token, collection_id, pid)
-
-        for index, product_id in enumerate(pid):
-            ClientProducts.objects.filter(product_id=product_id, collection_id=collection_id).update(position_in_collection=index + 1)
+        success = update_collection_products_order(client.shop_url, client.access_token, collection_id, pid) is not None
 
         if success:
-            logger.info("Product order updated successfully!")
+            logger.info("Product order sent successfully!")
         return success
 
     except Exception as e:
@@ -312,21 +505,24 @@ def async_sort_product_order(shop_id, collection_id, algo_id, history_entry_id):
         history_entry = History.objects.get(id=history_entry_id)
         
         history_entry.started_at = datetime.now()
-        history_entry.save()
+        history_entry.save(update_fields=["started_at"])
         
         client = Client.objects.get(shop_id=shop_id)
         logger.info(f"Client found: {client}")
         
         client_collection = ClientCollections.objects.get(shop_id=shop_id, collection_id=collection_id)
         logger.info(f"Client collection found: {client_collection}")
-        
-        days = client.lookback_period  
+
+        plan = algo_plan(algo_id)
+        logger.info(f"Algorithm plan: {plan.algo_id} v{plan.version}, {len(plan.buckets)} buckets")
         
         products = ClientProducts.objects.filter(shop_id=shop_id, collection_id=collection_id).values(
             "product_id", "product_name", "total_sold_units", "created_at", "updated_at", "published_at", 
             "tags", "variant_count", "variant_availability", "total_revenue", "total_inventory", 
             "sales_velocity", "recency_score"
         )
+        # dates parsed once here, the bucket rules read the <field>_epoch keys
+        products = normalize_timestamps(products, plan.date_fields)
         logger.info(f"Total products fetched from database: {len(products)}")
 
         total_collection_revenue = sum(product['total_revenue'] for product in products)
@@ -362,45 +558,32 @@ def async_sort_product_order(shop_id, collection_id, algo_id, history_entry_id):
 
         logger.info(f"Out-of-stock products segregated: {len(products)} products, {len(ofs_pinned)} pinned, {len(ofs_products)} out-of-stock products")
 
-        client_algo = ClientAlgo.objects.get(algo_id=algo_id)
-        logger.info(f"Client algorithm found: {client_algo}")
-
-        boost_tags = client_algo.boost_tags
-        bury_tags = client_algo.bury_tags
-        buckets = client_algo.bucket_parameters
+        boost_tags = plan.boost_tags
+        bury_tags = plan.bury_tags
         
-        logger.info(f"Boost tags: {boost_tags}, Bury tags: {bury_tags}, Buckets: {buckets}")
-
-        boost_tag_products = [product for product in products if any(tag in product["tags"] for tag in boost_tags)]
-        new_order.extend(boost_tag_products)
-
-        products = [product for product in products if product not in boost_tag_products]
-
-        bury_tag_products = [product for product in products if any(tag in product["tags"] for tag in bury_tags)]
-        products = [product for product in products if product not in bury_tag_products]
-
-        if isinstance(buckets, dict):
-            buckets = [buckets]
-            
-        for bucket in buckets:
-            logger.info(f"Processing bucket: {bucket}")
-
-            rule_name = bucket.get("rule_name")
-            rule_params = bucket.get("parameters", {})
-            capping = rule_params.pop("capping", None)
-
-            sort_function = ALGO_ID_TO_FUNCTION.get(rule_name)
-            if sort_function:
-                logger.info(f"Sorting function found for rule: {rule_name}")
-
-                capped_products, uncapped_products = sort_function(products, capping=capping, **rule_params)
+        logger.info(f"Boost tags: {boost_tags}, Bury tags: {bury_tags}, Buckets: {[bucket.rule_name for bucket in plan.buckets]}")
+
+        # the buckets run over typed columns of the products, see home/columnar.py. Boost and bury
+        # tags are looked up in its tag index, boosted products first, buried ones last
+        columns = ProductColumns(products)
+        boost_rows = columns.tagged_rows(boost_tags)
+        bury_rows = columns.tagged_rows(bury_tags, boost_rows)
+        new_order.extend(columns.take(boost_rows))
+        bury_tag_products = columns.take(bury_rows)
+        remaining_rows = columns.all_rows(boost_rows, bury_rows)
+        logger.info(f"Boost tag products: {len(boost_rows)}, bury tag products: {len(bury_rows)}")
+
+        for bucket in plan.buckets:
+            logger.info(f"Processing bucket: {bucket.rule_name} capping={bucket.capping} {dict(bucket.parameters)}")
+
+            capped_rows, uncapped_rows = evaluate_rule(
+                columns, remaining_rows, bucket.rule_name, bucket.rule_function, capping=bucket.capping, **bucket.parameters
+            )
 
-                if capped_products:
-                    new_order.extend(capped_products)
+            if len(capped_rows):
+                new_order.extend(columns.take(capped_rows))
 
-                products = uncapped_products if uncapped_products else products
-            else:
-                logger.warning(f"No sort function found for rule: {rule_name}")
+            remaining_rows = uncapped_rows if len(uncapped_rows) else remaining_rows
 
         new_order.extend(bury_tag_products)
         new_order.extend(ofs_pinned)
@@ -409,39 +592,42 @@ def async_sort_product_order(shop_id, collection_id, algo_id, history_entry_id):
         logger.info(f"Total products sorted: {len(new_order)}")
         
         pid = pid_extractor(new_order)
-        success = update_collection_products_order(client.shop_url, client.access_token, collection_id, pid)
+        history_entry.product_count = ClientProducts.objects.filter(shop_id=shop_id,collection_id=collection_id).count()
+        history_entry.save(update_fields=["product_count"])
 
-        for index, product_id in enumerate(pid):
-            ClientProducts.objects.filter(product_id=product_id, collection_id=collection_id).update(position_in_collection=index + 1)
+        # the history entry is settled when Shopify reports the reorder jobs done, see poll_reorder_jobs
+        reorder_job = update_collection_products_order(client.shop_url, client.access_token, collection_id, pid, history_entry)
 
-        if success:
+        if reorder_job is None:
+            logger.error("Product order update rejected by Shopify")
+        elif reorder_job.status == 'done':
             logger.info("Product order updated successfully!")
-            history_entry.status = 'Done'
-            history_entry.product_count = ClientProducts.objects.filter(shop_id=shop_id,collection_id=collection_id).count()
-            client_collection.sort_date = now()
-            client_collection.save()
-            
-            client.sort_date = now()
-            client.save()
         else:
-            history_entry.status = 'Failed'
-            
-        history_entry.ended_at = now()
-        history_entry.save()    
+            logger.info(f"Product order sent, waiting for Shopify jobs: {reorder_job.job_ids}")
         
         return shop_id
 
     except Exception as e:
         logger.error(f"Error in async task: {str(e)}")
-        history_entry.status = 'Failed'
-        history_entry.ended_at = now()
-        history_entry.save()
+        recorded = False
+        if history_entry.expected_reorders is not None:
+            # one collection of a run, the entry is settled once every collection is accounted for
+            try:
+                record_failed_reorder(shop_id, collection_id, history_entry.id)
+                recorded = True
+            except Exception as record_error:
+                logger.error(f"Could not record the failed sort of collection {collection_id}: {str(record_error)}")
+        if not recorded:
+            history_entry.status = 'Failed'
+            history_entry.ended_at = now()
+            history_entry.save()
         
         return False
 
 @shared_task
 def sort_active_collections(client_id):
     history_entry = None  
+    triggered = False
     try:
         client = Client.objects.get(id=client_id)
         logger.info(f"Sorting active collections for client {client.shop_id}")
@@ -472,6 +658,10 @@ def sort_active_collections(client_id):
             history_entry.save()
             return
 
+        # settled once every collection's reorder completed or failed, see settle_reorder_history
+        history_entry.expected_reorders = active_collections.count()
+        history_entry.save(update_fields=["expected_reorders"])
+
         tasks = []
         for collection in active_collections:
             collection_id = collection.collection_id
@@ -479,9 +669,15 @@ def sort_active_collections(client_id):
 
             logger.info(f"Triggering async sort for collection {collection_id} of client {client.shop_id}")
             
-            tasks.append(async_sort_product_order.s(client.shop_id, collection_id, algo_id, history_entry.id))
-
-        chord(tasks)(calculate_revenue.s(client.shop_id))
+            tasks.append(async_sort_product_order.si(client.shop_id, collection_id, algo_id, history_entry.id))
+
+        # one concurrent fetch of the changed collections runs first, as its own task; it reports
+        # errors in its result instead of raising, so a failed fetch still lets the sorts run
+        chain(
+            async_fetch_and_store_shop_products.si(client.shop_id),
+            chord(tasks, calculate_revenue.s(client.shop_id)),
+        ).apply_async()
+        triggered = True
         logger.info(f"Completed triggering sorting for all active collections of client {client.shop_id}")
 
     except Client.DoesNotExist:
@@ -495,7 +691,8 @@ def sort_active_collections(client_id):
     except Exception as e:
         logger.error(f"Exception occurred while sorting active collections: {str(e)}")
     finally:
-        if isinstance(history_entry, History):
+        # once triggered, the entry is settled as the collections' reorder jobs complete
+        if isinstance(history_entry, History) and not triggered and history_entry.status != "done":
             history_entry.status = "failed"
             history_entry.ended_at = now()
             history_entry.save()
@@ -563,4 +760,124 @@ def reset_sort_counts():
         logger.info(f"Successfully reset sort counts for {expired_usages.count()} usages.")
 
     except Exception as e:
-        logger.error(f"Exception occurred while resetting sort counts: {str(e)}")
\ No newline at end of file
+        logger.error(f"Exception occurred while resetting sort counts: {str(e)}")
+
+
+@shared_task
+def async_prune_order_rollups():
+    try:
+        retention_days = apps.get_app_config("shopify_app").ORDER_ROLLUP_RETENTION_DAYS
+        deleted = prune_order_rollups(retention_days)
+        logger.info(f"Pruned {deleted} daily order rollups older than {retention_days} days")
+    except Exception as e:
+        logger.error(f"Exception occurred while pruning order rollups: {str(e)}")
+
+
+@shared_task
+def async_meter_shop_orders(shop_id):
+    try:
+        client = Client.objects.get(shop_id=shop_id)
+        this_month = now().date().replace(day=1)
+        last_month = (this_month - timedelta(days=1)).replace(day=1)
+
+        # last month is final once counted after it ended
+        last_month_count = ShopOrderCount.objects.filter(shop_id=shop_id, month=last_month).first()
+        if not last_month_count or not last_month_count.counted_at or last_month_count.counted_at.date() <= this_month:
+            meter_shop_orders(client, last_month)
+        meter_shop_orders(client, this_month)
+
+        logger.info(f"Metered orders of shop_id {shop_id}")
+    except Client.DoesNotExist:
+        logger.error(f"Client not found for shop_id {shop_id}")
+    except Exception as e:
+        logger.error(f"Exception occurred while metering orders of shop_id {shop_id}: {str(e)}")
+
+
+@shared_task
+def meter_all_shops_orders():
+    for shop_id in Client.objects.filter(is_active=True).values_list("shop_id", flat=True):
+        async_meter_shop_orders.delay(shop_id)
+
+
+@shared_task
+def async_apply_product_webhook(shop_id, payload):
+    try:
+        client = Client.objects.get(shop_id=shop_id)
+        patched = apply_product_update(client, payload)
+        logger.info(f"products/update webhook patched {patched} products for shop_id {shop_id}")
+    except Exception as e:
+        logger.error(f"Exception occurred while applying products/update for shop_id {shop_id}: {str(e)}")
+
+
+@shared_task
+def async_apply_inventory_webhook(shop_id, payload):
+    try:
+        client = Client.objects.get(shop_id=shop_id)
+        patched = apply_inventory_level_update(client, payload)
+        logger.info(f"inventory_levels/update webhook patched {patched} products for shop_id {shop_id}")
+    except Exception as e:
+        logger.error(f"Exception occurred while applying inventory_levels/update for shop_id {shop_id}: {str(e)}")
+
+
+@shared_task
+def async_apply_order_webhook(shop_id, payload):
+    try:
+        client = Client.objects.get(shop_id=shop_id)
+        patched = apply_order_create(shop_id, payload)
+        # the cached order history no longer holds every order of the window
+        invalidate_shop_orders(client.shop_url)
+        logger.info(f"orders/create webhook patched {patched} products for shop_id {shop_id}")
+    except Exception as e:
+        logger.error(f"Exception occurred while applying orders/create for shop_id {shop_id}: {str(e)}")
+
+
+@shared_task
+def async_poll_reorder_jobs():
+    try:
+        settled = poll_reorder_jobs()
+        if settled:
+            logger.info(f"Settled {settled} collection reorders")
+    except Exception as e:
+        logger.error(f"Exception occurred while polling reorder jobs: {str(e)}")
+
+
+@shared_task
+def async_sync_inventory_levels(shop_id):
+    try:
+        client = Client.objects.get(shop_id=shop_id)
+        cached = sync_inventory_levels(client)
+        if cached is None:
+            logger.error(f"Could not read the locations of shop_id {shop_id}")
+        else:
+            logger.info(f"Cached location inventory of {cached} variants for shop_id {shop_id}")
+    except Client.DoesNotExist:
+        logger.error(f"Client not found for shop_id {shop_id}")
+    except Exception as e:
+        logger.error(f"Exception occurred while syncing inventory levels of shop_id {shop_id}: {str(e)}")
+
+
+@shared_task
+def sync_all_shops_inventory():
+    # with every location counted, the fetched totalInventory is already right
+    shop_ids = Client.objects.filter(is_active=True).exclude(stock_location='all').values_list("shop_id", flat=True)
+    for shop_id in shop_ids:
+        async_sync_inventory_levels.delay(shop_id)
+
+
+@shared_task
+def async_apply_location_inventory(shop_id):
+    """
+    Recounts the stored inventory after a stock_location change, from the
+    location inventory cache, or fills the cache first if the shop has none.
+    """
+    try:
+        client = Client.objects.get(shop_id=shop_id)
+        if not VariantInventory.objects.filter(shop_id=shop_id).exists():
+            async_sync_inventory_levels(shop_id)
+            return
+        updated = apply_location_inventory(client)
+        logger.info(f"Location inventory ({client.stock_location}) updated {updated} products for shop_id {shop_id}")
+    except Client.DoesNotExist:
+        logger.error(f"Client not found for shop_id {shop_id}")
+    except Exception as e:
+        logger.error(f"Exception occurred while applying location inventory of shop_id {shop_id}: {str(e)}")
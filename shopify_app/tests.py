@@ -0,0 +1,171 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.apps import apps
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .api import product_selection, PRODUCT_FIELD_SELECTIONS
+from .bulk import run_bulk_query, iter_jsonl, iter_bulk_objects, fetch_bulk_collection_products, fetch_bulk_orders
+from .fixture_server import FixtureShop, make_server, serve_in_thread, COLLECTION_ID_BASE
+from .models import Client
+from .webhooks import sign_webhook
+
+# the bulk lock and the webhook ids live on Redis aliases in production
+LOCAL_CACHES = {
+    alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": alias}
+    for alias in ("default", "orders", "shopify")
+}
+
+SHOP_URL = "fixture-shop.myshopify.com"
+HEADERS = {"Content-Type": "application/json", "X-Shopify-Access-Token": "fixture"}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class BulkOperationTests(SimpleTestCase):
+    """
+    Runs the bulk operation client against the local fixture server, which serves
+    the JSONL result with nested rows flattened after their parent.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.shop = FixtureShop(products=60, collections=2, orders=40)
+        cls.server = make_server(cls.shop)
+        cls.config = apps.get_app_config("shopify_app")
+        cls.saved_base_url = cls.config.SHOPIFY_BASE_URL
+        cls.config.SHOPIFY_BASE_URL = serve_in_thread(cls.server)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.config.SHOPIFY_BASE_URL = cls.saved_base_url
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        patcher = mock.patch("shopify_app.bulk.BULK_POLL_INTERVAL", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_run_bulk_query_serves_the_jsonl_result(self):
+        url = run_bulk_query(SHOP_URL, HEADERS, "{ collections { edges { node { id title } } } }")
+
+        rows = list(iter_jsonl(url))
+        self.assertEqual([row["id"] for row in rows], [collection["id"] for collection in self.shop.collections])
+
+    def test_empty_result_has_no_url(self):
+        url = run_bulk_query(
+            SHOP_URL, HEADERS, '{ collection(id: "gid://shopify/Collection/1") { products { edges { node { id } } } } }'
+        )
+
+        self.assertIsNone(url)
+        self.assertEqual(list(iter_jsonl(url)), [])
+
+    def test_iter_bulk_objects_reattaches_child_rows(self):
+        url = run_bulk_query(SHOP_URL, HEADERS, "{ productVariants { edges { node { id } } } }")
+
+        variants = list(iter_bulk_objects(iter_jsonl(url), "ProductVariant"))
+        expected = self.shop.variant_levels()
+        self.assertEqual([variant["id"] for variant, _ in variants], [variant["id"] for variant in expected])
+        for (variant, levels), stored in zip(variants, expected):
+            self.assertEqual(
+                [level["location"] for level in levels],
+                [edge["node"]["location"] for edge in stored["inventoryItem"]["inventoryLevels"]["edges"]],
+            )
+
+    def test_collection_products_get_their_variants_back(self):
+        collection_id = f"gid://shopify/Collection/{COLLECTION_ID_BASE}"
+        selection = product_selection(list(PRODUCT_FIELD_SELECTIONS), bulk=True)
+
+        products = list(fetch_bulk_collection_products(SHOP_URL, HEADERS, COLLECTION_ID_BASE, selection))
+
+        expected = self.shop.collection_products[collection_id]
+        self.assertEqual([product["id"] for product in products], [product["id"] for product in expected])
+        for product, stored in zip(products, expected):
+            self.assertEqual(product["images"], stored["images"])
+            self.assertEqual(
+                [edge["node"]["id"] for edge in product["variants"]["edges"]],
+                [edge["node"]["id"] for edge in stored["variants"]["edges"]],
+            )
+
+    def test_orders_get_their_line_items_back(self):
+        end_date = timezone.now() + timedelta(minutes=1)
+
+        orders = list(fetch_bulk_orders(SHOP_URL, HEADERS, end_date - timedelta(days=60), end_date))
+
+        self.assertEqual(len(orders), len(self.shop.orders))
+        for (created_at, line_items), stored in zip(orders, self.shop.orders):
+            self.assertEqual(created_at, stored["createdAt"])
+            self.assertEqual(
+                [(product_id, quantity) for product_id, quantity, _ in line_items],
+                [(edge["node"]["product"]["id"], edge["node"]["quantity"]) for edge in stored["lineItems"]["edges"]],
+            )
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CatalogWebhookTests(TestCase):
+    """
+    The catalog webhook receivers only queue payloads signed with the app secret.
+    """
+
+    def setUp(self):
+        self.shop = Client.objects.create(
+            shop_id="webhook-shop",
+            shop_name="webhook-shop",
+            email="webhook-shop@example.com",
+            shop_url=SHOP_URL,
+            access_token="fixture",
+        )
+        patcher = mock.patch.object(apps.get_app_config("shopify_app"), "SHOPIFY_API_SECRET", "test-secret")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.body = json.dumps({"id": 9000000000, "title": "Fixture product"}).encode("utf-8")
+
+    def _post(self, body, signature, webhook_id="1"):
+        return self.client.post(
+            reverse("products-update"),
+            data=body,
+            content_type="application/json",
+            HTTP_X_SHOPIFY_HMAC_SHA256=signature,
+            HTTP_X_SHOPIFY_SHOP_DOMAIN=SHOP_URL,
+            HTTP_X_SHOPIFY_TOPIC="products/update",
+            HTTP_X_SHOPIFY_WEBHOOK_ID=webhook_id,
+        )
+
+    def test_signed_payload_is_queued(self):
+        with mock.patch("shopify_app.views.async_apply_product_webhook.delay") as delay:
+            response = self._post(self.body, sign_webhook(self.body))
+
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once_with(self.shop.shop_id, json.loads(self.body))
+
+    def test_tampered_payload_is_rejected(self):
+        tampered = self.body.replace(b"Fixture product", b"Tampered product")
+
+        with mock.patch("shopify_app.views.async_apply_product_webhook.delay") as delay:
+            response = self._post(tampered, sign_webhook(self.body))
+
+        self.assertEqual(response.status_code, 403)
+        delay.assert_not_called()
+
+    def test_redelivery_is_skipped(self):
+        with mock.patch("shopify_app.views.async_apply_product_webhook.delay") as delay:
+            self._post(self.body, sign_webhook(self.body))
+            response = self._post(self.body, sign_webhook(self.body))
+
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once()
+
+    def test_retry_after_a_failed_enqueue_is_queued(self):
+        with mock.patch("shopify_app.views.async_apply_product_webhook.delay", side_effect=ConnectionError("broker down")):
+            response = self._post(self.body, sign_webhook(self.body))
+        self.assertEqual(response.status_code, 503)
+
+        with mock.patch("shopify_app.views.async_apply_product_webhook.delay") as delay:
+            response = self._post(self.body, sign_webhook(self.body))
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once()
@@ -0,0 +1,171 @@
+import hashlib
+import redis
+from django.conf import settings
+
+import logging
+logger = logging.getLogger(__name__)
+
+#####################################################################################################
+# GraphQL cost governor: one leaky bucket per shop in Redis, shared by every Celery worker, fed
+# with the cost Shopify reports in `extensions.cost` of each response
+#####################################################################################################
+
+DEFAULT_MAXIMUM_AVAILABLE = 1000
+DEFAULT_RESTORE_RATE = 50
+DEFAULT_QUERY_COST = 50
+THROTTLE_MAX_RETRIES = 5
+BUCKET_TTL = 60 * 60
+
+# Takes `cost` points from the shop's bucket after restoring what leaked back
+# since the last update. Returns 0 when the points were taken, otherwise the
+# seconds to wait before they will be available.
+ACQUIRE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'available', 'maximum', 'restore_rate', 'updated_at')
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local maximum = tonumber(state[2]) or tonumber(ARGV[2])
+local rate = tonumber(state[3]) or tonumber(ARGV[3])
+local available = tonumber(state[1]) or maximum
+local updated = tonumber(state[4]) or now
+available = math.min(maximum, available + (now - updated) * rate)
+local cost = math.min(tonumber(ARGV[1]), maximum)
+local wait = 0
+if available >= cost then
+    available = available - cost
+else
+    wait = (cost - available) / rate
+end
+redis.call('HSET', KEYS[1], 'available', available, 'maximum', maximum, 'restore_rate', rate, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(wait)
+"""
+
+# Replaces the bucket with the throttle status Shopify reported.
+RECONCILE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+redis.call('HSET', KEYS[1], 'available', ARGV[1], 'maximum', ARGV[2], 'restore_rate', ARGV[3], 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+_redis = None
+_acquire = None
+_reconcile = None
+_query_costs = {}
+
+
+def _scripts():
+    global _redis, _acquire, _reconcile
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.SHOPIFY_THROTTLE_REDIS_URL)
+        _acquire = _redis.register_script(ACQUIRE_SCRIPT)
+        _reconcile = _redis.register_script(RECONCILE_SCRIPT)
+    return _acquire, _reconcile
+
+
+def _bucket_key(shop_url):
+    return f"shopify_throttle:{shop_url}"
+
+
+def _query_key(query):
+    return hashlib.md5(query.encode("utf-8")).hexdigest()
+
+
+def reserve(shop_url, query):
+    """
+    Takes the expected cost of `query` from the shop's bucket.
+
+    The expected cost is the requestedQueryCost Shopify reported the last time
+    this process sent the same query.
+
+    Returns:
+        float: Seconds to wait before sending the query, 0 to send it now. If
+        Redis is unreachable the governor is skipped and 0 is returned.
+    """
+    cost = _query_costs.get(_query_key(query), DEFAULT_QUERY_COST)
+    try:
+        acquire, _ = _scripts()
+        wait = float(acquire(
+            keys=[_bucket_key(shop_url)],
+            args=[cost, DEFAULT_MAXIMUM_AVAILABLE, DEFAULT_RESTORE_RATE, BUCKET_TTL],
+        ))
+    except redis.RedisError as e:
+        logger.warning(f"Throttle governor unavailable, sending without pacing: {str(e)}")
+        return 0
+    if wait:
+        logger.debug(f"throttle: {shop_url} waits {wait:.2f}s for {cost} points")
+    return wait
+
+
+def concurrency_limit(shop_url, queries, limit):
+    """
+    How many of `queries` the shop's bucket can hold in flight at once: its
+    maximum available points over the largest expected query cost, between 1
+    and `limit`. Requests beyond it would only wait in reserve.
+    """
+    cost = max((_query_costs.get(_query_key(query), DEFAULT_QUERY_COST) for query in queries), default=DEFAULT_QUERY_COST)
+    try:
+        _scripts()
+        maximum = float(_redis.hget(_bucket_key(shop_url), "maximum") or DEFAULT_MAXIMUM_AVAILABLE)
+    except redis.RedisError as e:
+        logger.warning(f"Throttle governor unavailable, assuming the default bucket: {str(e)}")
+        maximum = DEFAULT_MAXIMUM_AVAILABLE
+    return max(1, min(limit, int(maximum // max(cost, 1))))
+
+
+def record(shop_url, query, body):
+    """
+    Updates the shop's bucket and the query's expected cost from the
+    `extensions.cost` of a decoded GraphQL response.
+    """
+    cost = (body or {}).get("extensions", {}).get("cost")
+    if not cost:
+        return
+
+    if cost.get("requestedQueryCost") is not None:
+        _query_costs[_query_key(query)] = cost["requestedQueryCost"]
+
+    throttle_status = cost.get("throttleStatus")
+    if not throttle_status:
+        return
+    try:
+        _, reconcile = _scripts()
+        reconcile(
+            keys=[_bucket_key(shop_url)],
+            args=[
+                throttle_status["currentlyAvailable"],
+                throttle_status["maximumAvailable"],
+                throttle_status["restoreRate"],
+                BUCKET_TTL,
+            ],
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Throttle governor unavailable, cost not recorded: {str(e)}")
+
+
+def is_throttled(status_code, body):
+    """
+    Whether Shopify rejected the request for exceeding the shop's cost budget.
+    """
+    if status_code == 429:
+        return True
+    errors = (body or {}).get("errors")
+    if not isinstance(errors, list):
+        return False
+    return any(error.get("extensions", {}).get("code") == "THROTTLED" for error in errors)
+
+
+def retry_delay(shop_url, query, body, attempt):
+    """
+    Seconds to back off before retrying a throttled request: the time the
+    bucket needs to refill for the query, doubled on every further attempt.
+    """
+    cost = (body or {}).get("extensions", {}).get("cost", {})
+    throttle_status = cost.get("throttleStatus")
+    if throttle_status:
+        missing = cost.get("requestedQueryCost", DEFAULT_QUERY_COST) - throttle_status["currentlyAvailable"]
+        delay = max(missing, 0) / throttle_status["restoreRate"]
+    else:
+        delay = 1
+    return max(delay, 0.5) * (2 ** attempt)
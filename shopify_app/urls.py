@@ -16,6 +16,11 @@ urlpatterns = [
     path('webhooks/customer-data-erasure/', customer_data_erasure, name='customer-data-erasure'),
     path('webhooks/shop-data-erasure/', shop_data_erasure, name='shop-data-erasure'),
 
+    # catalog webhooks, see webhooks.CATALOG_WEBHOOKS
+    path('webhooks/products-update/', views.product_update_webhook, name='products-update'),
+    path('webhooks/inventory-levels-update/', views.inventory_level_update_webhook, name='inventory-levels-update'),
+    path('webhooks/orders-create/', views.order_create_webhook, name='orders-create'),
+
     # FAQs
     path('faqs/', faq_list, name='faq_list'),
     path('test-mongodb/', test_mongodb_connection,name='test_mongo'),
@@ -15,6 +15,11 @@ from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.permissions import AllowAny
 from .models import Client, ClientCollections, ClientProducts
+from .webhooks import verify_webhook, first_delivery, forget_delivery, register_catalog_webhooks
+from .client import missing_scopes
+from .tasks import async_apply_product_webhook, async_apply_inventory_webhook, async_apply_order_webhook
+from django.views.decorators.csrf import csrf_exempt
+import json
 import os
 import requests
 from django.conf import settings
@@ -133,6 +138,7 @@ def finalize(request):
         }
         logger.debug(f"finalization for shop url {shop_url}, registering of shop_url")
         register_app_uninstall_webhook(shop_url, access_token)
+        register_catalog_webhooks(shop_url, access_token)
 
         return redirect('root_path')
 
@@ -220,7 +226,13 @@ def check_scopes(request):
             logger.debug(f"Received response from Shopify: {response_data}")
 
             if response.status_code == 200:
-                return JsonResponse({"scopes": response_data.get("access_scopes", [])}, status=200)
+                scopes = [scope["handle"] for scope in response_data.get("access_scopes", [])]
+                # scopes added to the app since the shop installed it, granted by logging in again
+                missing = missing_scopes(scopes, apps.get_app_config('shopify_app').SHOPIFY_API_SCOPE)
+                return JsonResponse(
+                    {"scopes": response_data.get("access_scopes", []), "missing_scopes": missing, "reauthorize": bool(missing)},
+                    status=200,
+                )
             else:
                 logger.error(f"Error response from Shopify: {response_data}")
                 return JsonResponse({"error": response_data}, status=response.status_code)
@@ -321,3 +333,56 @@ def shop_data_erasure(request):
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)    
 
 
+# catalog webhooks
+def _receive_catalog_webhook(request, task):
+    if not verify_webhook(request):
+        logger.error("Invalid HMAC signature for webhook.")
+        return Response({"error": "Unauthorized webhook"}, status=status.HTTP_403_FORBIDDEN)
+
+    topic = request.headers.get("X-Shopify-Topic")
+    shop_url = request.headers.get("X-Shopify-Shop-Domain")
+    try:
+        client = Client.objects.get(shop_url=shop_url)
+    except Client.DoesNotExist:
+        logger.warning(f"{topic} webhook for unknown shop: {shop_url}")
+        return Response({"error": "Client not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        logger.error(f"Unreadable {topic} webhook body from {shop_url}")
+        return Response({"error": "Invalid JSON"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not first_delivery(request):
+        logger.debug(f"Skipping redelivered {topic} webhook")
+        return Response({"message": "Already received"}, status=status.HTTP_200_OK)
+
+    # Shopify expects an answer within seconds, the patch runs on a worker
+    try:
+        task.delay(client.shop_id, payload)
+    except Exception as e:
+        # not queued: let Shopify's retry through instead of answering it as already received
+        forget_delivery(request)
+        logger.error(f"Could not queue {topic} webhook for shop_url {shop_url}: {str(e)}")
+        return Response({"error": "Webhook not queued"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    logger.info(f"{topic} webhook queued for shop_url: {shop_url}")
+    return Response({"message": "Webhook received"}, status=status.HTTP_200_OK)
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def product_update_webhook(request):
+    return _receive_catalog_webhook(request, async_apply_product_webhook)
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def inventory_level_update_webhook(request):
+    return _receive_catalog_webhook(request, async_apply_inventory_webhook)
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def order_create_webhook(request):
+    return _receive_catalog_webhook(request, async_apply_order_webhook)
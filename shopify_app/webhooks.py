@@ -0,0 +1,285 @@
+import hmac, base64, hashlib
+import os
+from decimal import Decimal
+from django.apps import apps
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+from django.db.models import F
+from .models import ClientCollections, ClientProducts
+from .client import shopify_graphql, granted_scopes, missing_scopes
+from .inventory import apply_level_update, apply_location_inventory
+
+import logging
+logger = logging.getLogger(__name__)
+
+# shared by all workers, see CACHES in settings
+shared_cache = ConnectionProxy(caches, "shopify")
+
+#####################################################################################################
+# catalog webhooks: products/update, inventory_levels/update and orders/create patch the stored
+# products in place instead of waiting for the next full product refetch
+#####################################################################################################
+
+# topic -> path of the receiver under /auth/
+CATALOG_WEBHOOKS = {
+    "PRODUCTS_UPDATE": "webhooks/products-update/",
+    "INVENTORY_LEVELS_UPDATE": "webhooks/inventory-levels-update/",
+    "ORDERS_CREATE": "webhooks/orders-create/",
+}
+
+# topic -> access scopes Shopify requires to subscribe to it
+CATALOG_WEBHOOK_SCOPES = {
+    "PRODUCTS_UPDATE": ("read_products",),
+    "INVENTORY_LEVELS_UPDATE": ("read_inventory",),
+    "ORDERS_CREATE": ("read_orders",),
+}
+
+WEBHOOK_DEDUP_TTL = 60 * 60 * 24
+
+
+def sign_webhook(body, secret=None):
+    """
+    Signs a raw webhook body the way Shopify does, base64 of its HMAC-SHA256 with
+    the app secret. Also used to sign payloads locally, see send_test_webhook.
+    """
+    secret = secret or apps.get_app_config("shopify_app").SHOPIFY_API_SECRET
+    return base64.b64encode(hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()).decode("utf-8")
+
+
+def verify_webhook(request):
+    """
+    Whether the request carries a valid X-Shopify-Hmac-SHA256 signature of its body.
+    """
+    shopify_hmac = request.headers.get("X-Shopify-Hmac-SHA256")
+    if not shopify_hmac:
+        logger.error("Missing HMAC header in webhook request")
+        return False
+    return hmac.compare_digest(sign_webhook(request.body), shopify_hmac)
+
+
+def first_delivery(request):
+    """
+    Shopify delivers a webhook at least once; returns False for a redelivery of a
+    webhook id already received.
+    """
+    webhook_id = request.headers.get("X-Shopify-Webhook-Id")
+    if not webhook_id:
+        return True
+    return shared_cache.add(f"shopify_webhook:{webhook_id}", 1, WEBHOOK_DEDUP_TTL)
+
+
+def forget_delivery(request):
+    """
+    Releases the webhook id claimed by first_delivery, so Shopify's retry of a
+    webhook that could not be queued is processed instead of skipped.
+    """
+    webhook_id = request.headers.get("X-Shopify-Webhook-Id")
+    if webhook_id:
+        shared_cache.delete(f"shopify_webhook:{webhook_id}")
+
+
+def register_catalog_webhooks(shop_url, access_token):
+    base_url = os.getenv("BACKEND_URL")
+    if not base_url:
+        logger.error("BASE_URL is not set in environment variables.")
+        return
+
+    headers = {
+        "Content-Type": "application/json",
+        "X-Shopify-Access-Token": access_token,
+    }
+    query = """
+    mutation webhookSubscriptionCreate($topic: WebhookSubscriptionTopic!, $callbackUrl: URL!) {
+        webhookSubscriptionCreate(topic: $topic, webhookSubscription: {callbackUrl: $callbackUrl, format: JSON}) {
+            userErrors {
+                field
+                message
+            }
+            webhookSubscription {
+                id
+            }
+        }
+    }
+    """
+    granted = granted_scopes(shop_url, headers)
+    for topic, path in CATALOG_WEBHOOKS.items():
+        missing = missing_scopes(granted, CATALOG_WEBHOOK_SCOPES[topic]) if granted is not None else []
+        if missing:
+            # registered on the next login, once the merchant has granted the scope
+            logger.warning(f"Not registering {topic} webhook for {shop_url}, missing scopes: {', '.join(missing)}")
+            continue
+
+        variables = {"topic": topic, "callbackUrl": f"{base_url}/auth/{path}"}
+        data = shopify_graphql(shop_url, headers, query, variables).json()
+
+        if data.get("data") and not data["data"]["webhookSubscriptionCreate"]["userErrors"]:
+            logger.info(f"Successfully registered {topic} webhook.")
+        else:
+            logger.error(f"Failed to register {topic} webhook: {data}")
+
+
+def _mark_collections_dirty(collection_ids):
+    return ClientCollections.objects.filter(collection_id__in=collection_ids).update(refetch=True)
+
+
+def apply_product_update(client, payload):
+    """
+    Patches the stored rows of a product from a products/update payload.
+
+    A tag change can move the product in or out of smart collections, so those
+    are marked for refetch along with the product's own collection. The payload's
+    inventory counts every location, so shops counting only some of them get it
+    recounted from the location inventory cache.
+
+    Returns:
+        int: Number of ClientProducts rows patched, 0 if the product is not stored.
+    """
+    shop_id = client.shop_id
+    product_id = str(payload["id"])
+    rows = ClientProducts.objects.filter(shop_id=shop_id, product_id=product_id)
+    stored = rows.values("collection_id", "tags").first()
+    if not stored:
+        return 0
+
+    variants = payload.get("variants") or []
+    tags = [tag.strip() for tag in (payload.get("tags") or "").split(",") if tag.strip()]
+    image = payload.get("image") or {}
+
+    discount_percentage = 0.0
+    discount_absolute = 0.0
+    for variant in variants:
+        price = float(variant["price"])
+        compare_at_price = float(variant.get("compare_at_price") or 0)
+        discount_absolute = compare_at_price - price
+        if compare_at_price > price:
+            discount_percentage = ((compare_at_price - price) / compare_at_price) * 100
+            break
+
+    inventory = sum(variant.get("inventory_quantity") or 0 for variant in variants)
+    patched = rows.update(
+        product_name=payload.get("title", ""),
+        image_link=image.get("src"),
+        tags=tags,
+        updated_at=payload.get("updated_at"),
+        published_at=payload.get("published_at"),
+        variant_count=len(variants),
+        variant_availability=inventory,
+        total_inventory=inventory,
+        discount_absolute=discount_absolute,
+        discount_percentage=discount_percentage,
+    )
+    if client.stock_location != "all":
+        apply_location_inventory(client, [product_id])
+
+    dirty = ClientCollections.objects.filter(collection_id=stored["collection_id"])
+    if set(stored["tags"] or []) != set(tags):
+        dirty = dirty | ClientCollections.objects.filter(shop_id=shop_id, is_smart=True)
+    dirty.update(refetch=True)
+
+    logger.debug(f"products/update patched product {product_id} of shop {shop_id}")
+    return patched
+
+
+def apply_inventory_level_update(client, payload):
+    """
+    Refreshes the inventory of the product whose inventory item changed, from an
+    inventory_levels/update payload. A variant in the location inventory cache is
+    patched in place and counted for the client's stock_location; otherwise the
+    payload only names the inventory item, so the product's current inventory is
+    read back in one small query.
+
+    Returns:
+        int: Number of ClientProducts rows patched.
+    """
+    product_id = apply_level_update(client, payload["inventory_item_id"], payload["location_id"], payload.get("available"))
+    if product_id:
+        _mark_collections_dirty(
+            ClientProducts.objects.filter(shop_id=client.shop_id, product_id=product_id).values_list("collection_id", flat=True)
+        )
+        logger.debug(f"inventory_levels/update patched cached levels of product {product_id} of shop {client.shop_id}")
+        return 1
+
+    headers = {"Content-Type": "application/json", "X-Shopify-Access-Token": client.access_token}
+    query = """
+    query($id: ID!) {
+        inventoryItem(id: $id) {
+            variant {
+                product {
+                    id
+                    totalInventory
+                    variants(first: 100) {
+                        edges {
+                            node {
+                                inventoryQuantity
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+    """
+    variables = {"id": f"gid://shopify/InventoryItem/{payload['inventory_item_id']}"}
+    response = shopify_graphql(client.shop_url, headers, query, variables)
+    if response.status_code != 200:
+        logger.error(f"Error reading inventory item: {response.status_code} - {response.text}")
+        return 0
+
+    inventory_item = (response.json().get("data") or {}).get("inventoryItem") or {}
+    product = (inventory_item.get("variant") or {}).get("product")
+    if not product:
+        return 0
+
+    product_id = product["id"].split("/")[-1]
+    rows = ClientProducts.objects.filter(shop_id=client.shop_id, product_id=product_id)
+    collection_ids = list(rows.values_list("collection_id", flat=True))
+    patched = rows.update(
+        total_inventory=product["totalInventory"],
+        variant_availability=sum(
+            variant["node"]["inventoryQuantity"] or 0 for variant in product["variants"]["edges"]
+        ),
+    )
+    _mark_collections_dirty(collection_ids)
+
+    logger.debug(f"inventory_levels/update patched product {product_id} of shop {client.shop_id}")
+    return patched
+
+
+def apply_order_create(shop_id, payload):
+    """
+    Adds a new order's line items to the revenue and units of the stored products
+    and their collections, so revenue and sales rules see it before the next refetch.
+
+    Returns:
+        int: Number of ClientProducts rows patched.
+    """
+    totals = {}
+    for line_item in payload.get("line_items") or []:
+        if not line_item.get("product_id"):
+            continue
+        product_id = str(line_item["product_id"])
+        quantity = int(line_item["quantity"])
+        revenue, units = totals.get(product_id, (0, 0))
+        totals[product_id] = (revenue + float(line_item["price"]) * quantity, units + quantity)
+
+    patched = 0
+    collection_totals = {}
+    for product_id, (revenue, units) in totals.items():
+        rows = ClientProducts.objects.filter(shop_id=shop_id, product_id=product_id)
+        for collection_id in rows.values_list("collection_id", flat=True):
+            collection_revenue, collection_units = collection_totals.get(collection_id, (0, 0))
+            collection_totals[collection_id] = (collection_revenue + revenue, collection_units + units)
+        patched += rows.update(
+            total_revenue=F("total_revenue") + Decimal(str(round(revenue, 2))),
+            total_sold_units=F("total_sold_units") + units,
+        )
+
+    for collection_id, (revenue, units) in collection_totals.items():
+        ClientCollections.objects.filter(collection_id=collection_id).update(
+            collection_total_revenue=F("collection_total_revenue") + Decimal(str(round(revenue, 2))),
+            collection_sold_units=F("collection_sold_units") + units,
+            refetch=True,
+        )
+
+    logger.debug(f"orders/create patched {patched} products of shop {shop_id}")
+    return patched
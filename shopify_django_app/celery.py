@@ -23,5 +23,21 @@ app.conf.beat_schedule = {
         'task': 'shopify_app.tasks.reset_sort_counts',  
         'schedule': crontab(hour=0, minute=0),  
     },
+    'prune-order-rollups-every-day': {
+        'task': 'shopify_app.tasks.async_prune_order_rollups',
+        'schedule': crontab(hour=1, minute=0),
+    },
+    'meter-shop-orders-every-day': {
+        'task': 'shopify_app.tasks.meter_all_shops_orders',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    'poll-reorder-jobs': {
+        'task': 'shopify_app.tasks.async_poll_reorder_jobs',
+        'schedule': 15.0,
+    },
+    'sync-inventory-levels-every-day': {
+        'task': 'shopify_app.tasks.sync_all_shops_inventory',
+        'schedule': crontab(hour=3, minute=0),
+    },
 }
 
@@ -147,6 +147,31 @@ CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_CACHE_BACKEND = 'django-cache'
 
+CACHES = {
+    # Django's default, also the Celery cache backend above
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # the shop order cache and the order metrics derived from it
+    'orders': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_CACHE_URL', 'redis://redis:6379/1'),
+        'KEY_PREFIX': 'orders',
+    },
+    # state every worker must see: bulk operation locks and received webhook ids
+    'shopify': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_CACHE_URL', 'redis://redis:6379/1'),
+        'KEY_PREFIX': 'shopify',
+    },
+}
+
+# seconds a shop's downloaded orders are shared between collection refreshes
+ORDER_CACHE_TTL = int(os.environ.get('ORDER_CACHE_TTL', 60 * 60))
+
+# per-shop GraphQL cost buckets shared by all Celery workers
+SHOPIFY_THROTTLE_REDIS_URL = os.environ.get('SHOPIFY_THROTTLE_REDIS_URL', 'redis://redis:6379/2')
+
 ######## for mroe security #####################
 X_FRAME_OPTIONS = 'DENY'
 